@@ -0,0 +1,61 @@
+"""
+Compares the iterative and recursive transpiler engines on deeply nested synthetic MathML and on
+the Noble 1962 model.
+
+Usage (from the repository root): python -m benchmarks.engines
+"""
+import os
+import sys
+import time
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy.backends import ElementTreeBackend
+
+from . import synthetic
+
+
+NOBLE_MODEL = os.path.join(os.path.dirname(__file__), '..', 'tests', 'noble_model_1962.cellml')
+
+
+def best_time(function, repeats=3):
+    """
+    Returns the best wall-clock time of `repeats` calls to function, in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_engines(math_element, repeats=3):
+    """
+    Returns the best times of the iterative and recursive engine on a parsed <math> element
+    """
+    return tuple(best_time(lambda: mathml2sympy.parse_dom(math_element, engine=engine), repeats)
+                 for engine in ('iterative', 'recursive'))
+
+
+def main():
+    # The recursive engine needs several frames per level of nesting
+    sys.setrecursionlimit(100000)
+
+    print('%-22s %12s %12s %8s' % ('input', 'iterative/s', 'recursive/s', 'ratio'))
+    for depth in (1000, 2000, 5000, 10000):
+        math_element = ElementTreeBackend.parse_string(synthetic.nested_apply(depth))
+        iterative, recursive = time_engines(math_element)
+        print('%-22s %12.4f %12.4f %8.2f'
+              % ('nested depth %d' % depth, iterative, recursive, recursive / iterative))
+
+    def parse_noble(engine):
+        for _ in mathml2sympy.parse_file(NOBLE_MODEL, backend='etree', engine=engine):
+            pass
+    iterative = best_time(lambda: parse_noble('iterative'), 5)
+    recursive = best_time(lambda: parse_noble('recursive'), 5)
+    print('%-22s %12.4f %12.4f %8.2f'
+          % ('noble_model_1962', iterative, recursive, recursive / iterative))
+
+
+if __name__ == '__main__':
+    main()
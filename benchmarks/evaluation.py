@@ -0,0 +1,55 @@
+"""
+Compares transpiling with SymPy's automatic evaluation against evaluate=False (with and without
+the final canonicalization pass) on the Noble 1962 model and on synthetic nested MathML.
+
+Usage (from the repository root): python -m benchmarks.evaluation
+"""
+import os
+from xml.etree import ElementTree
+
+from sympy.core.cache import clear_cache
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy.backends import ElementTreeBackend
+
+from . import synthetic
+from .engines import best_time
+
+
+NOBLE_MODEL = os.path.join(os.path.dirname(__file__), '..', 'tests', 'noble_model_1962.cellml')
+
+MODES = [
+    ('evaluate', {}),
+    ('unevaluated', {'evaluate': False}),
+    ('canonicalized', {'evaluate': False, 'canonicalize': True}),
+]
+
+
+def main():
+    # Parse the XML up front, so that only transpiling is timed
+    inputs = [('noble_model_1962', math_elements(NOBLE_MODEL))]
+    for depth in (1000, 5000):
+        inputs.append(('nested depth %d' % depth,
+                       [ElementTreeBackend.parse_string(synthetic.nested_apply(depth))]))
+
+    print('%-20s' % 'input' + ''.join('%15s' % name for name, _ in MODES))
+    for input_name, elements in inputs:
+        def transpile_all(options):
+            # Start from a cold SymPy cache, as when a model is first loaded
+            clear_cache()
+            for math_element in elements:
+                mathml2sympy.parse_dom(math_element, **options)
+        times = [best_time(lambda: transpile_all(options), 5) for _, options in MODES]
+        print('%-20s' % input_name + ''.join('%14.4fs' % t for t in times))
+
+
+def math_elements(path):
+    """
+    Returns the <math> elements of a CellML file, parsed with ElementTree
+    """
+    root = ElementTree.parse(path).getroot()
+    return list(root.iter('{%s}math' % synthetic.MATHML_NS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Times the startup of short-lived processes using the package: importing it, inspecting a model
+without building expressions (fingerprinting, as e.g. a diff tool does) and transpiling a model.
+Each case runs in a fresh Python process, and also reports whether SymPy was loaded.
+
+Usage (from the repository root): python -m benchmarks.startup [--repeats N]
+
+For a breakdown by module, run: python -X importtime -c 'import cellmlmanip.mathml2sympy'
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+NOBLE_MODEL = os.path.join(os.path.dirname(__file__), '..', 'tests', 'noble_model_1962.cellml')
+
+# Code run in each fresh process, by case name. The time from before the first statement to the
+# end of the last one is measured.
+CASES = [
+    ('import', 'import cellmlmanip.mathml2sympy'),
+    ('import + fingerprint', 'import cellmlmanip.mathml2sympy as m\n'
+                             'list(m.fingerprint_file(%r))' % NOBLE_MODEL),
+    ('import + parse_file', 'import cellmlmanip.mathml2sympy as m\n'
+                            'list(m.parse_file(%r))' % NOBLE_MODEL),
+    ('import sympy', 'import sympy\nsympy.Symbol'),
+]
+
+TIMER = '''import time
+start = time.perf_counter()
+%s
+elapsed = time.perf_counter() - start
+import sys
+print(elapsed, 'sympy.core' in sys.modules)
+'''
+
+
+def time_case(code):
+    """
+    Runs code in a fresh interpreter and returns (seconds taken, whether SymPy was loaded)
+    """
+    root = os.path.join(os.path.dirname(__file__), '..')
+    output = subprocess.check_output([sys.executable, '-c', TIMER % code], cwd=root)
+    elapsed, loaded = output.decode('ascii').split()
+    return float(elapsed), loaded == 'True'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='number of processes per case (the best time is reported)')
+    args = parser.parse_args(argv)
+
+    print('%-22s %10s %8s' % ('case', 'time/ms', 'sympy'))
+    for name, code in CASES:
+        runs = [time_case(code) for _ in range(args.repeats)]
+        print('%-22s %10.1f %8s' % (name, 1000 * min(t for t, _ in runs),
+                                    'loaded' if runs[0][1] else '-'))
+
+
+if __name__ == '__main__':
+    main()
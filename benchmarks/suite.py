@@ -0,0 +1,234 @@
+"""
+Times parse_string/parse_dom and records peak memory on the test models and on synthetic MathML
+of increasing size, and writes the results as JSON so that commits can be compared.
+
+Usage (from the repository root):
+
+    python -m benchmarks.suite --output before.json
+    (change something)
+    python -m benchmarks.suite --output after.json --compare before.json
+
+The synthetic inputs scale the number of equations, the nesting depth, the width of a
+<piecewise> and the number of distinct identifiers; see synthetic.py. Use --quick to leave out
+the largest sizes.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from xml.etree import ElementTree
+
+import sympy
+from sympy.core.cache import clear_cache
+
+import cellmlmanip
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy.backends import BACKENDS
+
+from . import synthetic
+from .engines import best_time
+
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'tests')
+MODELS = [
+    ('noble_model_1962', os.path.join(TESTS_DIR, 'noble_model_1962.cellml')),
+    ('test_simple_odes', os.path.join(TESTS_DIR, 'cellml_files', 'test_simple_odes.cellml')),
+]
+
+# Sizes of the synthetic inputs, by name of the size parameter. The last size of each is left out
+# with --quick.
+SIZES = {
+    'equations': [100, 1000, 10000],
+    'depth': [100, 1000, 5000],
+    'piecewise_width': [10, 100, 1000],
+    'identifiers': [10, 100, 1000, 2000],
+}
+
+# Number of equations in the inputs that vary the number of identifiers
+IDENTIFIER_EQUATIONS = 500
+
+
+def synthetic_inputs(quick=False):
+    """
+    Yields (group, size, MathML string) tuples for the synthetic inputs
+    """
+    generators = {
+        'equations': synthetic.many_equations,
+        'depth': synthetic.nested_apply,
+        'piecewise_width': synthetic.wide_piecewise,
+        'identifiers': lambda size: synthetic.many_equations(IDENTIFIER_EQUATIONS, size),
+    }
+    for group, sizes in SIZES.items():
+        for size in sizes[:-1] if quick else sizes:
+            yield group, size, generators[group](size)
+
+
+def model_blocks(path):
+    """
+    Returns the <math> blocks of a CellML file, each serialised as a MathML string
+    """
+    root = ElementTree.parse(path).getroot()
+    return [ElementTree.tostring(element, encoding='unicode')
+            for element in root.iter('{%s}math' % synthetic.MATHML_NS)]
+
+
+def peak_memory(function):
+    """
+    Returns the peak memory allocated by Python while calling function, in bytes
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, group, parameters, blocks, backend='minidom', repeats=3, options=None):
+    """
+    Benchmarks the transpiler on a list of MathML strings (each with a <math> root) and returns a
+    result dict
+
+    parse_string is timed on the strings, parse_dom on trees parsed up front (so only the
+    transpiler is timed). Each run starts from a cold SymPy cache, as when a model is first
+    loaded. Peak memory is that of parse_string.
+
+    :param options: transpiler options, see TranspileContext
+    """
+    options = options or {}
+    elements = [BACKENDS[backend].parse_string(block) for block in blocks]
+    expressions = []
+
+    def run_parse_string():
+        clear_cache()
+        del expressions[:]
+        for block in blocks:
+            expressions.extend(mathml2sympy.parse_string(block, backend=backend, **options))
+
+    def run_parse_dom():
+        clear_cache()
+        for element in elements:
+            mathml2sympy.parse_dom(element, **options)
+
+    return {
+        'name': name,
+        'group': group,
+        'parameters': parameters,
+        'input_bytes': sum(len(block.encode('utf-8')) for block in blocks),
+        'parse_string_s': best_time(run_parse_string, repeats),
+        'parse_dom_s': best_time(run_parse_dom, repeats),
+        'peak_memory_bytes': peak_memory(run_parse_string),
+        'expressions': len(expressions),
+    }
+
+
+def git_commit():
+    """
+    Returns the commit hash of the working tree, or None if it is not a git checkout
+    """
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(__file__))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def run(backend='minidom', repeats=3, quick=False, options=None, progress=None):
+    """
+    Runs all benchmarks and returns the results as a JSON-serialisable dict
+
+    :param options: transpiler options, see TranspileContext
+    :param progress: optional callback, called with each result as soon as it is available
+    """
+    cases = [(name, 'model', {'file': os.path.basename(path)}, model_blocks(path))
+             for name, path in MODELS]
+    cases.extend(('%s=%d' % (group, size), group, {group: size}, [xml])
+                 for group, size, xml in synthetic_inputs(quick))
+
+    # Nested MathML needs several Python frames per level with minidom
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+
+    results = []
+    for name, group, parameters, blocks in cases:
+        result = measure(name, group, parameters, blocks, backend, repeats, options)
+        results.append(result)
+        if progress is not None:
+            progress(result)
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'cellmlmanip': cellmlmanip.__version__,
+            'sympy': sympy.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': backend,
+            'repeats': repeats,
+            'options': options or {},
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline):
+    """
+    Returns lines comparing results with the results of an earlier run. Ratios are new / old, so
+    values above 1 are regressions.
+    """
+    old = {result['name']: result for result in baseline['results']}
+    lines = ['%-26s %14s %14s %14s' % ('input', 'parse_string', 'parse_dom', 'peak memory')]
+    for result in results['results']:
+        if result['name'] not in old:
+            continue
+        before = old[result['name']]
+        lines.append('%-26s %13.2fx %13.2fx %13.2fx' % (
+            result['name'],
+            result['parse_string_s'] / before['parse_string_s'],
+            result['parse_dom_s'] / before['parse_dom_s'],
+            result['peak_memory_bytes'] / before['peak_memory_bytes']))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='minidom')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='number of timed runs per input (the best is reported)')
+    parser.add_argument('--quick', action='store_true', help='leave out the largest inputs')
+    parser.add_argument('--unevaluated', action='store_true',
+                        help='transpile with evaluate=False')
+    args = parser.parse_args(argv)
+
+    print('%-26s %14s %14s %14s' % ('input', 'parse_string/s', 'parse_dom/s', 'peak memory/MB'))
+
+    def progress(result):
+        print('%-26s %14.4f %14.4f %14.2f' % (result['name'], result['parse_string_s'],
+                                              result['parse_dom_s'],
+                                              result['peak_memory_bytes'] / 1e6))
+        sys.stdout.flush()
+
+    options = {'evaluate': False} if args.unevaluated else {}
+    results = run(args.backend, args.repeats, args.quick, options, progress)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print('Compared with %s (new / old):' % (baseline['meta'].get('commit') or args.compare))
+        for line in compare(results, baseline):
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
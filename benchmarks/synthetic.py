@@ -0,0 +1,59 @@
+"""
+Generators of synthetic MathML for benchmarking the transpiler
+"""
+
+MATHML_NS = 'http://www.w3.org/1998/Math/MathML'
+
+
+def math_block(content_xml):
+    """
+    Wraps content MathML in a <math> root element
+    """
+    return '<math xmlns="%s">%s</math>' % (MATHML_NS, content_xml)
+
+
+def nested_apply(depth):
+    """
+    Returns a <math> block holding one expression nested `depth` <apply> elements deep, alternating
+    <plus> and <times> so that SymPy does not flatten the levels into one n-ary node, i.e.
+    x0 + y0 * (x1 + y1 * (x2 + ...))
+    """
+    opening = []
+    for level in range(depth):
+        operator = 'plus' if level % 2 == 0 else 'times'
+        opening.append('<apply><%s/><ci>x%d</ci>' % (operator, level))
+    return math_block(''.join(opening) + '<cn>1</cn>' + '</apply>' * depth)
+
+
+def many_equations(count, identifiers=None):
+    """
+    Returns a <math> block of `count` equations like those of a cardiac model, each
+    ``a_i = g_i * (V - E_i) * exp(-b_i * V) / (1 + c_i)``. The right-hand sides are drawn from a
+    pool of `identifiers` distinct variable names (by default every equation has its own), so
+    that fewer identifiers means more repeated symbols.
+    """
+    if identifiers is None:
+        identifiers = 4 * count
+    equations = []
+    for i in range(count):
+        g, e, b, c = ('<ci>p%d</ci>' % ((4 * i + k) % identifiers) for k in range(4))
+        equations.append(
+            '<apply><eq/><ci>a%d</ci>'
+            '<apply><divide/>'
+            '<apply><times/>%s<apply><minus/><ci>V</ci>%s</apply>'
+            '<apply><exp/><apply><times/><apply><minus/>%s</apply><ci>V</ci></apply></apply>'
+            '</apply>'
+            '<apply><plus/><cn>1</cn>%s</apply>'
+            '</apply></apply>' % (i, g, e, b, c))
+    return math_block(''.join(equations))
+
+
+def wide_piecewise(width):
+    """
+    Returns a <math> block with one equation whose right-hand side is a <piecewise> of `width`
+    pieces (plus <otherwise>), as used for e.g. stimulus protocols: x = k if t < k, for k < width
+    """
+    pieces = ''.join('<piece><cn>%d</cn><apply><lt/><ci>t</ci><cn>%d</cn></apply></piece>' % (k, k)
+                     for k in range(width))
+    return math_block('<apply><eq/><ci>x</ci><piecewise>%s<otherwise><cn>-1</cn></otherwise>'
+                      '</piecewise></apply>' % pieces)
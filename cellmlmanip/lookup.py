@@ -0,0 +1,176 @@
+"""
+Lookup tables for the expensive subexpressions of a model that only depend on one variable
+"""
+import numpy as np
+import sympy
+
+from .ode import _dependency_order, _quantities
+
+
+class LookupTables(object):
+    """
+    Tabulates the maximal subexpressions of a set of equations that depend on a single variable
+    (usually the membrane voltage) and are expensive to evaluate, i.e. contain a function such as
+    exp, log or a Piecewise, or a power with a non-integer exponent. Each one is evaluated on an
+    evenly spaced grid, and replaced by linear interpolation in that grid.
+
+    Variables defined by equations that only depend on the table variable (e.g. gating rates) are
+    followed, so ``1 / (alpha_h + beta_h)`` is tabulated as a whole. Defined constants may be
+    used, parameters may not, as their value is not known when the tables are built::
+
+        tables = LookupTables(equations, 'V', -150, 100, step=0.01, tolerance=1e-6)
+        system = OdeSystem(equations, lookup_tables=tables)
+
+    :param equations: SymPy equations, e.g. all blocks of a model returned by parse_file
+    :param variable: name or sympy.Symbol of the variable the tables are indexed by
+    :param start: lowest value in the tables
+    :param end: highest value in the tables (rounded up to a whole number of steps)
+    :param step: distance between table points
+    :param tolerance: if given, the tables are checked against the exact expressions halfway
+        between table points, where the interpolation error is largest, and a ValueError is raised
+        if an error exceeds ``tolerance * max(1, |exact value|)``
+    :raises ValueError: if the check fails, or an expression is not finite at a table point
+    """
+
+    def __init__(self, equations, variable, start, end, step=0.01, tolerance=None):
+        if isinstance(variable, str):
+            variable = sympy.Symbol(variable)
+        if step <= 0 or end <= start:
+            raise ValueError('Expected start < end and step > 0')
+        #: The variable the tables are indexed by, as a sympy.Symbol
+        self.variable = variable
+        self.start = float(start)
+        self.step = float(step)
+        size = int(np.ceil((end - start) / step - 1e-9)) + 1
+        self.end = self.start + (size - 1) * self.step
+
+        definitions = {}
+        for equation in equations:
+            definitions.setdefault(equation.args[0], equation.args[1])
+        # Maps each variable that only depends on the table variable and constants -> its
+        # definition in terms of the table variable only
+        resolved = {variable: variable}
+        order, _ = _dependency_order(
+            [q for q in definitions if q != variable], definitions, {variable})
+        for quantity in order:
+            if not isinstance(quantity, sympy.Symbol):
+                continue
+            expression = definitions[quantity]
+            if all(q in resolved for q in _quantities(expression)):
+                resolved[quantity] = expression.xreplace(resolved)
+
+        # Find the subexpressions to tabulate. Variables are not tabulated themselves, as their
+        # equation is; subexpressions that are equal once resolved share one table.
+        tables = {}
+        replacements = {}
+        for equation in equations:
+            stack = [equation.args[1]]
+            while stack:
+                expression = stack.pop()
+                quantities = _quantities(expression)
+                if quantities and all(q in resolved for q in quantities) and \
+                        isinstance(expression, sympy.Expr):
+                    exact = expression.xreplace(resolved)
+                    if not expression.is_Symbol and exact.has(variable) and _is_expensive(exact):
+                        symbol = tables.setdefault(exact, sympy.Dummy('table%d' % len(tables)))
+                        replacements[expression] = symbol
+                    continue
+                stack.extend(expression.args)
+
+        #: The tabulated subexpressions, in terms of the table variable only
+        self.expressions = list(tables)
+        #: Symbols standing for the tabulated subexpressions, in the same order
+        self.symbols = list(tables.values())
+        #: The equations, with tabulated subexpressions replaced by their symbols
+        self.equations = [sympy.Eq(equation.args[0], equation.args[1].xreplace(replacements),
+                                   evaluate=False) for equation in equations]
+
+        points = self.start + self.step * np.arange(size)
+        #: Array of table values, with one row per table
+        self.values = self._exact(points)
+        # Interpolation reads the values at and the differences to the next table point for all
+        # tables at once, so these are stored with one row per table point
+        self._lower = np.ascontiguousarray(self.values[:, :-1].T)
+        self._slope = np.ascontiguousarray(np.diff(self.values, axis=1).T)
+        for row, expression in zip(self.values, self.expressions):
+            bad = ~np.isfinite(row)
+            if bad.any():
+                raise ValueError('%s is not finite at %s = %s; choose another range or step'
+                                 % (expression, variable, points[bad][0]))
+        if tolerance is not None:
+            self.check(tolerance)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _exact(self, points):
+        """
+        Returns the exact values of all tabulated expressions at the given points
+        """
+        rows = []
+        for expression in self.expressions:
+            function = sympy.lambdify([self.variable], expression, 'numpy')
+            # Values that are not finite are reported by the caller
+            with np.errstate(all='ignore'):
+                values = np.asarray(function(points), dtype=float)
+            rows.append(np.broadcast_to(values, points.shape))
+        return np.array(rows).reshape((len(rows),) + points.shape)
+
+    def interpolate(self, value):
+        """
+        Returns the interpolated values of all tables, with one row per table and the shape of
+        value after that
+
+        :raises ValueError: if a value lies outside the tables
+        """
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 0:
+            # A single cell: plain float arithmetic is quicker than NumPy
+            value = float(value)
+            if not self.start <= value <= self.end:
+                raise ValueError('%s = %s outside the lookup table range %s to %s'
+                                 % (self.variable, value, self.start, self.end))
+            position = (value - self.start) / self.step
+            index = min(int(position), len(self._lower) - 1)
+            return self._lower[index] + (position - index) * self._slope[index]
+
+        if not ((value >= self.start) & (value <= self.end)).all():
+            raise ValueError('%s outside the lookup table range %s to %s'
+                             % (self.variable, self.start, self.end))
+        position = (value - self.start) / self.step
+        index = np.minimum(position.astype(int), len(self._lower) - 1)
+        fraction = position - index
+        return np.moveaxis(self._lower[index], -1, 0) + fraction * \
+            np.moveaxis(self._slope[index], -1, 0)
+
+    def errors(self):
+        """
+        Returns the largest error of each table relative to ``max(1, |exact value|)``, found
+        halfway between table points (zero for tables of a single point)
+        """
+        if self.values.shape[1] < 2:
+            return np.zeros(len(self.values))
+        points = self.start + self.step * (np.arange(self.values.shape[1] - 1) + 0.5)
+        exact = self._exact(points)
+        scale = np.maximum(1.0, np.abs(exact))
+        return (np.abs(self.interpolate(points) - exact) / scale).max(axis=1)
+
+    def check(self, tolerance):
+        """
+        Raises a ValueError if the error of a table (see errors()) exceeds the tolerance
+        """
+        for expression, error in zip(self.expressions, self.errors()):
+            if not error <= tolerance:
+                raise ValueError('Lookup table for %s has error %g, more than %g; use a smaller '
+                                 'step' % (expression, error, tolerance))
+
+
+def _is_expensive(expression):
+    """
+    Whether evaluating an expression involves a function or a non-integer power
+    """
+    for subexpression in sympy.preorder_traversal(expression):
+        if isinstance(subexpression, sympy.Function) or \
+                isinstance(subexpression, sympy.Pow) and not subexpression.exp.is_Integer:
+            return True
+    return False
@@ -3,4 +3,31 @@ CellML uses content MathML for mathematical expressions. This module
  translates a subset of MathML (as used by Cardiac Electrophysiology Web Lab)
  to SymPy expressions.
 """
-from .transpiler import parse_string, parse_dom
+from .batch import ParseResult, parse_file_parallel, parse_many
+from .cache import ExpressionCache
+from .cse import CsePlan, cse_plan
+from .fingerprint import (
+    BlockFingerprint,
+    EquationFingerprint,
+    ModelDiff,
+    component_digests,
+    diff_models,
+    duplicate_components,
+    fingerprint_block,
+    fingerprint_file,
+)
+from .index import EquationIndex
+from .lazy import LazyBlock, LazyEquation
+from .profiling import BlockStats, HandlerStats, TranspileProfile
+from .session import ModelChanges, ModelSession
+from .stream import StreamParser, parse_async
+from .symbol_table import SharingStats, SubexpressionTable, SymbolTable
+from .transpiler import (
+    TranspileContext,
+    canonicalize,
+    log_trace,
+    parse_dom,
+    parse_file,
+    parse_string,
+)
+from .writer import to_mathml, write_mathml
@@ -0,0 +1,201 @@
+"""
+XML tree backends for the MathML transpiler
+
+The handlers in transpiler.py never touch XML nodes directly. Instead they go through one of the
+backends below, so the same handlers work on both xml.dom (minidom/pulldom) nodes and
+xml.etree.ElementTree elements.
+"""
+import logging
+from xml.dom import Node, minidom
+from xml.etree import ElementTree
+
+
+class MinidomBackend(object):
+    """
+    Accessors for xml.dom nodes, as produced by minidom and pulldom
+    """
+    name = 'minidom'
+
+    @staticmethod
+    def parse_string(xml_string):
+        """
+        Parses an XML string and returns its document element
+        """
+        return minidom.parseString(xml_string).documentElement
+
+    @staticmethod
+    def tag(node):
+        """
+        Returns the tag name of the element, without any namespace prefix
+        """
+        return node.localName
+
+    @staticmethod
+    def children(node):
+        """
+        Yields the element children of the node. Comments and processing instructions are skipped.
+        """
+        for child_node in node.childNodes:
+            # If this is a Text node (no child nodes)
+            if child_node.nodeType == Node.TEXT_NODE:
+                # We should be handling text between tags explicitly in the handler
+                # (see cn_handler for an example), show a message
+                text = child_node.data.strip()
+                if text:
+                    logging.warning('Unhandled text node in <%s>: "%s"', node.tagName, text)
+            elif child_node.nodeType == Node.ELEMENT_NODE:
+                yield child_node
+            elif child_node.nodeType not in [Node.COMMENT_NODE, Node.PROCESSING_INSTRUCTION_NODE]:
+                raise NotImplementedError('Unknown node type %d' % child_node.nodeType)
+
+    @staticmethod
+    def text(node):
+        """
+        Returns the stripped text content of a token element, e.g. <ci> or <cn>
+        """
+        child_nodes = node.childNodes
+        if len(child_nodes) == 1:
+            return child_nodes[0].data.strip()
+        # pulldom splits text at the boundaries of the chunks it reads the document in
+        return ''.join(child_node.data for child_node in child_nodes
+                       if child_node.nodeType == Node.TEXT_NODE).strip()
+
+    @staticmethod
+    def separated_text(node):
+        """
+        Returns the stripped text parts of a token element separated by <sep/>, e.g. for
+        <cn type="e-notation">1.2<sep/>5</cn> returns ['1.2', '5']. Returns None if the element
+        contains anything other than text and <sep/> elements.
+        """
+        parts = ['']
+        for child_node in node.childNodes:
+            if child_node.nodeType == Node.TEXT_NODE:
+                parts[-1] += child_node.data
+            elif child_node.nodeType == Node.ELEMENT_NODE and child_node.localName == 'sep':
+                parts.append('')
+            elif child_node.nodeType not in [Node.COMMENT_NODE, Node.PROCESSING_INSTRUCTION_NODE]:
+                return None
+        return [part.strip() for part in parts]
+
+    @staticmethod
+    def attribute(node, name):
+        """
+        Returns the value of the (un-namespaced) attribute, or None if it is not set
+        """
+        if node.hasAttribute(name):
+            return node.getAttribute(name)
+        return None
+
+    @staticmethod
+    def detach(parent, node):
+        """
+        Removes a child node from its parent, leaving the child's own subtree intact
+        """
+        parent.removeChild(node)
+
+    @staticmethod
+    def to_xml(node):
+        """
+        Serialises the node, for use in error messages
+        """
+        return node.toxml()
+
+
+class ElementTreeBackend(object):
+    """
+    Accessors for xml.etree.ElementTree elements
+    """
+    name = 'etree'
+
+    @staticmethod
+    def parse_string(xml_string):
+        """
+        Parses an XML string and returns its root element
+        """
+        return ElementTree.fromstring(xml_string)
+
+    @staticmethod
+    def tag(node):
+        """
+        Returns the tag name of the element, without the '{namespace}' qualifier
+        """
+        return node.tag.rpartition('}')[2]
+
+    @staticmethod
+    def children(node):
+        """
+        Yields the element children of the node. Comments and processing instructions (only
+        present if the tree was built with insert_comments/insert_pis) are skipped.
+        """
+        if node.text and node.text.strip():
+            logging.warning('Unhandled text node in <%s>: "%s"',
+                            ElementTreeBackend.tag(node), node.text.strip())
+        for child_node in node:
+            if child_node.tag is not ElementTree.Comment and \
+                    child_node.tag is not ElementTree.ProcessingInstruction:
+                yield child_node
+            if child_node.tail and child_node.tail.strip():
+                logging.warning('Unhandled text node in <%s>: "%s"',
+                                ElementTreeBackend.tag(node), child_node.tail.strip())
+
+    @staticmethod
+    def text(node):
+        """
+        Returns the stripped text content of a token element, e.g. <ci> or <cn>
+        """
+        return node.text.strip()
+
+    @staticmethod
+    def separated_text(node):
+        """
+        Returns the stripped text parts of a token element separated by <sep/>, e.g. for
+        <cn type="e-notation">1.2<sep/>5</cn> returns ['1.2', '5']. Returns None if the element
+        contains anything other than text and <sep/> elements.
+        """
+        parts = [node.text or '']
+        for child_node in node:
+            if child_node.tag is ElementTree.Comment or \
+                    child_node.tag is ElementTree.ProcessingInstruction:
+                parts[-1] += child_node.tail or ''
+            elif ElementTreeBackend.tag(child_node) == 'sep':
+                parts.append(child_node.tail or '')
+            else:
+                return None
+        return [part.strip() for part in parts]
+
+    @staticmethod
+    def attribute(node, name):
+        """
+        Returns the value of the (un-namespaced) attribute, or None if it is not set
+        """
+        return node.get(name)
+
+    @staticmethod
+    def detach(parent, node):
+        """
+        Removes a child element from its parent, leaving the child's own subtree intact
+        """
+        parent.remove(node)
+
+    @staticmethod
+    def to_xml(node):
+        """
+        Serialises the node, for use in error messages
+        """
+        return ElementTree.tostring(node, encoding='unicode')
+
+
+# Backends by the name used for the `backend` argument of parse_string and parse_file
+BACKENDS = {
+    MinidomBackend.name: MinidomBackend,
+    ElementTreeBackend.name: ElementTreeBackend,
+}
+
+
+def get_backend(node):
+    """
+    Returns the backend that can read the given XML node
+    """
+    if isinstance(node, ElementTree.Element):
+        return ElementTreeBackend
+    return MinidomBackend
@@ -0,0 +1,145 @@
+"""
+Transpiles CellML in parallel, using a pool of worker processes: many files at once, or the
+<math> blocks of a single large file
+"""
+import collections
+import os
+import time
+from concurrent import futures
+from xml.etree import ElementTree
+
+from . import cache
+from .symbol_table import SymbolTable
+from .transpiler import iter_math_elements, parse_file, parse_string
+
+
+# Outcome of transpiling one file:
+#   path: the path as passed to parse_many
+#   blocks: list of (component name, list of SymPy expressions) tuples, or None if it failed
+#   error: the exception raised while reading the file, or None if it succeeded
+#   elapsed: wall-clock time spent on the file in its worker, in seconds
+ParseResult = collections.namedtuple('ParseResult', ['path', 'blocks', 'error', 'elapsed'])
+
+
+def parse_many(paths, workers=None, backend='minidom', **options):
+    """
+    Transpiles CellML files in a pool of worker processes and yields a ParseResult for each file as
+    soon as it is finished. Results are yielded in order of completion, not in the order of paths.
+    An error in one file is reported in its ParseResult and does not affect the others.
+
+    :param paths: paths of CellML documents
+    :param workers: number of worker processes (defaults to the number of CPUs). With 1, files are
+        transpiled one by one in this process.
+    :param backend: XML tree used for parsing, see parse_file
+    :param options: transpiler options, see TranspileContext. These are sent to the workers, so
+        they must be picklable. The profile and trace options are only supported with 1 worker.
+    :return: generator of ParseResult tuples
+    """
+    if workers == 1:
+        for path in paths:
+            yield _parse_one(path, backend, options)
+        return
+    if options.get('profile') is not None or options.get('trace') is not None:
+        raise ValueError('The profile and trace options are not supported with worker processes')
+
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = [executor.submit(_parse_one, path, backend, options, True) for path in paths]
+        try:
+            for future in futures.as_completed(pending):
+                result = future.result()
+                if result.blocks is not None:
+                    result = result._replace(blocks=cache.loads(result.blocks))
+                yield result
+        finally:
+            # Don't start any more files if the caller stops reading results early
+            for future in pending:
+                future.cancel()
+
+
+def _parse_one(path, backend, options, pickled=False):
+    """
+    Transpiles a single file, catching any error. Runs in a worker process.
+
+    :param pickled: if True, the blocks are returned pickled with cache.dumps, so that they can
+        be loaded with cache.loads (plain pickling would rebuild them with SymPy's evaluation,
+        changing expressions transpiled with evaluate=False)
+    """
+    start = time.perf_counter()
+    try:
+        blocks = list(parse_file(path, backend=backend, **options))
+        if pickled:
+            blocks = cache.dumps(blocks)
+    except Exception as e:
+        return ParseResult(path, None, e, time.perf_counter() - start)
+    return ParseResult(path, blocks, None, time.perf_counter() - start)
+
+
+def parse_file_parallel(source, workers=None, backend='minidom', blocks_per_task=None,
+                        **options):
+    """
+    Reads a CellML document and transpiles its <math> blocks in a pool of worker processes.
+    Gives the same result as ``list(parse_file(...))``, in document order.
+
+    The blocks are read in this process and sent to the workers in groups. The expressions come
+    back with their symbols, undefined functions and numbers pickled by name/value (see
+    cache.dumps), and are re-interned in this process, so all blocks share the objects of a single
+    SymbolTable exactly as with parse_file.
+
+    :param source: path or file object of a CellML document
+    :param workers: number of worker processes (defaults to the number of CPUs). With 1, blocks
+        are transpiled one by one in this process.
+    :param backend: XML tree used by the workers for parsing, either 'minidom' or 'etree'
+    :param blocks_per_task: number of blocks sent to a worker at a time (by default the blocks
+        are split into about four groups per worker)
+    :param options: transpiler options, see TranspileContext. These are sent to the workers, so
+        they must be picklable. If given, symbol_table and index are used in this process; a
+        SubexpressionTable can't be shared between processes, so subexpressions is not
+        supported. Neither are profile and trace, which would only see the workers' handler calls.
+    :return: list of (component name, list of SymPy expressions) tuples
+    """
+    if options.get('subexpressions') is not None:
+        raise ValueError('A SubexpressionTable cannot be shared between worker processes')
+    if options.get('profile') is not None or options.get('trace') is not None:
+        raise ValueError('The profile and trace options are not supported with worker processes')
+    symbol_table = options.pop('symbol_table', None)
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    index = options.pop('index', None)
+
+    if workers == 1:
+        return list(parse_file(source, backend=backend, symbol_table=symbol_table, index=index,
+                               **options))
+
+    # Serialise with ElementTree, which declares any namespace prefixes used in a block (e.g. for
+    # cellml:units) that were declared further up the document
+    component_names = []
+    blocks = []
+    for component_name, math_element in iter_math_elements(source, 'etree'):
+        component_names.append(component_name)
+        blocks.append(ElementTree.tostring(math_element, encoding='unicode'))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if blocks_per_task is None:
+        blocks_per_task = max(1, len(blocks) // (4 * workers))
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = [blocks[i:i + blocks_per_task] for i in range(0, len(blocks), blocks_per_task)]
+        results = executor.map(_transpile_blocks, tasks, [backend] * len(tasks),
+                               [options] * len(tasks))
+        expressions = [block for data in results for block in cache.loads(data, symbol_table)]
+
+    if index is not None:
+        for block in expressions:
+            index.add_block(block)
+    return list(zip(component_names, expressions))
+
+
+def _transpile_blocks(blocks, backend, options):
+    """
+    Transpiles serialised <math> blocks, sharing one SymbolTable. Runs in a worker process.
+
+    :return: the lists of expressions of the blocks, pickled with cache.dumps
+    """
+    symbol_table = SymbolTable()
+    return cache.dumps([parse_string(block, backend=backend, symbol_table=symbol_table, **options)
+                        for block in blocks])
@@ -0,0 +1,218 @@
+"""
+Content-addressed on-disk cache of transpiled <math> blocks
+"""
+import collections
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+
+from .. import __version__
+from .deferred import sympy
+from .symbol_table import SymbolTable
+from .transpiler import sympy_evaluate
+
+
+# Bump this if the way entries are stored changes
+CACHE_FORMAT = 1
+
+# File name extension of cache entries
+ENTRY_SUFFIX = '.pickle'
+
+
+class ExpressionCache(object):
+    """
+    Stores transpiled expressions on disk, keyed by a hash of the XML they were transpiled from
+    together with the cellmlmanip and SymPy versions (so upgrading either invalidates old entries).
+
+    Entries are pickled. Symbols, undefined functions and numbers are stored by name/value only and
+    re-interned through the SymbolTable of the parse that loads them, so cached expressions share
+    leaf objects exactly like freshly transpiled ones.
+
+    When the total size of the entries goes over max_size, the least recently used entries are
+    deleted.
+
+    Usage: ``parse_string(xml_string, cache=ExpressionCache('/tmp/cellmlmanip'))``
+
+    :param directory: directory to keep entries in (created if needed). Several processes may
+        share a directory, but each only tracks the entries it has seen for eviction.
+    :param max_size: maximum total size of the entries in bytes
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Maps key -> entry size in bytes, least recently used first
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        existing = []
+        for file_name in os.listdir(directory):
+            if file_name.endswith(ENTRY_SUFFIX):
+                stat = os.stat(os.path.join(directory, file_name))
+                existing.append((stat.st_mtime, file_name[:-len(ENTRY_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._size += size
+
+    @staticmethod
+    def key(data, *extra):
+        """
+        Returns the cache key for the given bytes
+
+        :param data: the bytes being transpiled, e.g. a serialised <math> block
+        :param extra: strings for anything else that changes the result (e.g. options)
+        """
+        digest = hashlib.sha256()
+        header = [str(CACHE_FORMAT), __version__, sympy.__version__] + [str(e) for e in extra]
+        digest.update('\0'.join(header).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    @property
+    def size(self):
+        """
+        Total size of the cache entries, in bytes
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key, symbol_table=None):
+        """
+        Returns the object stored under key, or None if there is no such entry
+
+        :param symbol_table: SymbolTable to intern the loaded leaf objects with
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = loads(f.read(), symbol_table)
+        except FileNotFoundError:
+            self._forget(key)
+            self.misses += 1
+            return None
+
+        # Mark as most recently used, also on disk for the next process to open the cache
+        os.utime(self._path(key))
+        if key not in self._entries:
+            self._entries[key] = os.path.getsize(self._path(key))
+            self._size += self._entries[key]
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, then evicts least recently used entries if the cache is too big
+        """
+        data = dumps(value)
+
+        # Write to a temporary file first, so that readers never see partial entries
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self._forget(key)
+        self._entries[key] = len(data)
+        self._size += len(data)
+        self._evict()
+
+    def clear(self):
+        """
+        Deletes all entries
+        """
+        for key in list(self._entries):
+            self._remove(key)
+
+    def _forget(self, key):
+        self._size -= self._entries.pop(key, 0)
+
+    def _remove(self, key):
+        self._forget(key)
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            self._remove(next(iter(self._entries)))
+
+
+def dumps(value):
+    """
+    Pickles (lists of) SymPy expressions, storing symbols, undefined functions and numbers by
+    name/value only so that loads() can re-intern them
+
+    :return: bytes
+    """
+    buffer = io.BytesIO()
+    _Pickler(buffer, pickle.HIGHEST_PROTOCOL).dump(value)
+    return buffer.getvalue()
+
+
+def loads(data, symbol_table=None):
+    """
+    Loads expressions pickled by dumps(), interning their leaf objects with the given SymbolTable
+    (a new one if not given). The expressions are rebuilt exactly as they were pickled, without
+    SymPy's evaluation, so unevaluated expressions stay unevaluated.
+    """
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    with sympy_evaluate(False):
+        return _Unpickler(io.BytesIO(data), symbol_table).load()
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles leaf objects by reference (name or value), see _Unpickler
+    """
+
+    def persistent_id(self, obj):
+        from sympy.core.function import UndefinedFunction
+
+        if type(obj) is sympy.Symbol:
+            return 'symbol', obj.name
+        if isinstance(obj, UndefinedFunction):
+            return 'function', obj.__name__
+        # Only standard precision floats (as made by cn_handler) survive a trip through float()
+        if type(obj) is sympy.Float and obj._prec == 53:
+            return 'number', float(obj)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """
+    Loads leaf objects pickled by _Pickler through a SymbolTable
+    """
+
+    def __init__(self, file, symbol_table):
+        super().__init__(file)
+        self.symbol_table = symbol_table
+
+    def persistent_load(self, pid):
+        kind, value = pid
+        if kind == 'symbol':
+            return self.symbol_table.symbol(value)
+        if kind == 'function':
+            return self.symbol_table.function(value)
+        if kind == 'number':
+            return self.symbol_table.number(value)
+        raise pickle.UnpicklingError('Unknown persistent id %r' % (pid,))
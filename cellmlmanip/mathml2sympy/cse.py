@@ -0,0 +1,134 @@
+"""
+Common subexpression elimination over all equations of a model
+"""
+import collections
+
+from .cache import dumps
+from .deferred import sympy
+from .transpiler import sympy_evaluate
+
+
+# Shared evaluation plan for a list of expressions:
+#   temporaries: (symbol, expression) tuples, each using only the temporaries before it
+#   equations: the expressions, with repeated subexpressions replaced by temporaries
+CsePlan = collections.namedtuple('CsePlan', ['temporaries', 'equations'])
+
+
+def cse_plan(expressions, prefix='_cse', evaluate=True, cache=None, symbol_table=None):
+    """
+    Finds the subexpressions that occur more than once in a list of expressions (e.g. all blocks
+    of a model) and returns a plan that computes each of them once, as a temporary.
+
+    Every distinct subtree is given a number from the numbers of its operator and arguments
+    (value numbering), so finding repeats takes time linear in the size of the expressions, unlike
+    sympy.cse. Only whole SymPy nodes are shared: a repeated ``a + b`` inside ``a + b + c`` (which
+    SymPy stores as one node with three terms) is not found.
+
+    The left-hand sides of equations are left alone. To evaluate the plan with an OdeSystem, give
+    it the temporaries as equations::
+
+        plan = cse_plan(equations)
+        system = OdeSystem([sympy.Eq(s, e) for s, e in plan.temporaries] + plan.equations)
+
+    :param expressions: list of SymPy expressions, e.g. as returned by parse_dom
+    :param prefix: name prefix of the temporary symbols. Names already used in the expressions
+        are skipped.
+    :param evaluate: if False, the expressions are rebuilt without SymPy's automatic evaluation,
+        keeping the structure of expressions parsed with evaluate=False
+    :param cache: optional ExpressionCache to store the plan in, keyed by the expressions
+    :param symbol_table: SymbolTable to intern the symbols of a plan loaded from the cache with
+    :return: CsePlan
+    """
+    if cache is None:
+        return _plan(expressions, prefix, evaluate)
+    key = cache.key(dumps(expressions), 'cse', prefix, str(evaluate))
+    stored = cache.get(key, symbol_table)
+    if stored is not None:
+        return CsePlan(*stored)
+    plan = _plan(expressions, prefix, evaluate)
+    cache.put(key, list(plan))
+    return plan
+
+
+def _is_leaf(node):
+    """
+    Whether a node is treated as a single value: atoms, and derivatives of (and applications of)
+    undefined functions, which stand for state variables
+    """
+    from sympy.core.function import AppliedUndef
+
+    return not node.args or isinstance(node, (sympy.Derivative, AppliedUndef))
+
+
+def _plan(expressions, prefix, evaluate):
+    roots = [expression.rhs if isinstance(expression, sympy.Eq) else expression
+             for expression in expressions]
+
+    # Number every distinct subtree, children before parents. A subtree is keyed by its operator
+    # and the numbers of its arguments, so looking it up never compares whole trees.
+    numbers = {}  # id of a node -> its number
+    table = {}  # key -> number
+    nodes = []  # number -> first node with that number
+    arguments = []  # number -> numbers of its arguments (None for leaves)
+    uses = []  # number -> number of references from distinct parents and roots
+    names = set()
+    stack = list(roots)
+    while stack:
+        node = stack[-1]
+        if id(node) in numbers:
+            stack.pop()
+            continue
+        leaf = _is_leaf(node)
+        if not leaf:
+            pending = [arg for arg in node.args if id(arg) not in numbers]
+            if pending:
+                stack.extend(pending)
+                continue
+        stack.pop()
+        if leaf:
+            key = node
+            if isinstance(node, sympy.Symbol):
+                names.add(node.name)
+        else:
+            argument_numbers = tuple(numbers[id(arg)] for arg in node.args)
+            key = (node.func, argument_numbers)
+        number = table.get(key)
+        if number is None:
+            number = table[key] = len(nodes)
+            nodes.append(node)
+            arguments.append(None if leaf else argument_numbers)
+            uses.append(0)
+            if not leaf:
+                for argument in argument_numbers:
+                    uses[argument] += 1
+        numbers[id(node)] = number
+    for root in roots:
+        uses[numbers[id(root)]] += 1
+
+    from sympy.logic.boolalg import Boolean
+
+    # Rebuild bottom-up, replacing repeated subexpressions by temporaries
+    temporaries = []
+    references = []  # number -> what its parents refer to: a temporary or the built node
+    free_names = (name for name in ('%s%d' % (prefix, i) for i in range(len(nodes) + len(names)))
+                  if name not in names)
+    with sympy_evaluate(evaluate):
+        for number, node in enumerate(nodes):
+            if arguments[number] is not None:
+                args = [references[argument] for argument in arguments[number]]
+                if any(new is not old for new, old in zip(args, node.args)):
+                    node = node.func(*args)
+            if uses[number] > 1 and arguments[number] is not None and \
+                    isinstance(node, (sympy.Expr, Boolean)):
+                symbol = sympy.Symbol(next(free_names))
+                temporaries.append((symbol, node))
+                node = symbol
+            references.append(node)
+
+    equations = []
+    for expression, root in zip(expressions, roots):
+        reduced = references[numbers[id(root)]]
+        if isinstance(expression, sympy.Eq):
+            reduced = sympy.Eq(expression.lhs, reduced, evaluate=False)
+        equations.append(reduced)
+    return CsePlan(temporaries, equations)
@@ -0,0 +1,34 @@
+"""
+Deferred imports of heavy dependencies, so that importing the package (e.g. to fingerprint or index
+models, which never build expressions) does not pay for them
+"""
+import importlib
+
+
+class DeferredModule(object):
+    """
+    Stands in for a module that is only imported (with importlib.import_module, so sys.modules is
+    left alone) when one of its attributes is first used. The attributes of the module are then
+    copied into the proxy, so later lookups cost the same as on the module itself; attributes the
+    module gains afterwards are still found through __getattr__.
+
+    Only read top-level attributes through the proxy: import submodules (e.g. sympy.core.function)
+    where they are needed, rather than relying on them being attributes of their package.
+
+    :param name: absolute module name, e.g. 'sympy'
+    """
+
+    def __init__(self, name):
+        self.__dict__['_deferred_name'] = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__dict__['_deferred_name'])
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return '<deferred module %r>' % self.__dict__['_deferred_name']
+
+
+# SymPy takes most of the import time of the package; it is imported on first transpile
+sympy = DeferredModule('sympy')
@@ -0,0 +1,153 @@
+"""
+Structural fingerprints of MathML equations and blocks, to compare and deduplicate models without
+building SymPy expressions
+"""
+import collections
+import hashlib
+
+from .backends import get_backend
+from .lazy import _read_lhs
+from .transpiler import TOKEN_ELEMENTS, cn_value, iter_math_elements
+
+
+# Fingerprint of one top-level expression of a <math> block:
+#   lhs: name of the variable it defines (see LazyEquation.lhs_name), None if it is not an equation
+#   is_ode: whether it defines the derivative of lhs
+#   digest: bytes hash of its structure
+EquationFingerprint = collections.namedtuple('EquationFingerprint', ['lhs', 'is_ode', 'digest'])
+
+# Fingerprint of a <math> block:
+#   digest: bytes hash of the digests of its equations, in order
+#   equations: list of EquationFingerprint
+BlockFingerprint = collections.namedtuple('BlockFingerprint', ['digest', 'equations'])
+
+# Differences between two fingerprinted models, as lists of (component name, lhs, is_ode) keys of
+# equations (expressions that are not equations are keyed by their digest instead of lhs):
+#   added: keys only in the new model
+#   removed: keys only in the old model
+#   changed: keys whose equation differs
+#   unchanged: keys whose equation is the same
+ModelDiff = collections.namedtuple('ModelDiff', ['added', 'removed', 'changed', 'unchanged'])
+
+
+def _hash(data):
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).digest()
+
+
+def _structure(element):
+    """
+    Returns a canonical string of the structure of an element: the tags of all elements, the
+    identifiers of <ci> elements and the values of <cn> elements. Whitespace, comments and
+    processing instructions are ignored, as are attributes other than the type of a <cn>, and
+    numbers that are equal as floats (e.g. 1 and 1.0) give the same string.
+    """
+    backend = get_backend(element)
+    parts = []
+    stack = [element]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is str:
+            parts.append(node)
+            continue
+        tag = backend.tag(node)
+        if tag in TOKEN_ELEMENTS:
+            if tag == 'ci':
+                parts.append('ci:%s ' % backend.text(node))
+            else:
+                number_type = backend.attribute(node, 'type')
+                if number_type in ('integer', 'rational'):
+                    numbers = [int(part) for part in backend.separated_text(node)]
+                    parts.append('cn:%s:%s ' % (number_type, numbers))
+                else:
+                    parts.append('cn:%r ' % cn_value(node))
+            continue
+        parts.append('%s(' % tag)
+        stack.append(')')
+        stack.extend(reversed(list(backend.children(node))))
+    return ''.join(parts)
+
+
+def fingerprint_block(math_element):
+    """
+    Returns the BlockFingerprint of a <math> element, read from the XML alone
+    """
+    backend = get_backend(math_element)
+    equations = []
+    for element in backend.children(math_element):
+        lhs, is_ode = _read_lhs(element)
+        equations.append(EquationFingerprint(lhs, is_ode, _hash(_structure(element))))
+    digest = hashlib.blake2b(b''.join(e.digest for e in equations), digest_size=16).digest()
+    return BlockFingerprint(digest, equations)
+
+
+def fingerprint_file(source, backend='minidom'):
+    """
+    Streams a CellML document and yields the fingerprint of each <math> block, without transpiling
+
+    :param source: path or file object of a CellML document
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree'
+    :return: generator of (component name, BlockFingerprint) tuples, in document order
+    """
+    for component_name, math_element in iter_math_elements(source, backend):
+        yield component_name, fingerprint_block(math_element)
+
+
+def _by_key(blocks):
+    """
+    Returns a dict mapping the key of every equation in a list of (component name,
+    BlockFingerprint) tuples to its digest, in document order
+    """
+    digests = collections.OrderedDict()
+    for component_name, block in blocks:
+        for equation in block.equations:
+            if equation.lhs is None:
+                digests[(component_name, equation.digest, False)] = equation.digest
+            else:
+                digests[(component_name, equation.lhs, equation.is_ode)] = equation.digest
+    return digests
+
+
+def diff_models(old, new):
+    """
+    Compares two versions of a model equation by equation, matching equations by component and
+    the variable they define. Takes time linear in the number of equations.
+
+    :param old: list of (component name, BlockFingerprint) tuples, e.g. from fingerprint_file
+    :param new: the same for the new version
+    :return: ModelDiff
+    """
+    old = _by_key(old)
+    new = _by_key(new)
+    added = [key for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = [key for key, digest in new.items() if key in old and old[key] != digest]
+    unchanged = [key for key, digest in new.items() if old.get(key) == digest]
+    return ModelDiff(added, removed, changed, unchanged)
+
+
+def component_digests(blocks):
+    """
+    Returns a dict mapping the name of every component in a list of (component name,
+    BlockFingerprint) tuples to a digest of all its blocks
+    """
+    digests = collections.OrderedDict()
+    for component_name, block in blocks:
+        digests[component_name] = digests.get(component_name, b'') + block.digest
+    return collections.OrderedDict(
+        (name, hashlib.blake2b(data, digest_size=16).digest()) for name, data in digests.items())
+
+
+def duplicate_components(models):
+    """
+    Finds components with identical mathematics across a collection of models
+
+    :param models: dict mapping a model name -> list of (component name, BlockFingerprint)
+        tuples, e.g. ``{path: list(fingerprint_file(path)) for path in paths}``
+    :return: list of groups of identical components, each a list of (model name, component name)
+        tuples with at least two entries
+    """
+    groups = collections.OrderedDict()
+    for model_name, blocks in models.items():
+        for component_name, digest in component_digests(blocks).items():
+            groups.setdefault(digest, []).append((model_name, component_name))
+    return [group for group in groups.values() if len(group) > 1]
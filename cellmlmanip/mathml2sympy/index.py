@@ -0,0 +1,255 @@
+"""
+Index of which equations define and use each variable, collected while transpiling
+"""
+import collections
+import heapq
+
+from .deferred import sympy
+
+
+class EquationIndex(object):
+    """
+    Maps every variable of a model to the equations that define it and the equations that use it,
+    and orders the equations by their dependencies.
+
+    Pass an index to the parser to fill it while transpiling: ci_handler reports every identifier
+    it reads, so no expression has to be walked again afterwards::
+
+        index = EquationIndex()
+        for _ in parse_file('model.cellml', index=index):
+            pass
+        index.defining('i_Na')
+
+    Equations ``Eq(x, ...)`` define the symbol x; ODEs ``Eq(Derivative(x(t), t), ...)`` define the
+    derivative, while x itself (a state) is defined by none. All other symbols and derivatives in
+    an equation are uses. Expressions that are not equations only use variables.
+
+    One index can collect several <math> blocks, e.g. all blocks of a document.
+    """
+
+    def __init__(self):
+        #: All indexed expressions, in the order they were added
+        self.equations = []
+        # Maps symbol or derivative -> indices of the defining/using equations
+        self._defining = collections.defaultdict(list)
+        self._using = collections.defaultdict(list)
+        # Maps index of an equation -> the quantities it uses
+        self._uses = []
+        # Quantities reported by the transpiler for the expression being built, and for the
+        # finished expressions of the current block
+        self._seen = []
+        self._finished = []
+
+    def __len__(self):
+        return len(self.equations)
+
+    # Called during transpiling ################################################################
+
+    def seen(self, quantity):
+        """
+        Records a symbol (or derivative) read while transpiling the current top-level expression
+        """
+        self._seen.append(quantity)
+
+    def end_expression(self):
+        """
+        Marks the end of a top-level expression of the <math> block being transpiled
+        """
+        self._finished.append(self._seen)
+        self._seen = []
+
+    def add_block(self, expressions):
+        """
+        Indexes the expressions of a transpiled <math> block, using the quantities reported while
+        transpiling it. If nothing was reported (e.g. the block came from an ExpressionCache),
+        the expressions are walked instead.
+        """
+        finished, self._finished, self._seen = self._finished, [], []
+        if len(finished) != len(expressions):
+            finished = [None] * len(expressions)
+        for expression, quantities in zip(expressions, finished):
+            self.add(expression, quantities)
+
+    def add(self, expression, quantities=None):
+        """
+        Indexes a single expression
+
+        :param quantities: list of the symbols and derivatives read while transpiling it (with
+            repeats); found from the expression if not given
+        """
+        if quantities is None:
+            if isinstance(expression, sympy.Eq):
+                quantities = _lhs_quantities(expression.lhs) + _quantities(expression.rhs)
+            else:
+                quantities = _quantities(expression)
+
+        uses = collections.Counter(quantities)
+        number = len(self.equations)
+        self.equations.append(expression)
+        if isinstance(expression, sympy.Eq) and \
+                isinstance(expression.lhs, (sympy.Symbol, sympy.Derivative)):
+            self._defining[expression.lhs].append(number)
+            # The identifiers on the left-hand side are not uses
+            uses.subtract(_lhs_quantities(expression.lhs))
+        uses = [quantity for quantity, count in uses.items() if count > 0]
+        self._uses.append(uses)
+        for quantity in uses:
+            self._using[quantity].append(number)
+
+    # Queries ##################################################################################
+
+    @staticmethod
+    def _key(variable):
+        return sympy.Symbol(variable) if isinstance(variable, str) else variable
+
+    def defining(self, variable):
+        """
+        Returns the equations that define a variable
+
+        :param variable: name or sympy.Symbol of a variable, or a sympy.Derivative
+        """
+        return [self.equations[i] for i in self._defining.get(self._key(variable), [])]
+
+    def using(self, variable):
+        """
+        Returns the equations that use a variable (on their right-hand side)
+
+        :param variable: name or sympy.Symbol of a variable, or a sympy.Derivative
+        """
+        return [self.equations[i] for i in self._using.get(self._key(variable), [])]
+
+    def uses(self, equation_number):
+        """
+        Returns the symbols and derivatives used by the equation with the given number (its
+        position in ``equations``)
+        """
+        return list(self._uses[equation_number])
+
+    @property
+    def variables(self):
+        """
+        Set of all symbols and derivatives that are defined or used
+        """
+        return set(self._defining) | set(self._using)
+
+    def dependencies(self, equation_number):
+        """
+        Returns the numbers of the equations that must be evaluated before the given one, i.e.
+        those that define something it uses
+        """
+        return sorted({i for quantity in self._uses[equation_number]
+                       for i in self._defining.get(quantity, [])})
+
+    def evaluation_order(self):
+        """
+        Returns all equations, ordered so that every equation comes after the equations it depends
+        on. Independent equations keep their original order.
+
+        :raises ValueError: if equations depend on each other in a cycle (see cycles())
+        """
+        count = len(self.equations)
+        dependents = [[] for _ in range(count)]
+        waiting = [0] * count
+        for number in range(count):
+            for dependency in self.dependencies(number):
+                dependents[dependency].append(number)
+                waiting[number] += 1
+
+        # Kahn's algorithm, taking the lowest ready equation first to keep the original order
+        ready = [number for number in range(count) if waiting[number] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            number = heapq.heappop(ready)
+            order.append(number)
+            for dependent in dependents[number]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+        if len(order) < count:
+            cycle = self.cycles()[0]
+            raise ValueError('Cyclic dependency between equations: %s'
+                             % ', '.join(str(equation) for equation in cycle))
+        return [self.equations[number] for number in order]
+
+    def cycles(self):
+        """
+        Returns the groups of equations that depend on each other in a cycle (the strongly
+        connected components of the dependency graph with more than one equation, or with an
+        equation that depends on itself), in order of their first equation
+        """
+        components = []
+        for component in _strongly_connected_components(len(self.equations), self.dependencies):
+            if len(component) > 1 or component[0] in self.dependencies(component[0]):
+                components.append(sorted(component))
+        return [[self.equations[number] for number in component]
+                for component in sorted(components)]
+
+
+def _quantities(expression):
+    """
+    Returns the quantities the transpiler reports for an expression (each only once): its symbols
+    and derivatives, and the variables of the derivatives
+    """
+    derivatives = expression.atoms(sympy.Derivative)
+    quantities = expression.free_symbols | derivatives
+    quantities.update(sympy.Symbol(derivative.expr.func.__name__) for derivative in derivatives)
+    return list(quantities)
+
+
+def _lhs_quantities(lhs):
+    """
+    Returns the quantities the transpiler reports for the left-hand side of an equation: a
+    symbol, or a derivative together with the identifiers in its <diff> (variable and bound
+    variable)
+    """
+    if isinstance(lhs, sympy.Derivative):
+        return [lhs, sympy.Symbol(lhs.expr.func.__name__)] + list(lhs.variables)
+    if isinstance(lhs, sympy.Symbol):
+        return [lhs]
+    return []
+
+
+def _strongly_connected_components(count, successors):
+    """
+    Tarjan's algorithm without recursion. Yields lists of node numbers.
+
+    :param count: number of nodes, which are numbered 0..count-1
+    :param successors: function returning the successors of a node
+    """
+    indices = {}
+    lowlinks = {}
+    on_stack = set()
+    stack = []
+    for root in range(count):
+        if root in indices:
+            continue
+        indices[root] = lowlinks[root] = len(indices)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors(root)))]
+        while work:
+            node, remaining = work[-1]
+            for successor in remaining:
+                if successor not in indices:
+                    indices[successor] = lowlinks[successor] = len(indices)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(successors(successor))))
+                    break
+                if successor in on_stack:
+                    lowlinks[node] = min(lowlinks[node], indices[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+                if lowlinks[node] == indices[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    yield component
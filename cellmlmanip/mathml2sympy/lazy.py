@@ -0,0 +1,117 @@
+"""
+Placeholders for equations that are only transpiled when they are used
+"""
+from .backends import get_backend
+
+
+class LazyEquation(object):
+    """
+    A top-level expression of a <math> block that has not necessarily been transpiled yet. It
+    keeps a reference to its XML element, and transpiles it (once) when ``expression`` is read.
+
+    The variable an equation defines is read straight from the XML, so equations can be picked
+    out by variable without building any SymPy objects.
+
+    :ivar lhs_name: name of the variable on the left-hand side of ``<apply><eq/><ci>x</ci>..``, or
+        of the differentiated variable for ``<apply><eq/><apply><diff/>..<ci>x</ci></apply>..``.
+        None for other expressions.
+    :ivar is_ode: whether the left-hand side is a derivative
+    """
+    __slots__ = ('lhs_name', 'is_ode', '_element', '_context', '_expression')
+
+    def __init__(self, element, context):
+        self._element = element
+        self._context = context
+        self._expression = None
+        self.lhs_name, self.is_ode = _read_lhs(element)
+
+    @property
+    def transpiled(self):
+        """
+        Whether the expression has been transpiled yet
+        """
+        return self._element is None
+
+    @property
+    def expression(self):
+        """
+        The SymPy expression, transpiled on first access
+        """
+        if self._element is not None:
+            self._expression = self._context.transpile_element(self._element)
+            # The XML and the context are not needed any more
+            self._element = self._context = None
+        return self._expression
+
+    def __repr__(self):
+        if self.transpiled:
+            return '<LazyEquation %s>' % (self._expression,)
+        return '<LazyEquation %s (not transpiled)>' % (
+            'd(%s)/dt' % self.lhs_name if self.is_ode else self.lhs_name)
+
+
+class LazyBlock(list):
+    """
+    The top-level expressions of a <math> block as a list of LazyEquation objects, with a lookup
+    by the name of the variable each one defines
+    """
+
+    def __init__(self, equations=()):
+        super().__init__(equations)
+        self._by_name = {}
+        for equation in self:
+            if equation.lhs_name is not None:
+                self._by_name.setdefault(equation.lhs_name, []).append(equation)
+
+    def find(self, name, ode=None):
+        """
+        Returns the equations defining the named variable (none of them are transpiled)
+
+        :param ode: if True, only return ODEs for the variable; if False, only algebraic equations
+        """
+        return [equation for equation in self._by_name.get(name, [])
+                if ode is None or equation.is_ode == ode]
+
+    def expressions(self):
+        """
+        Returns the SymPy expressions of all equations, transpiling those that haven't been
+        """
+        return [equation.expression for equation in self]
+
+
+def lazy_block(math_dom_element, context):
+    """
+    Returns a LazyBlock with a LazyEquation for each child of a <math> element, transpiled with
+    the given TranspileContext when used.
+
+    The children are detached from the <math> element, so that they stay intact when the rest of
+    the document is freed (as parse_file does after each block).
+    """
+    backend = get_backend(math_dom_element)
+    elements = list(backend.children(math_dom_element))
+    for element in elements:
+        backend.detach(math_dom_element, element)
+    return LazyBlock(LazyEquation(element, context) for element in elements)
+
+
+def _read_lhs(element):
+    """
+    Returns the defined variable name and whether it is differentiated, for a top-level element
+    """
+    backend = get_backend(element)
+    if backend.tag(element) != 'apply':
+        return None, False
+    children = list(backend.children(element))
+    if len(children) < 2 or backend.tag(children[0]) != 'eq':
+        return None, False
+    lhs = children[1]
+    tag = backend.tag(lhs)
+    if tag == 'ci':
+        return backend.text(lhs), False
+    if tag == 'apply':
+        parts = list(backend.children(lhs))
+        if parts and backend.tag(parts[0]) == 'diff':
+            for part in parts[1:]:
+                if backend.tag(part) == 'ci':
+                    return backend.text(part), True
+    return None, False
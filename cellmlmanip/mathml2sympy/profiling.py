@@ -0,0 +1,174 @@
+"""
+Opt-in counters and timings of the MathML handlers, to find out which constructs make a model
+slow to load
+"""
+import collections
+import json
+import time
+
+from .backends import get_backend
+
+
+class HandlerStats(object):
+    """
+    Counters for one MathML tag (or one operator applied by <apply>)
+
+    :ivar calls: number of handler calls
+    :ivar time: total time spent in the handler, in seconds. Children are transpiled before their
+        parent's handler is called, so this excludes the time spent on child elements.
+    :ivar nodes: number of new SymPy nodes in the results (subexpressions that were already
+        counted, e.g. shared symbols, are not counted again)
+    """
+    __slots__ = ('calls', 'time', 'nodes')
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.nodes = 0
+
+    def to_dict(self):
+        return {'calls': self.calls, 'time': self.time, 'nodes': self.nodes}
+
+
+# Totals for one transpiled <math> block:
+#   expressions: number of top-level expressions
+#   elements: number of handler calls
+#   time: wall-clock time spent transpiling the block, in seconds
+#   nodes: number of new SymPy nodes built
+#   max_depth: nesting depth of the deepest expression
+BlockStats = collections.namedtuple(
+    'BlockStats', ['expressions', 'elements', 'time', 'nodes', 'max_depth'])
+
+
+class TranspileProfile(object):
+    """
+    Collects statistics of everything transpiled with it. Pass it as the `profile` option, e.g.
+    ``parse_file(path, profile=profile)``, then read the counters or ``print(profile.report())``.
+    Profiling wraps every handler, so it slows transpiling down; without it nothing is measured.
+
+    :ivar tags: maps MathML tag -> HandlerStats of its handler
+    :ivar operators: maps the tag of an operator (e.g. 'rem', 'diff', 'lt') -> HandlerStats of the
+        <apply> elements applying it. This is where SymPy objects are built for most operators,
+        as their own handlers only return the SymPy class or function to apply.
+    :ivar blocks: list of BlockStats, one per <math> block
+    :ivar depths: histogram (Counter) of the nesting depths of the top-level expressions
+    """
+
+    def __init__(self):
+        self.tags = collections.defaultdict(HandlerStats)
+        self.operators = collections.defaultdict(HandlerStats)
+        self.blocks = []
+        self.depths = collections.Counter()
+        # State of the block being transpiled: its start time, number of handler calls, ids of
+        # the objects counted so far and maps id of a result -> its depth
+        self._start = None
+        self._elements = 0
+        self._counted = set()
+        self._depth = {}
+
+    def wrap(self, handlers):
+        """
+        Returns a copy of a handler table in which every handler is timed
+        """
+        return {tag: self._wrap_handler(tag, handler) for tag, handler in handlers.items()}
+
+    def _wrap_handler(self, tag, handler):
+        stats = self.tags[tag]
+        is_apply = tag == 'apply'
+
+        def profiled_handler(node, children, context):
+            start = time.perf_counter()
+            result = handler(node, children, context)
+            elapsed = time.perf_counter() - start
+
+            self._elements += 1
+            nodes = self._count(result)
+            stats.calls += 1
+            stats.time += elapsed
+            stats.nodes += nodes
+            if is_apply:
+                backend = get_backend(node)
+                operator = self.operators[backend.tag(next(backend.children(node)))]
+                operator.calls += 1
+                operator.time += elapsed
+                operator.nodes += nodes
+
+            depth = 1
+            if children:
+                depth += max(self._depth.get(id(child), 1) for child in children)
+            self._depth[id(result)] = depth
+            return result
+        return profiled_handler
+
+    def _count(self, result):
+        """
+        Returns the number of SymPy nodes in result that have not been counted before
+        """
+        count = 0
+        stack = [result]
+        while stack:
+            item = stack.pop()
+            if id(item) in self._counted:
+                continue
+            if isinstance(item, (list, tuple)):
+                stack.extend(item)
+            elif hasattr(item, 'args') and not isinstance(item, type):
+                self._counted.add(id(item))
+                count += 1
+                stack.extend(item.args)
+        return count
+
+    def start_block(self):
+        """
+        Called by TranspileContext before a <math> block is transpiled
+        """
+        self._start = time.perf_counter()
+        self._elements = 0
+        self._counted = set()
+        self._depth = {}
+
+    def end_block(self, expressions):
+        """
+        Called by TranspileContext with the expressions of the transpiled block
+        """
+        elapsed = time.perf_counter() - self._start
+        depths = [self._depth.get(id(expression), 1) for expression in expressions]
+        self.depths.update(depths)
+        self.blocks.append(BlockStats(len(expressions), self._elements, elapsed,
+                                      len(self._counted), max(depths, default=0)))
+        self._counted = set()
+        self._depth = {}
+
+    def to_dict(self):
+        """
+        Returns all statistics as a JSON-serialisable dict
+        """
+        return {
+            'tags': {tag: stats.to_dict() for tag, stats in sorted(self.tags.items())
+                     if stats.calls},
+            'operators': {tag: stats.to_dict() for tag, stats in sorted(self.operators.items())},
+            'blocks': [block._asdict() for block in self.blocks],
+            'depths': {str(depth): count for depth, count in sorted(self.depths.items())},
+        }
+
+    def dump(self, file):
+        """
+        Writes the statistics as JSON to a file object
+        """
+        json.dump(self.to_dict(), file, indent=2)
+
+    def report(self, limit=20):
+        """
+        Returns a text table of the tags and operators that took the most time
+        """
+        rows = [(stats.time, 'apply/' + tag, stats) for tag, stats in self.operators.items()]
+        rows.extend((stats.time, tag, stats) for tag, stats in self.tags.items() if stats.calls)
+        rows.sort(key=lambda row: row[0], reverse=True)
+        lines = ['%-20s %10s %12s %10s' % ('element', 'calls', 'time/s', 'nodes')]
+        for _, name, stats in rows[:limit]:
+            lines.append('%-20s %10d %12.6f %10d' % (name, stats.calls, stats.time, stats.nodes))
+        lines.append('%d blocks, %d expressions, %.6f s, max depth %d' % (
+            len(self.blocks), sum(block.expressions for block in self.blocks),
+            sum(block.time for block in self.blocks),
+            max((block.max_depth for block in self.blocks), default=0)))
+        return '\n'.join(lines)
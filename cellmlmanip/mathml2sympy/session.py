@@ -0,0 +1,129 @@
+"""
+Keeps a model loaded between edits, and only transpiles the <math> blocks that changed
+"""
+import collections
+import io
+
+from .fingerprint import fingerprint_block
+from .symbol_table import SymbolTable
+from .transpiler import iter_math_elements, parse_dom
+
+
+# Changes between two versions of a model, as reported by ModelSession.load:
+#   added: equations whose (component, left-hand side) is new
+#   removed: equations whose (component, left-hand side) has gone
+#   changed: (old, new) equation tuples for a left-hand side whose equation differs
+#   reused: number of <math> blocks taken over unchanged from the previous version
+#   transpiled: number of <math> blocks that had to be transpiled
+ModelChanges = collections.namedtuple(
+    'ModelChanges', ['added', 'removed', 'changed', 'reused', 'transpiled'])
+
+
+class ModelSession(object):
+    """
+    Holds the transpiled equations of a CellML document that is loaded again and again (e.g. while
+    it is being edited). Each <math> block is remembered by its structural fingerprint (see
+    fingerprint_block), and when a new version of the document is loaded only blocks with a new
+    fingerprint are transpiled; the expressions of all other blocks are reused, even if their
+    formatting or comments changed.
+
+    All versions share one SymbolTable, so reused and newly transpiled expressions use the same
+    symbol objects.
+
+    Usage::
+
+        session = ModelSession()
+        session.load('model.cellml')
+        (edit the file)
+        changes = session.load('model.cellml')
+
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree'
+    :param options: transpiler options, see TranspileContext
+    """
+
+    def __init__(self, backend='minidom', **options):
+        self.backend = backend
+        self.options = options
+        self.options.setdefault('symbol_table', SymbolTable())
+        #: (component name, list of SymPy expressions) tuples of the current version
+        self.blocks = []
+        # Maps fingerprint -> expressions of the blocks of the current version
+        self._by_fingerprint = {}
+
+    @property
+    def symbol_table(self):
+        """
+        The SymbolTable shared by all versions
+        """
+        return self.options['symbol_table']
+
+    @property
+    def equations(self):
+        """
+        All expressions of the current version, in document order
+        """
+        return [expression for _, expressions in self.blocks for expression in expressions]
+
+    def load(self, source):
+        """
+        Reads a (new version of a) CellML document, transpiling only the <math> blocks that are
+        not in the current version
+
+        :param source: path or file object of a CellML document
+        :return: ModelChanges relative to the previous version (everything is 'added' on the
+            first load)
+        """
+        blocks = []
+        by_fingerprint = {}
+        reused = transpiled = 0
+        for component_name, math_element in iter_math_elements(source, self.backend):
+            fingerprint = fingerprint_block(math_element).digest
+            expressions = by_fingerprint.get(fingerprint)
+            if expressions is None:
+                expressions = self._by_fingerprint.get(fingerprint)
+            if expressions is None:
+                expressions = parse_dom(math_element, **self.options)
+                transpiled += 1
+            else:
+                reused += 1
+            by_fingerprint[fingerprint] = expressions
+            blocks.append((component_name, list(expressions)))
+
+        previous = self.blocks
+        self.blocks = blocks
+        self._by_fingerprint = by_fingerprint
+        return ModelChanges(*_compare(previous, blocks), reused=reused, transpiled=transpiled)
+
+    def load_string(self, xml_string):
+        """
+        As load(), for a CellML document held in a string
+        """
+        if isinstance(xml_string, str):
+            xml_string = xml_string.encode('utf-8')
+        return self.load(io.BytesIO(xml_string))
+
+
+def _equations_by_lhs(blocks):
+    """
+    Returns an ordered dict mapping (component name, left-hand side) -> equation for all
+    equations in blocks. Expressions that are not equations are keyed by themselves.
+    """
+    equations = collections.OrderedDict()
+    for component_name, expressions in blocks:
+        for expression in expressions:
+            lhs = expression.lhs if hasattr(expression, 'lhs') else expression
+            equations[(component_name, lhs)] = expression
+    return equations
+
+
+def _compare(old_blocks, new_blocks):
+    """
+    Returns the added, removed and changed equations between two versions of a model
+    """
+    old = _equations_by_lhs(old_blocks)
+    new = _equations_by_lhs(new_blocks)
+    added = [equation for key, equation in new.items() if key not in old]
+    removed = [equation for key, equation in old.items() if key not in new]
+    changed = [(old[key], equation) for key, equation in new.items()
+               if key in old and old[key] is not equation and old[key] != equation]
+    return added, removed, changed
@@ -0,0 +1,100 @@
+"""
+Transpiles a CellML document that arrives in chunks, e.g. over the network
+"""
+import asyncio
+import functools
+from xml.etree import ElementTree
+
+from .symbol_table import SymbolTable
+from .transpiler import MathElementFilter, parse_dom
+
+
+class StreamParser(object):
+    """
+    Push parser for CellML documents: feed it the document in chunks of bytes (or str), and read
+    the transpiled <math> blocks as soon as each one is complete. Only the <math> block being read
+    is kept as a tree, so the whole document is never held in memory.
+
+    Usage::
+
+        parser = StreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+            for component_name, expressions in parser.read_blocks():
+                ...
+        parser.close()
+        for component_name, expressions in parser.read_blocks():
+            ...
+
+    The document is parsed with xml.etree.ElementTree.XMLPullParser.
+
+    :param options: transpiler options, see TranspileContext. As for parse_file, all blocks share
+        a single SymbolTable unless one is given.
+    """
+
+    def __init__(self, **options):
+        options.setdefault('symbol_table', SymbolTable())
+        self.options = options
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._filter = MathElementFilter()
+
+    def feed(self, data):
+        """
+        Feeds the next chunk of the document to the parser
+
+        :raises xml.etree.ElementTree.ParseError: if the document is not well-formed
+        """
+        self._parser.feed(data)
+
+    def close(self):
+        """
+        Tells the parser the document is complete. Blocks completed by the last chunk can still be
+        read after this.
+
+        :raises xml.etree.ElementTree.ParseError: if the document is incomplete
+        """
+        self._parser.close()
+
+    def read_blocks(self):
+        """
+        Transpiles and yields the <math> blocks completed by the chunks fed so far
+
+        :return: generator of (component name, list of SymPy expressions) tuples, in document order
+        """
+        for component_name, math_element in self._math_elements():
+            yield component_name, parse_dom(math_element, **self.options)
+
+    def _math_elements(self):
+        """
+        Yields the (component name, <math> element) of the blocks completed by the chunks fed so
+        far, without transpiling them. Each element is freed when the next one is requested.
+        """
+        return self._filter.math_elements(self._parser.read_events())
+
+
+async def parse_async(chunks, **options):
+    """
+    Reads a CellML document from an asynchronous iterable of chunks of bytes (e.g. the body of
+    an HTTP request) and yields the SymPy expressions of each <math> block as soon as it has
+    arrived, so that transpiling overlaps with receiving the rest of the document.
+
+    Usage: ``async for component_name, expressions in parse_async(request.content): ...``
+
+    Each block is transpiled in the event loop's default executor, so that the loop keeps
+    running (e.g. receiving the next chunks) meanwhile. Blocks are still transpiled one at a time,
+    in document order.
+
+    :param chunks: asynchronous iterable of bytes
+    :param options: transpiler options, see StreamParser
+    :return: asynchronous generator of (component name, list of SymPy expressions) tuples
+    """
+    loop = asyncio.get_event_loop()
+    parser = StreamParser(**options)
+    transpile = functools.partial(parse_dom, **parser.options)
+    async for chunk in chunks:
+        parser.feed(chunk)
+        for component_name, math_element in parser._math_elements():
+            yield component_name, await loop.run_in_executor(None, transpile, math_element)
+    parser.close()
+    for component_name, math_element in parser._math_elements():
+        yield component_name, await loop.run_in_executor(None, transpile, math_element)
@@ -0,0 +1,125 @@
+"""
+Interning tables for the leaf nodes and subexpressions of transpiled expressions
+"""
+import collections
+
+from .deferred import sympy
+
+
+class SymbolTable(object):
+    """
+    Builds each symbol, undefined function and numeric constant of a model once, and hands out the
+    same SymPy object every time it is seen again.
+
+    A new table is created for every parse, unless one is passed in (e.g. to share symbols between
+    several models). After parsing, the symbol inventory of the model can be read from the
+    `symbols`, `functions` and `numbers` dicts without walking the expression trees.
+    """
+
+    def __init__(self):
+        # Maps identifier -> sympy.Symbol
+        self.symbols = {}
+        # Maps identifier -> undefined sympy.Function class (used for derivatives)
+        self.functions = {}
+        # Maps float value -> sympy.Number
+        self.numbers = {}
+
+    def symbol(self, name):
+        """
+        Returns the interned sympy.Symbol with the given name
+        """
+        try:
+            return self.symbols[name]
+        except KeyError:
+            symbol = self.symbols[name] = sympy.Symbol(name)
+            return symbol
+
+    def function(self, name):
+        """
+        Returns the interned undefined sympy.Function with the given name
+        """
+        try:
+            return self.functions[name]
+        except KeyError:
+            function = self.functions[name] = sympy.Function(name)
+            return function
+
+    def number(self, value):
+        """
+        Returns the interned sympy.Number for the given float value
+        """
+        try:
+            return self.numbers[value]
+        except KeyError:
+            number = sympy.Number(value)
+            # NaN never compares equal to itself, so there is no point in storing it
+            if value == value:
+                self.numbers[value] = number
+            return number
+
+
+# Counts reported by SubexpressionTable.stats:
+#   lookups: number of <apply> elements looked up in the table
+#   shared: number of lookups that returned an existing object instead of building a new one
+#   unique: number of distinct subexpressions in the table
+SharingStats = collections.namedtuple('SharingStats', ['lookups', 'shared', 'unique'])
+
+
+class SubexpressionTable(object):
+    """
+    Hash-consing table for <apply> elements. Each application is keyed by its operator tag, the
+    identities of its transpiled operands and the transpiler options that change the result (e.g.
+    evaluate=False), so an application that has been built before (from the
+    same, interned, operands) is returned as the existing SymPy object instead of being rebuilt.
+
+    Because symbols and numbers are interned by the SymbolTable, this shares identical
+    subexpressions bottom-up across all equations transpiled with the same table, e.g. a repeated
+    ``exp((V + a) / b)`` becomes a single object.
+    """
+
+    def __init__(self):
+        # Maps (operator tag, operand identities) -> (expression, operands). The operands are kept
+        # so that their ids, which are part of the key, cannot be reused by other objects.
+        self._table = {}
+        self.lookups = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._table)
+
+    @staticmethod
+    def key(operator_tag, operands, mode=()):
+        """
+        Returns the key of an application of the given operator to the transpiled operands
+
+        :param mode: tuple of the options the application is built with, see
+            TranspileContext.output_options()
+        """
+        # Qualifiers such as <bvar><ci>t</ci><degree>..</degree></bvar> transpile to lists
+        return (mode, operator_tag) + tuple(
+            tuple(map(id, operand)) if isinstance(operand, list) else id(operand)
+            for operand in operands)
+
+    def get(self, key):
+        """
+        Returns the expression stored under key, or None
+        """
+        self.lookups += 1
+        entry = self._table.get(key)
+        if entry is None:
+            return None
+        self.shared += 1
+        return entry[0]
+
+    def put(self, key, expression, operands):
+        """
+        Stores an expression built from the given operands under key
+        """
+        self._table[key] = (expression, operands)
+
+    @property
+    def stats(self):
+        """
+        SharingStats for everything transpiled with this table so far
+        """
+        return SharingStats(self.lookups, self.shared, len(self._table))
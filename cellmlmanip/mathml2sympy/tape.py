@@ -0,0 +1,549 @@
+"""
+Compiles Content MathML into a compact linear "tape" that can be evaluated over NumPy arrays,
+without building SymPy expressions.
+
+A tape is a list of instructions in evaluation order. Instruction i computes value i from the
+values of earlier instructions (its operands), so a tape is stored as a handful of flat arrays:
+
+* ``opcodes``: the operation of each instruction, as an index into OPCODES
+* ``operands`` and ``offsets``: the operands of instruction i are
+  ``operands[offsets[i]:offsets[i + 1]]``. These are instruction indices, except for 'load'
+  (an index into ``inputs``) and 'constant' (an index into ``constants``)
+* ``constants``: the constant pool
+* ``inputs``: names of the variables that must be given to Tape.evaluate
+* ``outputs`` and ``output_names``: the instructions holding the result of each top-level
+  expression, and their names
+
+Most operations are named after the MathML element they implement. Top-level equations
+``<apply><eq/><ci>x</ci>...</apply>`` become 'store' instructions named after their left-hand side.
+Derivatives are named e.g. 'd(V)/d(time)'; where one is used on a right-hand side, it is loaded
+like any other variable. As in CellML, the order of the equations does not matter: every use of a
+variable that an equation defines reads the stored value instead of an input (the equation in the
+same <math> block if there is one, else the first in the document), and the instructions are put
+in dependency order when the tape is built.
+
+Tapes are saved and loaded with numpy.savez/numpy.load, see Tape.save and Tape.load.
+"""
+import bisect
+import collections
+import functools
+
+import numpy as np
+
+from .backends import BACKENDS, get_backend
+from .transpiler import (
+    TranspileContext,
+    apply_handler,
+    bvar_handler,
+    cn_value,
+    degree_handler,
+    iter_math_elements,
+    logbase_handler,
+    math_handler,
+    otherwise_handler,
+    piece_handler,
+    transpile,
+)
+
+
+def compile_string(xml_string, backend='minidom'):
+    """
+    Compiles a MathML string (with <math> as its root element) into a Tape
+    """
+    return compile_dom(BACKENDS[backend].parse_string(xml_string))
+
+
+def compile_dom(math_dom_element):
+    """
+    Compiles a <math> element (xml.dom node or ElementTree element) into a Tape
+    """
+    builder = TapeBuilder()
+    builder.add_block(math_dom_element)
+    return builder.build()
+
+
+def compile_file(source, backend='minidom'):
+    """
+    Compiles all <math> blocks of a CellML document into a single Tape, in document order
+
+    :param source: path or file object of a CellML document
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree'
+    """
+    builder = TapeBuilder()
+    for _, math_element in iter_math_elements(source, backend):
+        builder.add_block(math_element)
+    return builder.build()
+
+
+def derivative_name(variable, bound_variable, order=1):
+    """
+    Returns the tape name of the derivative of a variable, e.g. 'd(V)/d(time)'
+    """
+    if order == 1:
+        return 'd(%s)/d(%s)' % (variable, bound_variable)
+    return 'd^%d(%s)/d(%s)^%d' % (order, variable, bound_variable, order)
+
+
+# NUMPY IMPLEMENTATIONS #######################################################################
+
+def _nary(binary):
+    """
+    Returns an n-ary version of a binary NumPy function (e.g. np.add for <plus/>)
+    """
+    def _reduce(*operands):
+        return functools.reduce(binary, operands)
+    return _reduce
+
+
+def _chain(relation):
+    """
+    Returns an n-ary MathML relation: a < b < c holds if a < b and b < c
+    """
+    def _chained(*operands):
+        result = relation(operands[0], operands[1])
+        for first, second in zip(operands[1:-1], operands[2:]):
+            result = np.logical_and(result, relation(first, second))
+        return result
+    return _chained
+
+
+def _reciprocal(function):
+    """
+    Returns 1 / function(x), e.g. sec from cos
+    """
+    def _wrapped(operand):
+        return 1.0 / function(operand)
+    return _wrapped
+
+
+def _of_reciprocal(function):
+    """
+    Returns function(1 / x), e.g. arcsec from arccos
+    """
+    def _wrapped(operand):
+        return function(1.0 / operand)
+    return _wrapped
+
+
+def _minus(left_operand, right_operand=None):
+    if right_operand is None:
+        return np.negative(left_operand)
+    return np.subtract(left_operand, right_operand)
+
+
+def _root(first_operand, second_operand=None):
+    # As for root_handler: with a <degree>, the degree is the first operand
+    if second_operand is None:
+        return np.sqrt(first_operand)
+    return np.power(second_operand, 1.0 / np.asarray(first_operand))
+
+
+def _log(first_operand, second_operand=None):
+    # As for log_handler: with a <logbase>, the base is the first operand
+    if second_operand is None:
+        return np.log10(first_operand)
+    return np.log(second_operand) / np.log(first_operand)
+
+
+def _piecewise(*operands):
+    # Operands are value, condition pairs, optionally followed by the <otherwise> value
+    if len(operands) % 2:
+        default = operands[-1]
+        operands = operands[:-1]
+    else:
+        default = np.nan
+    conditions = [np.asarray(condition, dtype=bool) for condition in operands[1::2]]
+    return np.select(conditions, operands[0::2], default)
+
+
+# NumPy implementations of the operations on values, by opcode name
+OPERATIONS = {
+    'abs': np.abs,
+    'and': _nary(np.logical_and),
+    'arccos': np.arccos,
+    'arccosh': np.arccosh,
+    'arccot': _of_reciprocal(np.arctan),
+    'arccoth': _of_reciprocal(np.arctanh),
+    'arccsc': _of_reciprocal(np.arcsin),
+    'arccsch': _of_reciprocal(np.arcsinh),
+    'arcsec': _of_reciprocal(np.arccos),
+    'arcsech': _of_reciprocal(np.arccosh),
+    'arcsin': np.arcsin,
+    'arcsinh': np.arcsinh,
+    'arctan': np.arctan,
+    'arctanh': np.arctanh,
+    'ceiling': np.ceil,
+    'cos': np.cos,
+    'cosh': np.cosh,
+    'cot': _reciprocal(np.tan),
+    'coth': _reciprocal(np.tanh),
+    'csc': _reciprocal(np.sin),
+    'csch': _reciprocal(np.sinh),
+    'divide': np.divide,
+    'eq': _chain(np.equal),
+    'exp': np.exp,
+    'floor': np.floor,
+    'geq': _chain(np.greater_equal),
+    'gt': _chain(np.greater),
+    'leq': _chain(np.less_equal),
+    'ln': np.log,
+    'log': _log,
+    'lt': _chain(np.less),
+    'max': _nary(np.maximum),
+    'min': _nary(np.minimum),
+    'minus': _minus,
+    'neq': np.not_equal,
+    'not': np.logical_not,
+    'or': _nary(np.logical_or),
+    'piecewise': _piecewise,
+    'plus': _nary(np.add),
+    'power': np.power,
+    'rem': np.mod,
+    'root': _root,
+    'sec': _reciprocal(np.cos),
+    'sech': _reciprocal(np.cosh),
+    'sin': np.sin,
+    'sinh': np.sinh,
+    'tan': np.tan,
+    'tanh': np.tanh,
+    'times': _nary(np.multiply),
+    'xor': _nary(np.logical_xor),
+}
+
+# Values of the MathML constant elements
+CONSTANTS = {
+    'exponentiale': np.e,
+    'false': 0.0,
+    'infinity': np.inf,
+    'notanumber': np.nan,
+    'pi': np.pi,
+    'true': 1.0,
+}
+
+# Opcode names; the opcode of an instruction is its index in this tuple
+OPCODES = ('load', 'constant', 'store') + tuple(sorted(OPERATIONS))
+OPCODE_INDEX = {name: index for index, name in enumerate(OPCODES)}
+LOAD, CONSTANT, STORE = 0, 1, 2
+
+
+# TAPE ########################################################################################
+
+class Tape(object):
+    """
+    A compiled list of instructions, see the module documentation for the layout of the arrays
+    """
+
+    def __init__(self, opcodes, operands, offsets, constants, inputs, outputs, output_names):
+        self.opcodes = np.asarray(opcodes, dtype=np.uint8)
+        self.operands = np.asarray(operands, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.constants = np.asarray(constants, dtype=np.float64)
+        self.inputs = [str(name) for name in inputs]
+        self.outputs = np.asarray(outputs, dtype=np.int32)
+        self.output_names = [str(name) for name in output_names]
+
+        # Unpack into Python lists once, for the evaluation loop
+        self._program = []
+        for index, opcode in enumerate(self.opcodes.tolist()):
+            args = tuple(self.operands[self.offsets[index]:self.offsets[index + 1]].tolist())
+            self._program.append((opcode, OPERATIONS.get(OPCODES[opcode]), args))
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def evaluate(self, inputs):
+        """
+        Evaluates the tape over NumPy arrays. All inputs are broadcast against each other in the
+        usual NumPy way, e.g. pass a 1-d array for V and scalars for the parameters.
+
+        :param inputs: mapping of input name -> value or array, with an entry for every name in
+            ``self.inputs``
+        :return: OrderedDict mapping output name -> value or array
+        """
+        values = [None] * len(self._program)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for index, (opcode, operation, args) in enumerate(self._program):
+                if opcode == LOAD:
+                    values[index] = np.asarray(inputs[self.inputs[args[0]]], dtype=np.float64)
+                elif opcode == CONSTANT:
+                    values[index] = self.constants[args[0]]
+                elif opcode == STORE:
+                    values[index] = values[args[0]]
+                else:
+                    values[index] = operation(*[values[arg] for arg in args])
+        return collections.OrderedDict(
+            (name, values[output]) for name, output in zip(self.output_names, self.outputs))
+
+    def save(self, file):
+        """
+        Saves the tape with numpy.savez
+
+        :param file: path or file object
+        """
+        np.savez(file, opcodes=self.opcodes, opcode_names=np.array(OPCODES),
+                 operands=self.operands, offsets=self.offsets, constants=self.constants,
+                 inputs=np.array(self.inputs, dtype=str), outputs=self.outputs,
+                 output_names=np.array(self.output_names, dtype=str))
+
+    @staticmethod
+    def load(file):
+        """
+        Loads a tape saved with Tape.save
+        """
+        with np.load(file) as data:
+            # Map the saved opcodes by name, in case operations have been added since
+            saved_names = data['opcode_names'].tolist()
+            opcodes = [OPCODE_INDEX[saved_names[opcode]] for opcode in data['opcodes'].tolist()]
+            return Tape(opcodes, data['operands'], data['offsets'], data['constants'],
+                        data['inputs'].tolist(), data['outputs'], data['output_names'].tolist())
+
+
+class TapeBuilder(object):
+    """
+    Collects instructions while MathML is transpiled with the TAPE_HANDLERS, then builds a Tape
+    """
+
+    def __init__(self):
+        # Instructions as (opcode name, operands) tuples
+        self.instructions = []
+        self.names = []
+        self._name_indices = {}
+        self.constants = []
+        self._constant_slots = {}
+        # (output name, instruction index)
+        self.outputs = []
+        # Maps the name of each variable defined by an equation -> its 'store' instructions, in
+        # document order
+        self._stores = {}
+        # Index of the first instruction of each block
+        self._block_starts = []
+
+    def emit(self, opcode, *operands):
+        """
+        Appends an instruction and returns its index
+        """
+        self.instructions.append((opcode, operands))
+        return len(self.instructions) - 1
+
+    def load(self, name):
+        """
+        Emits a load of the named variable
+        """
+        if name not in self._name_indices:
+            self._name_indices[name] = len(self.names)
+            self.names.append(name)
+        return self.emit('load', self._name_indices[name])
+
+    def constant(self, value):
+        """
+        Returns the instruction holding a constant value, emitting it the first time
+        """
+        # Key on the representation: NaN never equals itself
+        key = repr(float(value))
+        if key not in self._constant_slots:
+            self.constants.append(float(value))
+            self._constant_slots[key] = self.emit('constant', len(self.constants) - 1)
+        return self._constant_slots[key]
+
+    def constant_value(self, slot):
+        """
+        Returns the value of a 'constant' instruction
+        """
+        opcode, operands = self.instructions[slot]
+        if opcode != 'constant':
+            raise ValueError('Expected a constant value')
+        return self.constants[operands[0]]
+
+    def loaded_name(self, slot):
+        """
+        Returns the variable name loaded by a 'load' instruction, or None
+        """
+        opcode, operands = self.instructions[slot]
+        return self.names[operands[0]] if opcode == 'load' else None
+
+    def add_block(self, math_dom_element):
+        """
+        Compiles the expressions of a <math> element, and makes them outputs of the tape
+        """
+        context = TranspileContext(handlers=TAPE_HANDLERS, tape=self)
+        self._block_starts.append(len(self.instructions))
+        self.add_outputs(transpile(math_dom_element, context))
+
+    def add_outputs(self, slots):
+        """
+        Turns the top-level expressions of a block into outputs. Equations with a variable or a
+        derivative on the left-hand side are named after it.
+        """
+        for slot in slots:
+            opcode, operands = self.instructions[slot]
+            name = None
+            if opcode == 'eq' and len(operands) == 2:
+                name = self.loaded_name(operands[0])
+            if name is not None:
+                self.instructions[slot] = ('store', (operands[1],))
+                self._stores.setdefault(name, []).append(slot)
+            else:
+                name = '_%d' % len(self.outputs)
+                slot = self.emit('store', slot)
+            self.outputs.append((name, slot))
+
+    def build(self):
+        """
+        Returns the finished Tape. Loads of variables defined by an equation are replaced by the
+        stored value, the instructions are put in dependency order, and instructions that no
+        output depends on are dropped.
+
+        :raises ValueError: if equations depend on each other in a cycle
+        """
+        # Map each instruction to the one that provides its value
+        alias = list(range(len(self.instructions)))
+        for index, (opcode, operands) in enumerate(self.instructions):
+            if opcode == 'load':
+                stores = self._stores.get(self.names[operands[0]])
+                if stores:
+                    block = bisect.bisect_right(self._block_starts, index)
+                    alias[index] = next(
+                        (store for store in stores
+                         if bisect.bisect_right(self._block_starts, store) == block), stores[0])
+
+        # Order the instructions the outputs depend on with a depth-first search from each output,
+        # in document order. An instruction is False while its operands are being visited, so
+        # meeting one of those again means the equations are cyclic.
+        order = []
+        done = {}
+        store_names = {slot: name for name, slot in self.outputs}
+        for _, slot in self.outputs:
+            stack = [slot]
+            while stack:
+                index = stack[-1]
+                if done.get(index) is not None:
+                    stack.pop()
+                    if not done[index]:
+                        done[index] = True
+                        order.append(index)
+                    continue
+                done[index] = False
+                opcode, operands = self.instructions[index]
+                if opcode in ('load', 'constant'):
+                    continue
+                for operand in operands:
+                    operand = alias[operand]
+                    if done.get(operand) is False:
+                        raise ValueError('Cyclic definition of %s'
+                                         % store_names.get(operand, 'a variable'))
+                    if operand not in done:
+                        stack.append(operand)
+
+        # Renumber the ordered instructions, and pack them into arrays
+        new_index = {}
+        opcodes, flat_operands, offsets, inputs, input_index = [], [], [0], [], {}
+        for index in order:
+            opcode, operands = self.instructions[index]
+            new_index[index] = len(opcodes)
+            if opcode == 'load':
+                name = self.names[operands[0]]
+                if name not in input_index:
+                    input_index[name] = len(inputs)
+                    inputs.append(name)
+                operands = (input_index[name],)
+            elif opcode != 'constant':
+                operands = tuple(new_index[alias[operand]] for operand in operands)
+            opcodes.append(OPCODE_INDEX[opcode])
+            flat_operands.extend(operands)
+            offsets.append(len(flat_operands))
+
+        return Tape(opcodes, flat_operands, offsets, self.constants, inputs,
+                    [new_index[slot] for _, slot in self.outputs],
+                    [name for name, _ in self.outputs])
+
+
+# TAPE HANDLERS ###############################################################################
+#
+# The same interface as the SymPy handlers in transpiler.py, but values are instruction indices.
+# Operator elements return a callback that emits the instruction when <apply> calls it.
+
+def ci_handler(node, children, context):
+    """
+    Loads a variable into a slot
+    MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.ci
+    """
+    return context.tape.load(get_backend(node).text(node))
+
+
+def cn_handler(node, children, context):
+    """
+    Stores a number as a constant
+    MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.cn
+    """
+    return context.tape.constant(cn_value(node))
+
+
+def piecewise_handler(node, children, context):
+    """
+    Emits one instruction taking the (value, condition) slots of all pieces, in order
+    MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.piecewise
+    """
+    operands = []
+    for value, condition in children:
+        operands.append(value)
+        if condition is not True:
+            operands.append(condition)
+    return context.tape.emit('piecewise', *operands)
+
+
+def diff_handler(node, children, context):
+    """
+    Loads the derivative of a state variable by name, like a variable: the value stored by its
+    equation where the tape defines it, otherwise an input
+    MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.diff
+    """
+    tape = context.tape
+
+    def _wrapped_diff(x_slot, y_slot):
+        # As for the SymPy handler, x is a list if the <bvar> has a <degree>
+        order = 1
+        if isinstance(x_slot, list):
+            x_slot, order = x_slot[0], int(tape.constant_value(x_slot[1]))
+        return tape.load(derivative_name(tape.loaded_name(y_slot), tape.loaded_name(x_slot),
+                                         order))
+    return _wrapped_diff
+
+
+def operator_handler(node, children, context):
+    """
+    Handles all elements implemented by a single instruction
+    """
+    tape = context.tape
+    opcode = get_backend(node).tag(node)
+
+    def _wrapped_operator(*operands):
+        return tape.emit(opcode, *operands)
+    return _wrapped_operator
+
+
+def constant_handler(node, children, context):
+    """
+    Stores the value of a constant element such as <pi/> or <exponentiale/>
+    MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.pi
+    """
+    return context.tape.constant(CONSTANTS[get_backend(node).tag(node)])
+
+
+# Mapping MathML tag element names to handlers producing tape instructions
+TAPE_HANDLERS = {
+    'apply': apply_handler,
+    'bvar': bvar_handler,
+    'ci': ci_handler,
+    'cn': cn_handler,
+    'degree': degree_handler,
+    'diff': diff_handler,
+    'logbase': logbase_handler,
+    'math': math_handler,
+    'otherwise': otherwise_handler,
+    'piece': piece_handler,
+    'piecewise': piecewise_handler,
+}
+for tagName in OPERATIONS:
+    TAPE_HANDLERS.setdefault(tagName, operator_handler)
+for tagName in CONSTANTS:
+    TAPE_HANDLERS[tagName] = constant_handler
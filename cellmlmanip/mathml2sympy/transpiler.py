@@ -4,158 +4,649 @@ Parses Content MathML and returns equivalent SymPy expressions
 Content Markup specification: https://www.w3.org/TR/MathML2/chapter4.html
 """
 import logging
-from xml.dom import Node, minidom
+from xml.dom import pulldom
+from xml.etree import ElementTree
 
-import sympy
+from .backends import BACKENDS, ElementTreeBackend, get_backend
+from .deferred import sympy
+from .lazy import lazy_block
+from .symbol_table import SymbolTable
 
 
-def parse_string(xml_string):
+def sympy_evaluate(value):
+    """
+    Returns SymPy's context manager that turns automatic evaluation on or off. It is looked up on
+    each call, so that SymPy is only imported once expressions are built.
+    """
+    try:
+        from sympy.core.parameters import evaluate
+    except ImportError:  # SymPy < 1.6
+        from sympy.core.evaluate import evaluate
+    return evaluate(value)
+
+
+def parse_string(xml_string, backend='minidom', **options):
     """
     Reads MathML content from a string and returns equivalent SymPy expressions
+
+    :param xml_string: MathML document with <math> as its root element
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree' (ElementTree, which is
+        faster and uses less memory)
+    :param options: transpiler options, see TranspileContext
+    """
+    return parse_dom(BACKENDS[backend].parse_string(xml_string), **options)
+
+
+def parse_file(source, backend='minidom', **options):
+    """
+    Reads a CellML document and yields the SymPy expressions of each <math> block as soon as it
+    has been read. The document is streamed (with pulldom or ElementTree.iterparse), so only one
+    <math> block is held as a tree at a time and it is freed once it has been transpiled.
+
+    :param source: path or file object of a CellML document
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree'
+    :param options: transpiler options, see TranspileContext. All blocks of the document share a
+        single SymbolTable, unless one is given.
+    :return: generator of (component name, list of SymPy expressions) tuples, in document order
+    """
+    options.setdefault('symbol_table', SymbolTable())
+    for component_name, math_element in iter_math_elements(source, backend):
+        yield component_name, parse_dom(math_element, **options)
+
+
+def iter_math_elements(source, backend='minidom'):
+    """
+    Streams a CellML document and yields each <math> element as soon as it has been read. Each
+    element is freed when the next one is requested, so it must not be used after that.
+
+    :param source: path or file object of a CellML document
+    :param backend: XML tree used for parsing, either 'minidom' or 'etree'
+    :return: generator of (component name, <math> element) tuples, in document order
+    """
+    if BACKENDS[backend] is ElementTreeBackend:
+        return _iterparse_math_elements(source)
+    return _pulldom_math_elements(source)
+
+
+def _pulldom_math_elements(source):
+    """
+    Implements iter_math_elements() for the minidom backend
+    """
+    document = pulldom.parse(source)
+    component_name = None
+    for event, node in document:
+        if event == pulldom.START_ELEMENT:
+            if node.localName == 'component':
+                component_name = node.getAttribute('name')
+            elif node.localName == 'math':
+                document.expandNode(node)
+                yield component_name, node
+                # Break the parent/child reference cycles so the block can be freed straight away
+                node.unlink()
+        elif event == pulldom.END_ELEMENT and node.localName == 'component':
+            component_name = None
+
+
+def _iterparse_math_elements(source):
+    """
+    Implements iter_math_elements() for the ElementTree backend
+    """
+    events = ElementTree.iterparse(source, events=('start', 'end'))
+    return MathElementFilter().math_elements(events)
+
+
+class MathElementFilter(object):
+    """
+    Picks the <math> elements out of a stream of ElementTree ('start', element) and ('end',
+    element) events, such as those of ElementTree.iterparse or XMLPullParser.read_events, and
+    frees everything else as soon as it has been read. The stream may arrive in several parts
+    (one call to math_elements per part).
     """
-    dom = minidom.parseString(xml_string)
-    return parse_dom(dom.childNodes[0])
 
+    def __init__(self):
+        self.component_name = None
+        self.root = None
+        self.depth = 0
 
-def parse_dom(math_dom_element):
+    def math_elements(self, events):
+        """
+        Yields a (component name, <math> element) tuple for each <math> element that is completed
+        by the given events. Each element is freed when the next one is requested.
+        """
+        for event, element in events:
+            tag = ElementTreeBackend.tag(element)
+            if event == 'start':
+                if self.root is None:
+                    self.root = element
+                self.depth += 1
+                if tag == 'component':
+                    self.component_name = element.get('name')
+            else:
+                self.depth -= 1
+                if tag == 'math':
+                    yield self.component_name, element
+                    element.clear()
+                elif tag == 'component':
+                    self.component_name = None
+                # Drop everything read so far once each top-level element is finished
+                if self.depth == 1:
+                    self.root.clear()
+
+
+def parse_dom(math_dom_element, lazy=False, **options):
     """
     Accepts a <math> node of DOM structure and returns equivalent SymPy expressions.
     Note: math_dom_element must point the <math> XmlNode, not the root XmlDocument
 
-    :param math_dom_element: <math> XmlNode object of a MathML DOM structure
+    :param math_dom_element: <math> XmlNode object of a MathML DOM structure, or a <math>
+        xml.etree.ElementTree.Element
+    :param lazy: if True, return a LazyBlock of LazyEquation placeholders instead, each of which
+        is only transpiled when its expression is read. The children of the <math> element are
+        moved into the placeholders. Can't be combined with the cache, index and profile options,
+        which work on whole blocks.
+    :param options: transpiler options, see TranspileContext
     :return: List of SymPy expression(s)
     """
-    return transpile(math_dom_element)
-
+    context = TranspileContext(**options)
+    if lazy:
+        if context.cache is not None or context.index is not None or context.profile is not None:
+            raise ValueError('The cache, index and profile options are not supported with '
+                             'lazy=True')
+        return lazy_block(math_dom_element, context)
+    if context.cache is None:
+        return context.transpile(math_dom_element)
+
+    # Look the block up by its serialised XML, and only transpile it if it hasn't been seen before
+    xml = get_backend(math_dom_element).to_xml(math_dom_element).encode('utf-8')
+    key = context.cache.key(xml, *context.output_options())
+    expressions = context.cache.get(key, context.symbol_table)
+    if expressions is None:
+        expressions = context.transpile(math_dom_element)
+        context.cache.put(key, expressions)
+    elif context.index is not None:
+        context.index.add_block(expressions)
+    return expressions
+
+
+class TranspileContext(object):
+    """
+    Holds the state shared by the handlers while transpiling
+
+    :param symbol_table: SymbolTable used to intern symbols, functions and numbers. Pass the same
+        table to several parses to share the objects between them, and to collect the symbol
+        inventory of a model. A new table is made if not given.
+    :param trace: optional callback ``trace(tag, node, result)``, called after each element has
+        been transpiled (children before parents). See log_trace for an example. Tracing costs
+        nothing when no callback is given.
+    :param engine: 'iterative' (default) walks the tree with an explicit stack, so it is not
+        limited by the Python recursion limit; 'recursive' is the original recursive descent
+    :param cache: optional ExpressionCache, checked by parse_dom before transpiling a <math> block.
+        The trace callback is not called for blocks loaded from the cache.
+    :param subexpressions: optional SubexpressionTable. If given, identical <apply> elements share a
+        single SymPy object (across all parses using the table); its ``stats`` report how much
+        was shared.
+    :param evaluate: if False, expressions are built exactly as written, without SymPy's automatic
+        simplification (canonical ordering, combining terms etc.), which is much faster
+    :param canonicalize: with evaluate=False, rebuild the finished expressions once with SymPy's
+        normal evaluation (see canonicalize()), giving the same result as evaluate=True
+    :param handlers: table mapping MathML tags to handlers, HANDLERS by default. Other tables turn
+        MathML into something other than SymPy expressions (see tape.TAPE_HANDLERS).
+    :param index: optional EquationIndex, to which the transpiled expressions are added together
+        with the variables they define and use
+    :param profile: optional TranspileProfile, which times every handler call and collects
+        statistics per tag and per <math> block
+    :param bindings: optional dict mapping variable names to values. Bound variables are read as
+        numbers, so that constant subexpressions are folded and piecewise branches with constant
+        conditions are pruned as the expressions are built (with evaluate=False too). Bound
+        variables must not be differentiated. An equation that defines a bound variable is
+        overridden by the binding: it is transpiled as variable = bound value.
+    :param tape: the tape.TapeBuilder that the tape handlers emit instructions to, if they are
+        used
+    """
+
+    def __init__(self, symbol_table=None, trace=None, engine='iterative', cache=None,
+                 subexpressions=None, evaluate=True, canonicalize=False, handlers=None,
+                 index=None, profile=None, bindings=None, tape=None):
+        self.symbol_table = symbol_table if symbol_table is not None else SymbolTable()
+        self.trace = trace
+        self.engine = ENGINES[engine]
+        self.cache = cache
+        self.subexpressions = subexpressions
+        self.evaluate = evaluate
+        self.canonicalize = canonicalize
+        self.handlers = handlers if handlers is not None else HANDLERS
+        self.index = index
+        self.profile = profile
+        self.bindings = bindings or None
+        self.tape = tape
+        # The top-level equations that define a bound variable, in the block being transpiled
+        self.bound_definitions = set()
+        # The options that change the built expressions, so that a SubexpressionTable shared
+        # between parses in different modes never returns an expression built in another mode
+        self.mode = tuple(self.output_options())
+        if profile is not None:
+            self.handlers = profile.wrap(self.handlers)
+
+    def transpile(self, xml_node):
+        """
+        Transpiles the children of xml_node with the engine and evaluation mode of this context
+        """
+        if self.profile is not None:
+            self.profile.start_block()
+        if self.bindings is not None:
+            self.find_bound_definitions(get_backend(xml_node).children(xml_node))
+        if self.evaluate:
+            expressions = self.engine(xml_node, self)
+        else:
+            with sympy_evaluate(False):
+                expressions = self.engine(xml_node, self)
+        if self.profile is not None:
+            self.profile.end_block(expressions)
+        if not self.evaluate and self.canonicalize:
+            expressions = canonicalize(expressions)
+        if self.index is not None:
+            self.index.add_block(expressions)
+        return expressions
+
+    def transpile_element(self, xml_element):
+        """
+        Transpiles a single element (e.g. one equation of a <math> block) and returns its result
+        """
+        backend = get_backend(xml_element)
+        tag_name = backend.tag(xml_element)
+        if tag_name not in self.handlers:
+            raise NotImplementedError('No handler for element <%s>' % tag_name)
+        if self.bindings is not None:
+            self.find_bound_definitions([xml_element])
+        with sympy_evaluate(self.evaluate):
+            children = None if tag_name in TOKEN_ELEMENTS else self.engine(xml_element, self)
+            result = self.handlers[tag_name](xml_element, children, self)
+        if self.trace is not None:
+            self.trace(tag_name, xml_element, result)
+        if not self.evaluate and self.canonicalize:
+            result, = canonicalize([result])
+        return result
 
-def transpile(xml_node):
+    def find_bound_definitions(self, elements):
+        """
+        Finds the equations among the given top-level elements (e.g. the children of a <math>
+        element) whose left-hand side is a bound variable. Equations nested in other elements, such
+        as the conditions of a <piecewise>, are left alone.
+        """
+        self.bound_definitions = set()
+        for element in elements:
+            backend = get_backend(element)
+            if backend.tag(element) != 'apply':
+                continue
+            children = list(backend.children(element))
+            if len(children) == 3 and backend.tag(children[0]) == 'eq' and \
+                    backend.tag(children[1]) == 'ci' and backend.text(children[1]) in self.bindings:
+                self.bound_definitions.add(element)
+
+    def output_options(self):
+        """
+        Returns strings describing the (non-default) options that change the transpiled
+        expressions, e.g. to include in cache keys
+        """
+        options = []
+        if not self.evaluate:
+            options.append('evaluate=False')
+            if self.canonicalize:
+                options.append('canonicalize=True')
+        if self.bindings is not None:
+            options.append('bindings=%r' % sorted(self.bindings.items()))
+        return options
+
+
+def canonicalize(expressions):
+    """
+    Rebuilds expressions that were transpiled with evaluate=False using SymPy's normal evaluation,
+    bottom-up in a single pass. Subexpressions that are shared between (or within) the expressions
+    are only rebuilt once.
+
+    :param expressions: list of SymPy expressions
+    :return: list of evaluated SymPy expressions
+    """
+    # Maps id of an original subexpression -> its rebuilt version. The originals stay alive while
+    # the expressions do, so ids can't be reused during the pass.
+    rebuilt = {}
+    stack = list(expressions)
+    while stack:
+        expression = stack[-1]
+        if id(expression) in rebuilt:
+            stack.pop()
+            continue
+        pending = [arg for arg in expression.args if id(arg) not in rebuilt]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        if expression.args:
+            args = [rebuilt[id(arg)] for arg in expression.args]
+            rebuilt[id(expression)] = expression.func(*args)
+        else:
+            rebuilt[id(expression)] = expression
+    return [rebuilt[id(expression)] for expression in expressions]
+
+
+def log_trace(tag, node, result):
+    """
+    Trace callback that logs every transpiled element at DEBUG level. The element is only
+    serialised when DEBUG logging is actually enabled.
+
+    Usage: ``parse_string(xml_string, trace=log_trace)``
+    """
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('Transpiled node %s ⟶ %s', get_backend(node).to_xml(node), result)
+
+
+def transpile(xml_node, context=None):
     """
     Descends the given MathML element node and calls the corresponding handler for child elements.
     Returns the SymPy expression of node
+
+    The tree is walked with an explicit stack rather than by recursion, so arbitrarily deep MathML
+    (e.g. machine-generated chains of <apply>) can be transpiled. The children of an element are
+    transpiled before its handler is called, except for token elements (see TOKEN_ELEMENTS) whose
+    handlers read the content themselves.
+
     :param xml_node: a DOM element of parsed MathML
+    :param context: TranspileContext shared by the handlers (a new one is made if not given)
     :return: a list of SymPy expressions
     """
+    if context is None:
+        context = TranspileContext()
+    backend = get_backend(xml_node)
+    handlers = context.handlers
+    trace = context.trace
+    index = context.index
+
     # Collect the parsed expression(s) (i.e. SymPy output) into list
     sympy_expressions = []
 
-    # For each child element of this DOM node
-    for child_node in xml_node.childNodes:
-        # If this is a Text node (no child nodes)
-        if child_node.nodeType == Node.TEXT_NODE:
-            # We should be handling text between tags explicitly in the handler
-            # (see cn_handler for an example), show a message
-            text = child_node.data.strip()
-            if text:
-                logging.warning('Unhandled text node in <%s>: "%s"', child_node.tagName, text)
-        elif child_node.nodeType == child_node.ELEMENT_NODE:
-            # Call the appropriate MathML handler function for this tag
-            tag_name = child_node.tagName
-            if tag_name in HANDLERS:
-                sympy_expressions.append(HANDLERS[tag_name](child_node))
-                logging.debug('Transpiled node %s ⟶ %s', child_node.toxml(), sympy_expressions[-1])
-            else:
+    # Each frame holds an element, its tag, an iterator over its element children (the backend
+    # skips comments etc.) and the list of its transpiled children so far
+    stack = [(xml_node, None, backend.children(xml_node), sympy_expressions)]
+    while stack:
+        node, tag_name, child_nodes, results = stack[-1]
+        for child_node in child_nodes:
+            child_tag = backend.tag(child_node)
+            if child_tag not in handlers:
                 # MathML handler function not found for this tag!
-                raise NotImplementedError('No handler for element <%s>' % tag_name)
-        elif child_node.nodeType not in [Node.COMMENT_NODE, Node.PROCESSING_INSTRUCTION_NODE]:
-            raise NotImplementedError('Unknown node type %d' % child_node.nodeType)
+                raise NotImplementedError('No handler for element <%s>' % child_tag)
+            if child_tag in TOKEN_ELEMENTS:
+                result = handlers[child_tag](child_node, None, context)
+                if trace is not None:
+                    trace(child_tag, child_node, result)
+                results.append(result)
+                if index is not None and len(stack) == 1:
+                    index.end_expression()
+            else:
+                # Descend; this frame's iterator carries on from here once the child is done
+                stack.append((child_node, child_tag, backend.children(child_node), []))
+                break
+        else:
+            # All children have been transpiled, so the element itself can be
+            stack.pop()
+            if stack:
+                result = handlers[tag_name](node, results, context)
+                if trace is not None:
+                    trace(tag_name, node, result)
+                stack[-1][3].append(result)
+                if index is not None and len(stack) == 1:
+                    index.end_expression()
+    return sympy_expressions
+
+
+def transpile_recursive(xml_node, context=None, top_level=True):
+    """
+    Recursive version of transpile(), giving identical results. Every level of MathML nesting
+    costs several Python frames, so very deep expressions can exceed the recursion limit.
+
+    :param xml_node: a DOM element of parsed MathML
+    :param context: TranspileContext shared by the handlers (a new one is made if not given)
+    :param top_level: False when called for the children of a nested element
+    :return: a list of SymPy expressions
+    """
+    if context is None:
+        context = TranspileContext()
+
+    # Collect the parsed expression(s) (i.e. SymPy output) into list
+    sympy_expressions = []
+
+    # For each child element of this node (the backend skips comments etc.)
+    backend = get_backend(xml_node)
+    for child_node in backend.children(xml_node):
+        # Call the appropriate MathML handler function for this tag
+        tag_name = backend.tag(child_node)
+        if tag_name in context.handlers:
+            if tag_name in TOKEN_ELEMENTS:
+                children = None
+            else:
+                children = transpile_recursive(child_node, context, top_level=False)
+            result = context.handlers[tag_name](child_node, children, context)
+            if context.trace is not None:
+                context.trace(tag_name, child_node, result)
+            sympy_expressions.append(result)
+            if top_level and context.index is not None:
+                context.index.end_expression()
+        else:
+            # MathML handler function not found for this tag!
+            raise NotImplementedError('No handler for element <%s>' % tag_name)
     return sympy_expressions
 
 
 # MATHML ELEMENT HANDLERS ######################################################################
+#
+# Every handler is called as handler(node, children, context), where children is the list of
+# transpiled child elements of node (None for TOKEN_ELEMENTS) and context is the TranspileContext.
 
-def math_handler(node):
+def math_handler(node, children, context):
     """
     Descend XML node <math>...</math>
     """
-    result = transpile(node)
+    result = children
     return result
 
 
 # TOKEN ELEMENTS ###############################################################################
 
-def ci_handler(node):
+def ci_handler(node, children, context):
     """
     MathML:  https://www.w3.org/TR/MathML2/chapter4.html#contm.ci
     SymPy: http://docs.sympy.org/latest/modules/core.html#id17
     """
-    identifier = node.childNodes[0].data.strip()
-    return sympy.Symbol(identifier)
+    identifier = get_backend(node).text(node)
+    if context.bindings is not None and identifier in context.bindings:
+        return context.symbol_table.number(float(context.bindings[identifier]))
+    symbol = context.symbol_table.symbol(identifier)
+    if context.index is not None:
+        context.index.seen(symbol)
+    return symbol
 
 
-def cn_handler(node):
+def cn_handler(node, children, context):
     """
     MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.cn
     SymPy: http://docs.sympy.org/latest/modules/core.html#number
     """
+    # Numbers typed as integer or rational are kept exact
+    number_type = get_backend(node).attribute(node, 'type')
+    if number_type == 'integer':
+        return sympy.Integer(get_backend(node).text(node))
+    if number_type == 'rational':
+        numerator, denominator = cn_parts(node)
+        return sympy.Rational(int(numerator), int(denominator))
+    return context.symbol_table.number(cn_value(node))
+
+
+def cn_value(node):
+    """
+    Returns the value of a <cn> element as a float
+    """
+    backend = get_backend(node)
 
     # If this number is using scientific notation
-    if 'type' in node.attributes:
-        if node.attributes['type'].value == 'e-notation':
+    number_type = backend.attribute(node, 'type')
+    if number_type is not None and number_type != 'real':
+        if number_type == 'e-notation':
             # A real number may also be presented in scientific notation. Such numbers have two
             # parts (a mantissa and an exponent) separated by sep. The first part is a real number,
             # while the second part is an integer exponent indicating a power of the base.
             # For example, 12.3<sep/>5 represents 12.3 times 10^5. The default presentation of
             # this example is 12.3e5.
-            if len(node.childNodes) == 3 and node.childNodes[1].tagName == 'sep':
-                mantissa = node.childNodes[0].data.strip()
-                exponent = int(node.childNodes[2].data.strip())
-                return sympy.Float('%se%d' % (mantissa, exponent))
-            else:
-                raise SyntaxError('Expecting <cn type="e-notation">significand<sep/>exponent</cn>.'
-                                  'Got: ' + node.toxml())
-        raise NotImplementedError('Unimplemented type attribute for <cn>: '
-                                  + node.attributes['type'].value)
+            mantissa, exponent = cn_parts(node)
+            return float('%se%d' % (mantissa, int(exponent)))
+        if number_type == 'integer':
+            return float(int(backend.text(node)))
+        if number_type == 'rational':
+            # A rational number is given as numerator<sep/>denominator
+            numerator, denominator = cn_parts(node)
+            return int(numerator) / int(denominator)
+        raise NotImplementedError('Unimplemented type attribute for <cn>: ' + number_type)
+
+    return float(backend.text(node))
+
 
-    number = float(node.childNodes[0].data.strip())
-    return sympy.Number(number)
+def cn_parts(node):
+    """
+    Returns the two parts of a <cn> element separated by <sep/>, e.g. ['12.3', '5'] for
+    <cn type="e-notation">12.3<sep/>5</cn>
+    """
+    backend = get_backend(node)
+    parts = backend.separated_text(node)
+    if parts is None or len(parts) != 2:
+        number_type = backend.attribute(node, 'type')
+        expected = {'e-notation': 'significand<sep/>exponent',
+                    'rational': 'numerator<sep/>denominator'}[number_type]
+        raise SyntaxError('Expecting <cn type="%s">%s</cn>.Got: %s'
+                          % (number_type, expected, backend.to_xml(node)))
+    return parts
 
 
 # BASIC CONTENT ELEMENTS #######################################################################
 
-def apply_handler(node):
+def apply_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.apply
     """
-    result = transpile(node)
-
-    logging.debug('Result of <apply>:\n\t%s\t⟶\t%s', node.toxml(), result)
-
-    if len(result) > 1:
-        expression = result[0](*(result[1:]))
-    else:
-        expression = result[0]
-    return expression
+    result = children
 
+    if len(result) == 1:
+        return result[0]
 
-def piecewise_handler(node):
+    if context.bindings is not None:
+        folded = fold_constants(node, result, context)
+        if folded is not None:
+            return folded
+
+    # With hash-consing, return the existing object if this operator has been applied to the same
+    # operands before
+    table = context.subexpressions
+    if table is not None:
+        backend = get_backend(node)
+        key = table.key(backend.tag(next(backend.children(node))), result[1:], context.mode)
+        expression = table.get(key)
+        if expression is None:
+            expression = result[0](*(result[1:]))
+            table.put(key, expression, result[1:])
+        return expression
+
+    return result[0](*(result[1:]))
+
+
+def fold_constants(node, children, context):
+    """
+    Returns the folded value of an <apply> element whose operands are (partly) constant, or None
+    if nothing can be folded. Only used with bindings: with evaluate=True SymPy folds constants
+    itself. An equation that defines a bound variable is replaced by variable = bound value.
+    """
+    operator, operands = children[0], children[1:]
+    backend = get_backend(node)
+    if node in context.bound_definitions:
+        lhs = list(backend.children(node))[1]
+        return sympy.Eq(context.symbol_table.symbol(backend.text(lhs)), operands[0])
+    tag = backend.tag(next(backend.children(node)))
+    if context.evaluate:
+        return None
+
+    from sympy.logic.boolalg import BooleanAtom
+
+    constants = [operand for operand in operands
+                 if getattr(operand, 'is_number', False) or isinstance(operand, BooleanAtom)]
+    if len(constants) == len(operands):
+        with sympy_evaluate(True):
+            return operator(*operands)
+    if not constants:
+        return None
+
+    if tag in ('plus', 'times'):
+        # Combine the constant terms of a sum or factors of a product
+        with sympy_evaluate(True):
+            constant = operator(*constants)
+        if tag == 'times' and _equals(constant, 0):
+            return constant
+        variables = [operand for operand in operands if operand not in constants]
+        if not _equals(constant, 0 if tag == 'plus' else 1):
+            variables.insert(0, constant)
+        return variables[0] if len(variables) == 1 else operator(*variables)
+    if tag == 'minus' and len(operands) == 2 and _equals(operands[1], 0) or \
+            tag in ('divide', 'power') and _equals(operands[1], 1):
+        return operands[0]
+    return None
+
+
+def _equals(expression, number):
+    """
+    Whether an expression is a SymPy number equal to the given number (SymPy does not consider
+    Float(1.0) and Integer(1) equal)
+    """
+    return expression.is_Number and float(expression) == number
+
+
+def piecewise_handler(node, children, context):
     """
     MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.piecewise
     SymPy: http://docs.sympy.org/latest/modules/functions/elementary.html#piecewise
 
     constructor, zero or more <piece>, zero or one <otherwise>
     """
-    result = transpile(node)
+    result = children
+    if context.bindings is not None and not context.evaluate:
+        # Drop the pieces that can never be chosen, as SymPy does when it evaluates
+        pieces = []
+        for expression, condition in result:
+            if condition == sympy.false:
+                continue
+            pieces.append((expression, condition))
+            if condition == sympy.true:
+                break
+        if not pieces:
+            return sympy.nan
+        if pieces[0][1] == sympy.true:
+            return pieces[0][0]
+        result = pieces
     return sympy.Piecewise(*result)
 
 
-def piece_handler(node):
+def piece_handler(node, children, context):
     """
     MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.piecewise
     Returns a 2-tuple defining an expression and condition
     <piece> element contains exactly two children
     """
-    result = transpile(node)
+    result = children
     if len(result) != 2:
         raise ValueError('Need exactly 2 children for <piece>')
     return result[0], result[1]
 
 
-def otherwise_handler(node):
+def otherwise_handler(node, children, context):
     """
     MathML: https://www.w3.org/TR/MathML2/chapter4.html#contm.piecewise
     Returns a 2-tuple defining an expression and condition
     """
-    result = transpile(node)
+    result = children
     if len(result) != 1:
         raise ValueError('More than 1 child for <otherwise>')
     return result[0], True
@@ -163,7 +654,7 @@ def otherwise_handler(node):
 
 # ARITHMETIC, ALGEBRA AND LOGIC ################################################################
 
-def minus_handler(node):
+def minus_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.minus
     unary arithmetic operator OR binary arithmetic operator
@@ -184,7 +675,7 @@ def minus_handler(node):
     return _wrapped_minus
 
 
-def divide_handler(node):
+def divide_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.divide
     binary arithmetic operator
@@ -197,7 +688,7 @@ def divide_handler(node):
     return _wrapped_divide
 
 
-def power_handler(node):
+def power_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.power
     binary arithmetic operator
@@ -208,7 +699,7 @@ def power_handler(node):
     return _wrapped_power
 
 
-def root_handler(node):
+def root_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.root
     operator taking qualifiers
@@ -227,43 +718,50 @@ def root_handler(node):
     return _wrapped_root
 
 
-def degree_handler(node):
+def degree_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.degree
     Meaning of <degree> depends on context! We implement it for order of <bvar> in <diff> and
     the kind of root in <root>
     """
-    result = transpile(node)
+    result = children
     if len(result) != 1:
         raise ValueError('Expected single value in <degree> tag.'
-                         'Got: ' + node.toxml())
+                         'Got: ' + get_backend(node).to_xml(node))
     return result[0]
 
 
 # CALCULUS AND VECTOR CALCULUS #################################################################
 
-def diff_handler(node):
+def diff_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.diff
     operator taking qualifiers
     """
     def _wrapped_diff(x_symbol, y_symbol, evaluate=False):
+        bound_variable = x_symbol[0] if isinstance(x_symbol, list) else x_symbol
+        if not isinstance(y_symbol, sympy.Symbol) or not isinstance(bound_variable, sympy.Symbol):
+            raise ValueError('Bound variables must not appear in derivatives, got d(%s)/d(%s)'
+                             % (y_symbol, bound_variable))
         # dx / dy
-        y_function = sympy.Function(y_symbol.name)
+        y_function = context.symbol_table.function(y_symbol.name)
 
         # if bound variable element <bvar> contains <degree>, argument x_symbol is a list,
         # otherwise, it is a symbol
         if isinstance(x_symbol, list) and len(x_symbol) == 2:
             bound_variable = x_symbol[0]
             order = int(x_symbol[1])
-            return sympy.Derivative(y_function(bound_variable), bound_variable, order,
-                                    evaluate=evaluate)
-
-        return sympy.Derivative(y_function(x_symbol), x_symbol, evaluate=evaluate)
+            derivative = sympy.Derivative(y_function(bound_variable), bound_variable, order,
+                                          evaluate=evaluate)
+        else:
+            derivative = sympy.Derivative(y_function(x_symbol), x_symbol, evaluate=evaluate)
+        if context.index is not None:
+            context.index.seen(derivative)
+        return derivative
     return _wrapped_diff
 
 
-def bvar_handler(node):
+def bvar_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.bvar
     NASTY: bvar element depends on the context it is being used
@@ -272,19 +770,19 @@ def bvar_handler(node):
 
     The bound variable <bvar> can also specify degree. In this case, we'll have two elements
     """
-    result = transpile(node)
+    result = children
     if len(result) == 1:
         # Bound variable without specifying degree
         return result[0]
     elif len(result) == 2:
         return result
     else:
-        raise SyntaxError("Don't know how to handle <bvar> " + node.toxml())
+        raise SyntaxError("Don't know how to handle <bvar> " + get_backend(node).to_xml(node))
 
 
 # ELEMENTARY CLASSICAL FUNCTIONS ###############################################################
 
-def log_handler(node):
+def log_handler(node, children, context):
     """
     https://www.w3.org/TR/MathML2/chapter4.html#contm.log
     operator taking qualifiers or a unary calculus operator
@@ -299,7 +797,7 @@ def log_handler(node):
     return _wrapped_log
 
 
-def logbase_handler(node):
+def logbase_handler(node, children, context):
     """
     Qualifier for <log>
 
@@ -311,7 +809,7 @@ def logbase_handler(node):
     Should be the first element following log, i.e. the second child of the containing apply
     element.
     """
-    return transpile(node)[0]
+    return children[0]
 
 
 def get_nary_relation_callback(sympy_relation):
@@ -333,20 +831,32 @@ def get_nary_relation_callback(sympy_relation):
     return _wrapper_relational
 
 
-def simple_operator_handler(node):
+def simple_operator_handler(node, children, context):
     """
     This function handles simple MathML <tagName> to sympy.Class operators, where no unique handling
     of tag children etc. is required.
     """
-    tag_name = node.tagName
+    operators = SIMPLE_OPERATORS or resolve_simple_operators()
+    return operators[get_backend(node).tag(node)]
 
-    handler = getattr(sympy, SIMPLE_MATHML_TO_SYMPY_NAMES[tag_name])
 
-    # Some MathML relations allow chaining but Sympy relations are binary operations
-    if tag_name in MATHML_NARY_RELATIONS:
-        return get_nary_relation_callback(handler)
+def resolve_simple_operators():
+    """
+    Fills SIMPLE_OPERATORS with the SymPy object of every tag in SIMPLE_MATHML_TO_SYMPY_NAMES, so
+    that simple_operator_handler is a single dict lookup. Called on first use rather than at
+    import, as it imports SymPy.
 
-    return handler
+    :return: SIMPLE_OPERATORS
+    """
+    operators = {}
+    for tag_name, sympy_name in SIMPLE_MATHML_TO_SYMPY_NAMES.items():
+        operator = getattr(sympy, sympy_name)
+        # Some MathML relations allow chaining but Sympy relations are binary operations
+        if tag_name in MATHML_NARY_RELATIONS:
+            operator = get_nary_relation_callback(operator)
+        operators[tag_name] = operator
+    SIMPLE_OPERATORS.update(operators)
+    return SIMPLE_OPERATORS
 
 
 # END OF MATHML HANDLERS #######################################################################
@@ -408,6 +918,20 @@ SIMPLE_MATHML_TO_SYMPY_NAMES = {
 # MathML relation elements that are n-ary operators
 MATHML_NARY_RELATIONS = {'eq', 'leq', 'lt', 'geq', 'gt'}
 
+# Maps the tags of SIMPLE_MATHML_TO_SYMPY_NAMES -> the SymPy object (or n-ary relation callback)
+# returned by simple_operator_handler; empty until resolve_simple_operators() is first called
+SIMPLE_OPERATORS = {}
+
+# MathML token elements: their handlers read the element content themselves, so the transpiler
+# does not descend into them
+TOKEN_ELEMENTS = {'ci', 'cn'}
+
+# Tree-walking implementations of transpile(), by the name used for TranspileContext(engine=...)
+ENGINES = {
+    'iterative': transpile,
+    'recursive': transpile_recursive,
+}
+
 # Mapping MathML tag element names (keys) to appropriate handler for SymPy output (values)
 # These tags require explicit handling because they have children or context etc.
 HANDLERS = {
@@ -0,0 +1,222 @@
+"""
+Writes SymPy expressions as the subset of content MathML that the transpiler reads, so that
+parsing the output gives back the same expressions
+"""
+import io
+
+from .deferred import sympy
+from .transpiler import SIMPLE_MATHML_TO_SYMPY_NAMES
+
+
+MATHML_NAMESPACE = 'http://www.w3.org/1998/Math/MathML'
+
+# Number of output strings collected before they are written to the file
+BUFFER_SIZE = 4096
+
+
+def write_mathml(expressions, file):
+    """
+    Writes a <math> element containing the given expressions to a file object opened in text mode.
+    The XML is written piece by piece, without building a DOM.
+
+    :param expressions: list of SymPy expressions, e.g. as returned by parse_string()
+    :param file: file object with a write() method
+    :raises NotImplementedError: for expressions that have no content MathML equivalent (e.g.
+        functions other than derivatives of state variables)
+    """
+    if not CONSTANTS:
+        _fill_tables()
+    buffer = ['<math xmlns="%s">' % MATHML_NAMESPACE]
+    for expression in expressions:
+        _write_expression(expression, buffer, file)
+    buffer.append('</math>')
+    file.write(''.join(buffer))
+
+
+def to_mathml(expressions):
+    """
+    Returns the <math> element containing the given expressions as a string, see write_mathml()
+    """
+    output = io.StringIO()
+    write_mathml(expressions, output)
+    return output.getvalue()
+
+
+def _write_expression(expression, buffer, file):
+    """
+    Appends the MathML of one expression to buffer, flushing it to file when it is full. The tree
+    is walked without recursion: the stack holds output strings and expressions still to write.
+    """
+    stack = [expression]
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            buffer.append(item)
+            if len(buffer) >= BUFFER_SIZE:
+                file.write(''.join(buffer))
+                del buffer[:]
+            continue
+        parts = _parts(item)
+        parts.reverse()
+        stack.extend(parts)
+
+
+def _escape(text):
+    """
+    Escapes &, < and > in element text, as xml.sax.saxutils.escape does (which is not used as it
+    imports urllib, doubling the import time of the package)
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _apply(operator, *operands):
+    """
+    Returns the parts of ``<apply><operator/>operands..</apply>``
+    """
+    return ['<apply><%s/>' % operator] + list(operands) + ['</apply>']
+
+
+def _cn(text, number_type=None):
+    if number_type is None:
+        return '<cn>%s</cn>' % text
+    return '<cn type="%s">%s</cn>' % (number_type, text)
+
+
+def _float(value):
+    text = repr(float(value))
+    if 'e' in text:
+        # A real number in scientific notation is written as mantissa<sep/>exponent
+        mantissa, exponent = text.split('e')
+        return _cn('%s<sep/>%d' % (mantissa, int(exponent)), 'e-notation')
+    return _cn(text)
+
+
+def _reciprocal_degree(exponent):
+    """
+    Returns n if an exponent is 1/n for an integer n > 1 (as Rational(1, n), or as
+    Pow(n, -1) when built without evaluation), so that the power can be written as a root
+    """
+    if isinstance(exponent, sympy.Rational) and exponent.p == 1 and exponent.q > 1:
+        return exponent.q
+    if isinstance(exponent, sympy.Pow) and exponent.exp == sympy.S.NegativeOne and \
+            isinstance(exponent.base, sympy.Integer) and exponent.base > 1:
+        return int(exponent.base)
+    return None
+
+
+def _parts(expression):
+    """
+    Returns the MathML of an expression as a list of strings and subexpressions
+    """
+    if expression.__class__ in CONSTANTS:
+        return [CONSTANTS[expression.__class__]]
+    if isinstance(expression, sympy.Symbol):
+        return ['<ci>%s</ci>' % _escape(expression.name)]
+    if isinstance(expression, sympy.Integer):
+        return [_cn(expression.p, 'integer')]
+    if isinstance(expression, sympy.Rational):
+        return [_cn('%d<sep/>%d' % (expression.p, expression.q), 'rational')]
+    if isinstance(expression, sympy.Float):
+        return [_float(expression)]
+    if expression == sympy.S.NegativeInfinity:
+        return _apply('minus', '<infinity/>')
+
+    args = expression.args
+    if isinstance(expression, sympy.Add) and len(args) == 2 and _is_negation(args[1]):
+        return _apply('minus', args[0], args[1].args[1])
+    if isinstance(expression, sympy.Mul) and len(args) == 2:
+        if _is_negation(expression):
+            return _apply('minus', args[1])
+        for numerator, denominator in ((args[0], args[1]), (args[1], args[0])):
+            if isinstance(numerator, sympy.log) and _is_reciprocal(denominator) and \
+                    isinstance(denominator.base, sympy.log):
+                # log(x, b) evaluates to log(x) / log(b)
+                return _apply('log', '<logbase>', denominator.base.args[0], '</logbase>',
+                              numerator.args[0])
+        if _is_reciprocal(args[1]):
+            return _apply('divide', args[0], args[1].base)
+    if isinstance(expression, sympy.Pow):
+        degree = _reciprocal_degree(expression.exp)
+        if degree == 2:
+            return _apply('root', expression.base)
+        if degree is not None:
+            return _apply('root', '<degree>', _cn(degree, 'integer'), '</degree>', expression.base)
+        return _apply('power', expression.base, expression.exp)
+    if isinstance(expression, sympy.log) and len(args) == 2:
+        return _apply('log', '<logbase>', args[1], '</logbase>', args[0])
+    if isinstance(expression, sympy.Derivative):
+        return _derivative(expression)
+    if isinstance(expression, sympy.Piecewise):
+        parts = ['<piecewise>']
+        for piece_expression, condition in args:
+            if condition == sympy.true:
+                parts.extend(['<otherwise>', piece_expression, '</otherwise>'])
+            else:
+                parts.extend(['<piece>', piece_expression, condition, '</piece>'])
+        parts.append('</piecewise>')
+        return parts
+
+    operator = OPERATORS.get(expression.func)
+    if operator is None:
+        raise NotImplementedError('No content MathML for %s' % sympy.srepr(expression))
+    return _apply(operator, *args)
+
+
+def _is_negation(expression):
+    """
+    Whether an expression is Mul(-1, x), as built by unary minus
+    """
+    return isinstance(expression, sympy.Mul) and len(expression.args) == 2 and \
+        expression.args[0] == sympy.S.NegativeOne
+
+
+def _is_reciprocal(expression):
+    """
+    Whether an expression is Pow(x, -1), as built by division
+    """
+    return isinstance(expression, sympy.Pow) and expression.exp == sympy.S.NegativeOne
+
+
+def _derivative(derivative):
+    """
+    Returns the parts of ``<apply><diff/><bvar>..</bvar><ci>..</ci></apply>`` for the derivative of
+    a state variable, i.e. Derivative(x(t), t) as built by the transpiler
+    """
+    from sympy.core.function import UndefinedFunction
+
+    function = derivative.expr
+    if len(derivative.variable_count) != 1 or len(function.args) != 1 or \
+            not isinstance(function.func, UndefinedFunction):
+        raise NotImplementedError('No content MathML for %s' % sympy.srepr(derivative))
+    variable, order = derivative.variable_count[0]
+    parts = ['<apply><diff/><bvar>', variable]
+    if order != 1:
+        parts.extend(['<degree>', _cn(order, 'integer'), '</degree>'])
+    parts.extend(['</bvar><ci>%s</ci></apply>' % _escape(function.func.__name__)])
+    return parts
+
+
+def _fill_tables():
+    """
+    Fills CONSTANTS and OPERATORS, on first use rather than at import as it imports SymPy
+    """
+    CONSTANTS.update({
+        sympy.E.__class__: '<exponentiale/>',
+        sympy.pi.__class__: '<pi/>',
+        sympy.oo.__class__: '<infinity/>',
+        sympy.nan.__class__: '<notanumber/>',
+        sympy.true.__class__: '<true/>',
+        sympy.false.__class__: '<false/>',
+    })
+    for tag, name in SIMPLE_MATHML_TO_SYMPY_NAMES.items():
+        value = getattr(sympy, name)
+        if isinstance(value, type):
+            OPERATORS[value] = tag
+
+
+# SymPy singletons with a MathML constant element, by class
+CONSTANTS = {}
+
+# Maps SymPy class -> MathML operator, inverting the simple handlers. ln and log are the same
+# function, which is written as <ln/> (log with one argument is the natural logarithm).
+OPERATORS = {}
@@ -0,0 +1,356 @@
+"""
+Builds a single, vectorised right-hand-side function for the ODE system of a transpiled model
+"""
+import functools
+import keyword
+
+import numpy as np
+import sympy
+from sympy.printing.lambdarepr import NumPyPrinter
+
+
+class OdeSystem(object):
+    """
+    The ODEs ``Eq(Derivative(x(t), t), rhs)`` of a model, together with the algebraic equations
+    ``Eq(a, expression)`` they depend on, compiled into one NumPy function.
+
+    The state variables are the differentiated variables; the parameters are all other variables
+    that are used but not defined by an equation. Algebraic equations that no ODE needs are left
+    out, the rest are evaluated once per call in dependency order.
+
+    Every quantity may carry extra (batch) dimensions after its first, so that many cells or
+    parameter sets are evaluated in one call::
+
+        system = OdeSystem(equations)
+        y = np.tile(y0[:, np.newaxis], (1, 1000))              # 1000 cells
+        p = system.parameter_array({'g_Na_max': np.linspace(300, 500, 1000), ...})
+        dy = system.rhs(0.0, y, p)                              # shape (len(system.states), 1000)
+
+    :param equations: SymPy equations, e.g. all blocks of a model returned by parse_file
+    :param parameters: optional list of parameter names, giving the order of the rows of the
+        ``params`` argument of rhs. Defaults to the parameters sorted by name.
+    :param lookup_tables: optional LookupTables built from the same equations. The tabulated
+        subexpressions are then interpolated in the tables instead of being evaluated. The table
+        variable must be a state, the bound variable or a parameter.
+    """
+
+    def __init__(self, equations, parameters=None, lookup_tables=None):
+        self._lookup_tables = lookup_tables
+        if lookup_tables is not None:
+            # The tabulated subexpressions become quantities of their own, defined by their exact
+            # expressions (which the Jacobian differentiates), but evaluated by interpolation
+            equations = lookup_tables.equations + [
+                sympy.Eq(symbol, expression, evaluate=False)
+                for symbol, expression in zip(lookup_tables.symbols, lookup_tables.expressions)]
+
+        # Maps a defined quantity (a Symbol, or the Derivative of a state) -> its expression
+        definitions = {}
+        derivatives = []
+        bound_variables = set()
+        for equation in equations:
+            lhs, rhs = equation.args
+            if isinstance(lhs, sympy.Derivative):
+                if len(lhs.variables) != 1:
+                    raise ValueError('Only first order ODEs are supported, got %s' % equation)
+                bound_variables.add(lhs.variables[0])
+                derivatives.append(lhs)
+            elif not isinstance(lhs, sympy.Symbol):
+                raise ValueError('Expected a variable or derivative on the left-hand side of %s'
+                                 % equation)
+            if lhs in definitions:
+                raise ValueError('Multiple definitions of %s' % lhs)
+            definitions[lhs] = rhs
+        if not derivatives:
+            raise ValueError('No ODEs found')
+        if len(bound_variables) != 1:
+            raise ValueError('ODEs use more than one bound variable: %s'
+                             % ', '.join(sorted(str(v) for v in bound_variables)))
+
+        #: The bound variable (usually time), as a sympy.Symbol
+        self.time = bound_variables.pop()
+        #: The derivatives of the states, in order of the rows of y
+        self.derivatives = derivatives
+        #: Names of the state variables, in order of the rows of y
+        self.states = [derivative.expr.func.__name__ for derivative in derivatives]
+        state_symbols = [sympy.Symbol(name) for name in self.states]
+        for state in state_symbols:
+            if state in definitions:
+                raise ValueError('State variable %s is also defined by an algebraic equation'
+                                 % state)
+
+        if lookup_tables is not None and lookup_tables.variable in definitions:
+            raise ValueError('Lookup table variable %s must not be defined by an equation'
+                             % lookup_tables.variable)
+
+        # Put every equation the ODEs need in dependency order
+        inputs = set(state_symbols) | {self.time}
+        order, used = _dependency_order(derivatives, definitions, inputs)
+        #: (quantity, expression) tuples in the order they are evaluated
+        self.equations = [(quantity, definitions[quantity]) for quantity in order]
+
+        unknown = {s for s in used if s not in definitions and s not in inputs}
+        if parameters is None:
+            parameters = sorted(s.name for s in unknown)
+        else:
+            missing = sorted(s.name for s in unknown - {sympy.Symbol(p) for p in parameters})
+            if missing:
+                raise ValueError('No values given for parameters: %s' % ', '.join(missing))
+        #: Names of the parameters, in order of the rows of params
+        self.parameters = list(parameters)
+
+        self._state_symbols = state_symbols
+        #: Python source of the generated function, for inspection
+        self.source = self._generate('rhs', self.equations, self.derivatives)
+        self._rhs = self._compile(self.source, 'rhs')
+
+    def _generate(self, name, equations, outputs):
+        """
+        Returns the source of a function ``name(t, y, p)`` that evaluates the given (quantity,
+        expression) tuples in order and returns a tuple of the output quantities
+        """
+        # Every quantity gets a local variable; names that are valid Python identifiers are kept
+        # to keep the source readable
+        local_names = {}
+
+        def local(quantity):
+            if quantity not in local_names:
+                name = str(quantity)
+                if not name.isidentifier() or keyword.iskeyword(name) or \
+                        name in ('numpy', 'functools', 'lookup', 't', 'y', 'p') or \
+                        name.startswith('_'):
+                    name = '_v%d' % len(local_names)
+                local_names[quantity] = sympy.Symbol(name)
+            return local_names[quantity]
+
+        lines = ['def %s(t, y, p):' % name, '    %s = t' % local(self.time)]
+        for i, state in enumerate(self._state_symbols):
+            lines.append('    %s = y[%d]' % (local(state), i))
+        for i, parameter in enumerate(self.parameters):
+            lines.append('    %s = p[%d]' % (local(sympy.Symbol(parameter)), i))
+
+        # Interpolate all lookup tables at once, if any are used
+        tables = {}
+        if self._lookup_tables is not None:
+            tables = {symbol: row for row, symbol in enumerate(self._lookup_tables.symbols)}
+            if any(quantity in tables for quantity, _ in equations):
+                lines.append('    _tables = lookup(%s)' % local(self._lookup_tables.variable))
+
+        printer = NumPyPrinter()
+        for quantity, expression in equations:
+            if quantity in tables:
+                lines.append('    %s = _tables[%d]' % (local(quantity), tables[quantity]))
+                continue
+            replacements = {q: local(q) for q in _quantities(expression)}
+            lines.append('    %s = %s' % (local(quantity),
+                                          printer.doprint(expression.xreplace(replacements))))
+        lines.append('    return (%s)' % ''.join('%s, ' % local(q) for q in outputs).rstrip())
+        return '\n'.join(lines) + '\n'
+
+    def _compile(self, source, name):
+        """
+        Executes generated source and returns the function it defines
+        """
+        namespace = {'numpy': np, 'functools': functools}
+        if self._lookup_tables is not None:
+            namespace['lookup'] = self._lookup_tables.interpolate
+        exec(compile(source, '<OdeSystem>', 'exec'), namespace)
+        return namespace[name]
+
+    def rhs(self, t, y, params=()):
+        """
+        Evaluates the derivatives of all states
+
+        :param t: value of the bound variable
+        :param y: array of state values, with one row per state (in the order of ``states``) and
+            any number of further (batch) dimensions
+        :param params: array with one row per parameter (in the order of ``parameters``),
+            broadcastable against the rows of y
+        :return: array of derivatives, with the same shape as y (or larger, if the parameters have
+            more batch dimensions)
+        """
+        y = np.asarray(y, dtype=float)
+        params = np.asarray(params, dtype=float)
+        derivatives = self._rhs(t, y, params)
+        # Derivatives that are constant or only depend on some inputs must still fill the batch
+        return np.stack(np.broadcast_arrays(y[0], *derivatives)[1:])
+
+    __call__ = rhs
+
+    def parameter_array(self, values):
+        """
+        Returns the params array for rhs from a mapping of parameter names to values (numbers or
+        arrays of batch values)
+        """
+        missing = [name for name in self.parameters if name not in values]
+        if missing:
+            raise ValueError('No values given for parameters: %s' % ', '.join(missing))
+        rows = [np.asarray(values[name], dtype=float) for name in self.parameters]
+        return np.stack(np.broadcast_arrays(*rows)) if rows else np.empty(0)
+
+    def jacobian(self):
+        """
+        Returns the SparseJacobian of the derivatives with respect to the states
+        """
+        return SparseJacobian(self)
+
+
+class SparseJacobian(object):
+    """
+    The Jacobian ``d(dy[i]/dt)/dy[j]`` of an OdeSystem, as a sparse matrix in coordinate (COO)
+    and compressed sparse row (CSR) form, with a compiled evaluator for its nonzero entries.
+
+    The sparsity pattern is found first, from which states each equation depends on through the
+    variables it uses. Only those entries are differentiated, using the chain rule through the
+    algebraic equations, so that they are never substituted into each other::
+
+        jacobian = system.jacobian()
+        values = jacobian.evaluate(t, y, p)            # shape (jacobian.nnz, *batch)
+        matrix = scipy.sparse.csr_matrix((values, jacobian.indices, jacobian.indptr),
+                                         shape=jacobian.shape)
+
+    Entries whose derivative is exactly zero (e.g. ``d(x - x)/dx``) are left out of the pattern.
+
+    :ivar rows: row (derivative) number of each nonzero entry, in row-major order
+    :ivar columns: column (state) number of each nonzero entry
+    :ivar indptr: CSR row pointers: the entries of row i are ``indptr[i]:indptr[i + 1]``
+    :ivar indices: CSR column indices, the same as ``columns``
+    :ivar source: Python source of the generated evaluator, for inspection
+    """
+
+    def __init__(self, system):
+        self.system = system
+        states = system._state_symbols
+        # Maps each defined quantity -> the set of numbers of the states it depends on
+        depends = {state: {number} for number, state in enumerate(states)}
+        # Maps (quantity, state number) -> the derivative of the quantity with respect to that
+        # state, as a symbol (see auxiliary) or, if it is that simple, an expression
+        partials = {(state, number): sympy.S.One for number, state in enumerate(states)}
+        # (symbol, expression) tuples of the partial derivatives of the algebraic variables, in
+        # the order they are evaluated
+        self._auxiliary = []
+        for quantity, expression in system.equations:
+            inputs = [q for q in _quantities(expression) if q in depends]
+            depends[quantity] = set()
+            for input_quantity in inputs:
+                depends[quantity].update(depends[input_quantity])
+            slopes = {q: expression.diff(q) for q in inputs}
+            for number in sorted(depends[quantity]):
+                partial = sympy.Add(*[slopes[q] * partials[(q, number)] for q in inputs
+                                      if (q, number) in partials])
+                if partial == 0:
+                    continue
+                if not isinstance(quantity, sympy.Derivative) and not partial.is_Atom:
+                    symbol = sympy.Dummy('d%s_d%s' % (quantity, states[number]))
+                    self._auxiliary.append((symbol, partial))
+                    partial = symbol
+                partials[(quantity, number)] = partial
+
+        #: Number of rows and columns
+        self.shape = (len(states), len(states))
+        self.rows = []
+        self.columns = []
+        self._entries = []
+        self.indptr = [0]
+        for row, derivative in enumerate(system.derivatives):
+            for column in sorted(depends[derivative]):
+                if (derivative, column) in partials:
+                    self.rows.append(row)
+                    self.columns.append(column)
+                    self._entries.append(partials[(derivative, column)])
+            self.indptr.append(len(self.rows))
+        self.indices = self.columns
+
+        # Only evaluate the equations that the entries need
+        entries = [sympy.Dummy('J%d' % i) for i in range(self.nnz)]
+        definitions = dict(system.equations + self._auxiliary + list(zip(entries, self._entries)))
+        order, _ = _dependency_order(entries, definitions, set(states) | {system.time})
+        self.source = system._generate(
+            'jacobian', [(quantity, definitions[quantity]) for quantity in order], entries)
+        self._jacobian = system._compile(self.source, 'jacobian')
+
+    @property
+    def nnz(self):
+        """
+        Number of structurally nonzero entries
+        """
+        return len(self.rows)
+
+    @property
+    def entries(self):
+        """
+        The nonzero entries as SymPy expressions, in the order of ``rows`` and ``columns``. They
+        are written in terms of the states, parameters and algebraic variables of the model.
+        """
+        resolved = {}
+        tables = self.system._lookup_tables
+        if tables is not None:
+            resolved.update(zip(tables.symbols, tables.expressions))
+        for symbol, expression in self._auxiliary:
+            resolved[symbol] = expression.xreplace(resolved)
+        return [entry.xreplace(resolved) for entry in self._entries]
+
+    def evaluate(self, t, y, params=()):
+        """
+        Evaluates the nonzero entries, with arguments as for OdeSystem.rhs
+
+        :return: array with one row per nonzero entry (in the order of ``rows`` and ``columns``)
+            and the batch dimensions of y
+        """
+        y = np.asarray(y, dtype=float)
+        params = np.asarray(params, dtype=float)
+        if not self.nnz:
+            return np.zeros((0,) + y.shape[1:])
+        values = self._jacobian(t, y, params)
+        return np.stack(np.broadcast_arrays(y[0], *values)[1:])
+
+    def dense(self, t, y, params=()):
+        """
+        Evaluates the Jacobian as a dense array of shape ``shape + batch dimensions``
+        """
+        values = self.evaluate(t, y, params)
+        matrix = np.zeros(self.shape + values.shape[1:])
+        matrix[self.rows, self.columns] = values
+        return matrix
+
+
+def _quantities(expression):
+    """
+    Returns the quantities an expression depends on: its symbols, and the derivatives used in it
+    """
+    return expression.free_symbols | expression.atoms(sympy.Derivative)
+
+
+def _dependency_order(targets, definitions, inputs):
+    """
+    Returns the defined quantities needed for the targets, each one after everything it depends
+    on, and the set of all quantities used along the way.
+
+    :raises ValueError: if the definitions depend on each other in a cycle
+    """
+    order = []
+    used = set()
+    done = set()
+    # Quantities that are being visited; meeting one of these again means a cycle
+    visiting = set()
+    for target in targets:
+        if target in done:
+            continue
+        stack = [(target, iter(_quantities(definitions[target])))]
+        visiting.add(target)
+        while stack:
+            quantity, dependencies = stack[-1]
+            for dependency in dependencies:
+                used.add(dependency)
+                if dependency in done or dependency in inputs or dependency not in definitions:
+                    continue
+                if dependency in visiting:
+                    raise ValueError('Cyclic dependency involving %s' % dependency)
+                visiting.add(dependency)
+                stack.append((dependency, iter(_quantities(definitions[dependency]))))
+                break
+            else:
+                stack.pop()
+                visiting.discard(quantity)
+                done.add(quantity)
+                order.append(quantity)
+    return order, used
@@ -15,5 +15,5 @@ setup(
     author_email='',
     url='https://github.com/ModellingWebLab/cellmlmanip',
     license=license_,
-    find_packages=find_packages(exclude=('tests', 'docs'))
+    find_packages=find_packages(exclude=('tests', 'docs', 'benchmarks'))
 )
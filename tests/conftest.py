@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from cellmlmanip import mathml2sympy
+
+
+TESTS_DIR = os.path.dirname(__file__)
+NOBLE_MODEL = os.path.join(TESTS_DIR, 'noble_model_1962.cellml')
+SIMPLE_ODES = os.path.join(TESTS_DIR, 'cellml_files', 'test_simple_odes.cellml')
+
+
+def make_mathml(content_xml):
+    """
+    Returns a <math> element containing the given content MathML, as a string
+    """
+    return '<math xmlns="http://www.w3.org/1998/Math/MathML">%s</math>' % content_xml
+
+
+@pytest.fixture(scope='module')
+def noble_equations():
+    """
+    All equations of the Noble 1962 model, in document order
+    """
+    return [e for _, block in mathml2sympy.parse_file(NOBLE_MODEL) for e in block]
+
+
+@pytest.fixture
+def noble_parameters():
+    """
+    Values of the parameters of the Noble 1962 model, by name
+    """
+    return {
+        'Cm': 12.0, 'E_L': -60.0, 'E_Na': 40.0, 'G_K1_max': 1200.0, 'G_K_max': 1200.0,
+        'g_L': 75.0, 'g_Na_max': 400000.0, 'perc_reduced_inact_for_IpNa': 0.0,
+        'shift_INa_inact': 0.0,
+    }
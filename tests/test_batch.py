@@ -0,0 +1,92 @@
+import os
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL, SIMPLE_ODES
+from sympy.core.cache import clear_cache
+
+from cellmlmanip import mathml2sympy
+
+
+TESTS_DIR = os.path.dirname(__file__)
+
+
+class TestParseMany(object):
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_results(self, workers):
+        missing = os.path.join(TESTS_DIR, 'no_such_model.cellml')
+        paths = [NOBLE_MODEL, SIMPLE_ODES, missing]
+        results = {result.path: result
+                   for result in mathml2sympy.parse_many(paths, workers=workers)}
+        assert set(results) == set(paths)
+
+        for path in (NOBLE_MODEL, SIMPLE_ODES):
+            assert results[path].error is None
+            assert results[path].blocks == list(mathml2sympy.parse_file(path))
+            assert results[path].elapsed > 0
+
+        assert results[missing].blocks is None
+        assert isinstance(results[missing].error, OSError)
+
+    def test_options(self):
+        result, = mathml2sympy.parse_many([SIMPLE_ODES], workers=2, backend='etree',
+                                          engine='recursive')
+        assert result.blocks == list(mathml2sympy.parse_file(SIMPLE_ODES))
+
+        with pytest.raises(ValueError, match='not supported with worker processes'):
+            list(mathml2sympy.parse_many([SIMPLE_ODES], workers=2,
+                                         profile=mathml2sympy.TranspileProfile()))
+
+    def test_unevaluated(self):
+        result, = mathml2sympy.parse_many([NOBLE_MODEL], workers=2, evaluate=False)
+        expected = list(mathml2sympy.parse_file(NOBLE_MODEL, evaluate=False))
+        assert [sympy.srepr(e) for _, block in result.blocks for e in block] == \
+            [sympy.srepr(e) for _, block in expected for e in block]
+
+
+class TestParseFileParallel(object):
+
+    @pytest.mark.parametrize('workers, backend', [(1, 'minidom'), (2, 'minidom'), (2, 'etree')])
+    def test_same_as_parse_file(self, workers, backend):
+        for path in (NOBLE_MODEL, SIMPLE_ODES):
+            blocks = mathml2sympy.parse_file_parallel(path, workers=workers, backend=backend,
+                                                      blocks_per_task=2)
+            assert blocks == list(mathml2sympy.parse_file(path))
+
+    def test_symbols_interned(self):
+        # Otherwise SymPy may return equal expressions built by earlier tests from other symbols
+        clear_cache()
+        symbol_table = mathml2sympy.SymbolTable()
+        blocks = mathml2sympy.parse_file_parallel(NOBLE_MODEL, workers=2, blocks_per_task=1,
+                                                  symbol_table=symbol_table)
+        # Blocks from different workers share the symbols of the one table
+        symbols = [s for _, block in blocks for e in block for s in e.free_symbols]
+        assert len([s for s in symbols if s.name == 'V']) > 1
+        assert all(symbol_table.symbols[s.name] is s for s in symbols)
+        functions = [f.func for _, block in blocks for e in block
+                     for f in e.atoms(sympy.core.function.AppliedUndef)]
+        assert functions
+        assert all(symbol_table.functions[f.__name__] is f for f in functions)
+
+    def test_options(self):
+        index = mathml2sympy.EquationIndex()
+        blocks = mathml2sympy.parse_file_parallel(NOBLE_MODEL, workers=2, index=index,
+                                                  evaluate=False, canonicalize=True)
+        assert blocks == list(mathml2sympy.parse_file(NOBLE_MODEL))
+        assert len(index) == 18
+        assert len(index.using('V')) == 10
+
+        with pytest.raises(ValueError, match='cannot be shared'):
+            mathml2sympy.parse_file_parallel(
+                NOBLE_MODEL, subexpressions=mathml2sympy.SubexpressionTable())
+        with pytest.raises(ValueError, match='not supported with worker processes'):
+            mathml2sympy.parse_file_parallel(NOBLE_MODEL, profile=mathml2sympy.TranspileProfile())
+        with pytest.raises(ValueError, match='not supported with worker processes'):
+            mathml2sympy.parse_file_parallel(NOBLE_MODEL, trace=mathml2sympy.log_trace)
+
+    def test_unevaluated(self):
+        blocks = mathml2sympy.parse_file_parallel(NOBLE_MODEL, workers=2, evaluate=False)
+        expected = list(mathml2sympy.parse_file(NOBLE_MODEL, evaluate=False))
+        assert [sympy.srepr(e) for _, block in blocks for e in block] == \
+            [sympy.srepr(e) for _, block in expected for e in block]
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy import transpiler
+
+
+class TestExpressionCache(object):
+
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return mathml2sympy.ExpressionCache(str(tmpdir))
+
+    def test_model_round_trip(self, cache, monkeypatch):
+        fresh = list(mathml2sympy.parse_file(NOBLE_MODEL, cache=cache))
+        assert cache.hits == 0
+        assert len(cache) == cache.misses == 7
+
+        # Transpiling again would fail, so everything must come from the cache
+        def fail(*args):
+            raise AssertionError('Transpiled a cached block')
+        monkeypatch.setitem(transpiler.ENGINES, 'iterative', fail)
+
+        table = mathml2sympy.SymbolTable()
+        cached = list(mathml2sympy.parse_file(NOBLE_MODEL, cache=cache, symbol_table=table))
+        assert cached == fresh
+        assert cache.hits == 7
+
+        # Leaf objects are interned through the symbol table of the new parse
+        V = table.symbols['V']
+        for _, expressions in cached:
+            for expression in expressions:
+                for symbol in expression.free_symbols:
+                    assert symbol is table.symbols[symbol.name]
+        assert V in table.symbols.values()
+
+    def test_unevaluated_round_trip(self, cache):
+        xml = ('<math xmlns="http://www.w3.org/1998/Math/MathML">'
+               '<apply><plus/><ci>x</ci><ci>x</ci></apply>'
+               '<apply><times/><cn>2</cn><cn>3</cn></apply></math>')
+        fresh = mathml2sympy.parse_string(xml, evaluate=False, cache=cache)
+        cached = mathml2sympy.parse_string(xml, evaluate=False, cache=cache)
+        assert cache.hits == 1
+        assert [sympy.srepr(e) for e in cached] == [sympy.srepr(e) for e in fresh]
+        x = sympy.Symbol('x')
+        assert cached[0].args == (x, x)
+        assert cached[1].args == (sympy.Float(2.0), sympy.Float(3.0))
+
+        fresh = list(mathml2sympy.parse_file(NOBLE_MODEL, evaluate=False, cache=cache))
+        cached = list(mathml2sympy.parse_file(NOBLE_MODEL, evaluate=False, cache=cache))
+        assert [sympy.srepr(e) for _, block in cached for e in block] == \
+            [sympy.srepr(e) for _, block in fresh for e in block]
+
+    def test_reopen(self, cache, tmpdir):
+        xml = '<math xmlns="http://www.w3.org/1998/Math/MathML"><ci>x</ci></math>'
+        mathml2sympy.parse_string(xml, cache=cache)
+        reopened = mathml2sympy.ExpressionCache(str(tmpdir))
+        assert len(reopened) == 1
+        assert reopened.size == cache.size
+        assert mathml2sympy.parse_string(xml, cache=reopened) == [sympy.Symbol('x')]
+        assert reopened.hits == 1
+
+    def test_key(self):
+        key = mathml2sympy.ExpressionCache.key
+        assert key(b'<math/>') == key(b'<math/>')
+        assert key(b'<math/>') != key(b'<math />')
+        assert key(b'<math/>') != key(b'<math/>', 'option')
+
+    def test_lru_eviction(self, cache):
+        cache.put('a', [1])
+        cache.put('b', [2])
+        entry_size = cache.size // 2
+        cache.max_size = 2 * entry_size
+        assert cache.get('a') == [1]
+        cache.put('c', [3])
+        assert 'b' not in cache
+        assert cache.get('b') is None
+        assert cache.get('a') == [1]
+        assert cache.get('c') == [3]
+        assert cache.size == 2 * entry_size
+        assert sorted(os.listdir(cache.directory)) == ['a.pickle', 'c.pickle']
+
+    def test_clear(self, cache):
+        cache.put('a', [1])
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.size == 0
+        assert os.listdir(cache.directory) == []
@@ -0,0 +1,106 @@
+import pytest
+import sympy
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy.transpiler import sympy_evaluate
+from cellmlmanip.ode import OdeSystem
+
+
+x, y, z, a, b = sympy.symbols('x y z a b')
+
+
+def expand(plan):
+    """
+    Substitutes the temporaries of a plan back into its equations
+    """
+    values = {}
+    for symbol, expression in plan.temporaries:
+        values[symbol] = expression.xreplace(values)
+    return [equation.xreplace(values) for equation in plan.equations]
+
+
+class TestCsePlan(object):
+
+    def test_shared_across_equations(self):
+        shared = sympy.exp(x * y)
+        equations = [sympy.Eq(a, shared + z), sympy.Eq(b, 2 * shared)]
+        plan = mathml2sympy.cse_plan(equations)
+        assert plan.temporaries == [(sympy.Symbol('_cse0'), shared)]
+        assert plan.equations[0] == sympy.Eq(a, sympy.Symbol('_cse0') + z)
+        assert expand(plan) == equations
+
+    def test_nested(self):
+        inner = sympy.exp(x)
+        outer = sympy.log(1 + inner)
+        expressions = [outer * inner, outer + y, inner - y]
+        plan = mathml2sympy.cse_plan(expressions)
+        # Temporaries only refer to those before them
+        assert [s for s, _ in plan.temporaries] == [sympy.Symbol('_cse0'), sympy.Symbol('_cse1')]
+        assert plan.temporaries[0][1] == inner
+        assert plan.temporaries[1][1] == sympy.log(1 + sympy.Symbol('_cse0'))
+        assert expand(plan) == expressions
+
+    def test_used_more_than_once(self, noble_equations):
+        plan = mathml2sympy.cse_plan(noble_equations)
+        assert plan.temporaries
+        for symbol, _ in plan.temporaries:
+            count = sum(e.count(symbol) for e in plan.equations) + \
+                sum(e.count(symbol) for _, e in plan.temporaries)
+            assert count >= 2
+        assert expand(plan) == noble_equations
+
+    def test_no_repeats(self):
+        expressions = [x + y, sympy.exp(z)]
+        plan = mathml2sympy.cse_plan(expressions)
+        assert plan.temporaries == []
+        assert plan.equations == expressions
+
+    def test_unevaluated(self):
+        expressions = mathml2sympy.parse_string(
+            '<math xmlns="http://www.w3.org/1998/Math/MathML">'
+            '<apply><eq/><ci>a</ci><apply><plus/><apply><times/><ci>x</ci><ci>y</ci></apply>'
+            '<apply><times/><ci>x</ci><ci>y</ci></apply></apply></apply></math>',
+            evaluate=False)
+        plan = mathml2sympy.cse_plan(expressions, evaluate=False)
+        assert plan.temporaries == [(sympy.Symbol('_cse0'), x * y)]
+        # The plan keeps the structure of unevaluated input
+        assert plan.equations[0].rhs.args == (sympy.Symbol('_cse0'), sympy.Symbol('_cse0'))
+
+    def test_name_clash(self):
+        taken = sympy.Symbol('t0')
+        expressions = [sympy.exp(taken) + x, sympy.exp(taken) + y]
+        plan = mathml2sympy.cse_plan(expressions, prefix='t')
+        assert plan.temporaries[0][0] == sympy.Symbol('t1')
+
+    def test_cache(self, noble_equations, tmpdir):
+        cache = mathml2sympy.ExpressionCache(str(tmpdir))
+        plan = mathml2sympy.cse_plan(noble_equations, cache=cache)
+        assert cache.misses == 1
+        cached = mathml2sympy.cse_plan(noble_equations, cache=cache)
+        assert cache.hits == 1
+        assert cached == plan
+        # A different prefix is a different plan
+        mathml2sympy.cse_plan(noble_equations, prefix='tmp', cache=cache)
+        assert cache.misses == 2
+
+    def test_cache_unevaluated(self, tmpdir):
+        cache = mathml2sympy.ExpressionCache(str(tmpdir))
+        with sympy_evaluate(False):
+            shared = sympy.exp(x)
+            equations = [sympy.Eq(a, shared + shared), sympy.Eq(b, shared * y)]
+        plan = mathml2sympy.cse_plan(equations, evaluate=False, cache=cache)
+        cached = mathml2sympy.cse_plan(equations, evaluate=False, cache=cache)
+        assert cache.hits == 1
+        temporary = sympy.Symbol('_cse0')
+        # Not rebuilt as 2*_cse0
+        assert cached.equations[0].rhs.args == (temporary, temporary)
+        assert sympy.srepr(cached) == sympy.srepr(plan)
+
+    def test_ode_system(self, noble_equations, noble_parameters):
+        plan = mathml2sympy.cse_plan(noble_equations)
+        system = OdeSystem([sympy.Eq(s, e) for s, e in plan.temporaries] + plan.equations)
+        exact = OdeSystem(noble_equations)
+        params = exact.parameter_array(noble_parameters)
+        state = [-87.0, 0.01, 0.8, 0.01]
+        assert system.states == exact.states
+        assert system.rhs(0.0, state, params) == pytest.approx(exact.rhs(0.0, state, params))
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import sympy
+from conftest import NOBLE_MODEL
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy import deferred, transpiler
+
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def sympy_loaded_after(code):
+    """
+    Runs code in a fresh interpreter and returns whether it loaded SymPy
+    """
+    code += '\nimport sys\nprint("sympy.core" in sys.modules)'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return output.decode('ascii').strip() == 'True'
+
+
+class TestDeferredImport(object):
+
+    def test_import(self):
+        assert not sympy_loaded_after('import cellmlmanip.mathml2sympy')
+
+    def test_fingerprint(self):
+        assert not sympy_loaded_after(
+            'import cellmlmanip.mathml2sympy as m\nlist(m.fingerprint_file(%r))' % NOBLE_MODEL)
+
+    def test_transpile(self):
+        assert sympy_loaded_after(
+            'import cellmlmanip.mathml2sympy as m\nm.parse_string('
+            '"<math xmlns=\'http://www.w3.org/1998/Math/MathML\'><ci>x</ci></math>")')
+
+    def test_submodule_imported_first(self):
+        # Importing a SymPy submodule before the first transpile must leave SymPy intact
+        assert sympy_loaded_after(
+            'import tempfile\n'
+            'import cellmlmanip.mathml2sympy as m\n'
+            'from sympy.core.function import AppliedUndef\n'
+            'import sympy.core.function\n'
+            'cache = m.ExpressionCache(tempfile.mkdtemp())\n'
+            'expressions = list(m.parse_file(%r, cache=cache))\n'
+            'assert cache.misses == len(expressions) and len(cache) == cache.misses\n'
+            'm.to_mathml([e for _, block in expressions for e in block])' % NOBLE_MODEL)
+
+    def test_shared_module(self):
+        # The proxy gives the attributes of SymPy itself, and sys.modules is left alone
+        assert deferred.sympy.Symbol is sympy.Symbol
+        assert sys.modules['sympy'] is sympy
+        assert type(sympy) is type(os)
+
+
+class TestSimpleOperators(object):
+
+    def test_resolved(self):
+        mathml2sympy.parse_string('<math xmlns="http://www.w3.org/1998/Math/MathML">'
+                                  '<apply><plus/><ci>x</ci><cn>1</cn></apply></math>')
+        operators = transpiler.SIMPLE_OPERATORS
+        assert set(operators) == set(transpiler.SIMPLE_MATHML_TO_SYMPY_NAMES)
+        assert operators['plus'] is sympy.Add
+        assert operators['pi'] is sympy.pi
+
+    def test_nary_relation(self):
+        x, y, z = sympy.symbols('x y z')
+        less = transpiler.resolve_simple_operators()['lt']
+        assert less(x, y) == sympy.Lt(x, y)
+        assert less(x, y, z) == sympy.And(sympy.Lt(x, y), sympy.Lt(y, z))
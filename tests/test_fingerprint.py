@@ -0,0 +1,111 @@
+import io
+
+import pytest
+from conftest import NOBLE_MODEL
+
+from cellmlmanip import mathml2sympy
+
+
+LEAK_EQUATION = """<apply>
+               <times/>
+               <ci>g_L</ci>"""
+
+
+@pytest.fixture(scope='module')
+def noble_xml():
+    with open(NOBLE_MODEL, 'rb') as f:
+        return f.read().decode('utf-8').replace('\r\n', '\n')
+
+
+def fingerprints(xml, backend='minidom'):
+    return list(mathml2sympy.fingerprint_file(io.BytesIO(xml.encode('utf-8')), backend))
+
+
+def block(content_xml, backend='minidom'):
+    xml = '<math xmlns="http://www.w3.org/1998/Math/MathML">%s</math>' % content_xml
+    return mathml2sympy.fingerprint_block(
+        mathml2sympy.backends.BACKENDS[backend].parse_string(xml))
+
+
+class TestFingerprints(object):
+
+    def test_noble(self, noble_xml):
+        blocks = fingerprints(noble_xml)
+        assert [len(b.equations) for _, b in blocks] == [1, 2, 3, 5, 3, 3, 1]
+        assert blocks[0][0] == 'membrane'
+        assert blocks[0][1].equations[0][:2] == ('V', True)
+        assert [e.lhs for e in blocks[2][1].equations] == ['alpha_m', 'beta_m', 'm']
+        assert len({b.digest for _, b in blocks}) == 7
+        assert fingerprints(noble_xml, 'etree') == blocks
+
+    def test_formatting_ignored(self):
+        compact = block('<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci><cn>1</cn></apply></apply>')
+        formatted = block("""
+            <!-- x is a plus one -->
+            <apply>
+                <eq/> <ci> x </ci>
+                <?some-tool hint?>
+                <apply><plus/><ci>a</ci>
+                    <cn xmlns:cellml="http://www.cellml.org/cellml/1.0#" cellml:units="mV">1.0</cn>
+                </apply>
+            </apply>
+        """, 'etree')
+        assert formatted == compact
+        assert block('<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci>'
+                     '<cn type="e-notation">1<sep/>0</cn></apply></apply>') == compact
+
+    @pytest.mark.parametrize('content_xml', [
+        '<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci><cn>2</cn></apply></apply>',
+        '<apply><eq/><ci>x</ci><apply><plus/><ci>b</ci><cn>1</cn></apply></apply>',
+        '<apply><eq/><ci>x</ci><apply><plus/><cn>1</cn><ci>a</ci></apply></apply>',
+        '<apply><eq/><ci>x</ci><apply><minus/><ci>a</ci><cn>1</cn></apply></apply>',
+        '<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci><cn type="integer">1</cn></apply></apply>',
+        '<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci></apply><cn>1</cn></apply>',
+    ])
+    def test_changes_detected(self, content_xml):
+        compact = block('<apply><eq/><ci>x</ci><apply><plus/><ci>a</ci><cn>1</cn></apply></apply>')
+        other = block(content_xml)
+        assert other.equations[0][:2] == ('x', False)
+        assert other.digest != compact.digest
+
+    def test_block_digest(self):
+        x = '<apply><eq/><ci>x</ci><ci>a</ci></apply>'
+        y = '<apply><eq/><ci>y</ci><ci>b</ci></apply>'
+        assert block(x + y).equations == block(x).equations + block(y).equations
+        assert block(x + y).digest != block(y + x).digest
+
+
+class TestDiff(object):
+
+    def test_diff_models(self, noble_xml):
+        old = fingerprints(noble_xml)
+        assert mathml2sympy.diff_models(old, old) == mathml2sympy.ModelDiff(
+            [], [], [], [(c, e.lhs, e.is_ode) for c, b in old for e in b.equations])
+
+        edited = noble_xml.replace(LEAK_EQUATION, LEAK_EQUATION + '<cn>2</cn>')
+        edited = edited.replace(
+            '<math xmlns="http://www.w3.org/1998/Math/MathML">',
+            '<math xmlns="http://www.w3.org/1998/Math/MathML">'
+            '<apply><eq/><ci>spare</ci><cn>1</cn></apply><apply><plus/><ci>a</ci></apply>', 1)
+        # Remove the next top-level equation after beta_m's
+        top_level = '<apply>\n            <eq/>\n            '
+        start = edited.index(top_level + '<ci>beta_m</ci>')
+        edited = edited[:start] + edited[edited.index(top_level, start + 1):]
+        diff = mathml2sympy.diff_models(old, fingerprints(edited))
+        assert diff.added[0] == ('membrane', 'spare', False)
+        assert diff.added[1][0] == 'membrane' and isinstance(diff.added[1][1], bytes)
+        assert diff.changed == [('leakage_current', 'i_Leak', False)]
+        assert len(diff.unchanged) == 18 - 2
+        assert len(diff.removed) == 1 and diff.removed[0][:2] == ('sodium_channel_m_gate', 'beta_m')
+
+    def test_duplicate_components(self, noble_xml):
+        edited = noble_xml.replace(LEAK_EQUATION, LEAK_EQUATION + '<cn>2</cn>')
+        models = {'original': fingerprints(noble_xml), 'edited': fingerprints(edited),
+                  'copy': fingerprints(noble_xml)}
+        groups = mathml2sympy.duplicate_components(models)
+        components = [c for c, _ in models['original']]
+        assert len(groups) == len(components)
+        leakage, = [g for g in groups if g[0][1] == 'leakage_current']
+        assert leakage == [('original', 'leakage_current'), ('copy', 'leakage_current')]
+        assert all(len(g) == 3 for g in groups if g is not leakage)
+        assert list(mathml2sympy.component_digests(models['original'])) == components
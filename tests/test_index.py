@@ -0,0 +1,101 @@
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL, SIMPLE_ODES, make_mathml
+
+from cellmlmanip import mathml2sympy
+
+
+def assign(variable, content_xml):
+    return '<apply><eq/><ci>%s</ci>%s</apply>' % (variable, content_xml)
+
+
+def index_file(path, **options):
+    index = mathml2sympy.EquationIndex()
+    for _ in mathml2sympy.parse_file(path, index=index, **options):
+        pass
+    return index
+
+
+class TestEquationIndex(object):
+
+    def test_defining_and_using(self):
+        index = index_file(NOBLE_MODEL)
+        assert len(index) == 18
+        i_na, = index.defining('i_Na')
+        assert str(i_na) == 'Eq(i_Na, (-E_Na + V)*(g_Na + 0.14))'
+        dv_dt, = index.using(sympy.Symbol('i_Na'))
+        assert dv_dt.lhs == sympy.Derivative(sympy.Function('V')(sympy.Symbol('time')),
+                                             sympy.Symbol('time'))
+        assert index.defining(dv_dt.lhs) == [dv_dt]
+        # States are not defined by an algebraic equation, but used by many
+        assert index.defining('V') == []
+        assert len(index.using('V')) == 10
+        # Parameters are only used
+        assert index.defining('g_Na_max') == []
+        assert [e.lhs for e in index.using('g_Na_max')] == [sympy.Symbol('g_Na')]
+        assert index.using('no_such_variable') == []
+        assert sorted(map(str, index.uses(index.equations.index(i_na)))) == ['E_Na', 'V', 'g_Na']
+
+    def test_same_as_from_expressions(self):
+        # Indexing while transpiling gives the same result as walking the expressions
+        for path in (NOBLE_MODEL, SIMPLE_ODES):
+            index = index_file(path)
+            walked = mathml2sympy.EquationIndex()
+            for expression in index.equations:
+                walked.add(expression)
+            assert walked.variables == index.variables
+            for number in range(len(index)):
+                assert sorted(map(str, walked.uses(number))) == sorted(map(str, index.uses(number)))
+
+    @pytest.mark.parametrize('options', [
+        {'engine': 'recursive'}, {'backend': 'etree'}, {'evaluate': False, 'canonicalize': True}])
+    def test_options(self, options):
+        index = index_file(NOBLE_MODEL, **options)
+        expected = index_file(NOBLE_MODEL)
+        assert index.equations == expected.equations
+        assert [index.uses(n) for n in range(len(index))] == \
+            [expected.uses(n) for n in range(len(expected))]
+
+    def test_cached_blocks(self, tmpdir):
+        cache = mathml2sympy.ExpressionCache(str(tmpdir))
+        index_file(NOBLE_MODEL, cache=cache)
+        index = index_file(NOBLE_MODEL, cache=cache)
+        assert cache.hits == 7
+        assert index.equations == index_file(NOBLE_MODEL).equations
+        assert len(index.using('V')) == 10
+
+    def test_derivative_on_rhs(self):
+        index = mathml2sympy.EquationIndex()
+        mathml2sympy.parse_string(make_mathml(
+            assign('rate', '<apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply>') +
+            '<apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>x</ci></apply><ci>x</ci></apply>'
+        ), index=index)
+        rate, ode = index.equations
+        assert index.using(ode.lhs) == [rate]
+        assert index.uses(1) == [sympy.Symbol('x')]
+        assert index.dependencies(0) == [1]
+        assert index.evaluation_order() == [ode, rate]
+
+    def test_evaluation_order(self):
+        index = index_file(NOBLE_MODEL)
+        order = index.evaluation_order()
+        assert sorted(order, key=str) == sorted(index.equations, key=str)
+        position = {equation: i for i, equation in enumerate(order)}
+        for number, equation in enumerate(index.equations):
+            for dependency in index.dependencies(number):
+                assert position[index.equations[dependency]] < position[equation]
+        assert index.cycles() == []
+
+    def test_cycles(self):
+        index = mathml2sympy.EquationIndex()
+        mathml2sympy.parse_string(make_mathml(
+            assign('a', '<apply><plus/><ci>b</ci><cn>1</cn></apply>') +
+            assign('b', '<apply><times/><ci>c</ci><ci>p</ci></apply>') +
+            assign('c', '<ci>a</ci>') +
+            assign('d', '<ci>a</ci>') +
+            assign('e', '<apply><minus/><ci>e</ci></apply>')), index=index)
+        a, b, c, d, e = index.equations
+        assert index.cycles() == [[a, b, c], [e]]
+        with pytest.raises(ValueError, match='Cyclic dependency between equations: Eq\\(a, '):
+            index.evaluation_order()
@@ -0,0 +1,69 @@
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL, SIMPLE_ODES, make_mathml
+
+from cellmlmanip import mathml2sympy
+
+
+class TestLazy(object):
+    backend = 'minidom'
+
+    def test_parse_string(self):
+        block = mathml2sympy.parse_string(make_mathml(
+            '<apply><eq/><ci>y</ci><apply><plus/><ci>x</ci><cn>1</cn></apply></apply>'
+            '<apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>y</ci></apply><ci>y</ci></apply>'
+            '<apply><plus/><ci>x</ci><cn>1</cn></apply>'), backend=self.backend, lazy=True)
+        assert isinstance(block, mathml2sympy.LazyBlock)
+        assert [(e.lhs_name, e.is_ode) for e in block] == [('y', False), ('y', True), (None, False)]
+        assert not any(e.transpiled for e in block)
+        assert repr(block[1]) == '<LazyEquation d(y)/dt (not transpiled)>'
+
+        ode, = block.find('y', ode=True)
+        assert ode is block[1]
+        x, y, t = sympy.symbols('x y t')
+        assert ode.expression == sympy.Eq(sympy.Derivative(sympy.Function('y')(t), t), y)
+        assert ode.transpiled
+        assert not block[0].transpiled
+        # The result is cached
+        assert ode.expression is ode.expression
+        assert block.find('y', ode=False) == [block[0]]
+        assert block.find('y') == [block[0], block[1]]
+        assert block.find('z') == []
+        assert block.expressions()[2] == x + 1.0
+
+    @pytest.mark.parametrize('path', [NOBLE_MODEL, SIMPLE_ODES])
+    def test_parse_file(self, path):
+        # The XML of each equation stays usable after parse_file has moved on
+        lazy_blocks = list(mathml2sympy.parse_file(path, backend=self.backend, lazy=True))
+        eager_blocks = list(mathml2sympy.parse_file(path, backend=self.backend))
+        assert [name for name, _ in lazy_blocks] == [name for name, _ in eager_blocks]
+        for (_, lazy), (_, eager) in zip(reversed(lazy_blocks), reversed(eager_blocks)):
+            assert lazy.expressions() == eager
+
+    def test_find_before_transpiling(self):
+        blocks = list(mathml2sympy.parse_file(NOBLE_MODEL, backend=self.backend, lazy=True))
+        i_na, = [e for _, block in blocks for e in block.find('i_Na')]
+        assert str(i_na.expression) == 'Eq(i_Na, (-E_Na + V)*(g_Na + 0.14))'
+        assert sum(e.transpiled for _, block in blocks for e in block) == 1
+
+    @pytest.mark.parametrize('options', [{'evaluate': False}, {'engine': 'recursive'},
+                                         {'evaluate': False, 'canonicalize': True}])
+    def test_options(self, options):
+        lazy_blocks = mathml2sympy.parse_file(NOBLE_MODEL, backend=self.backend, lazy=True,
+                                              **options)
+        eager_blocks = mathml2sympy.parse_file(NOBLE_MODEL, backend=self.backend, **options)
+        for (_, lazy), (_, eager) in zip(lazy_blocks, eager_blocks):
+            assert [str(e) for e in lazy.expressions()] == [str(e) for e in eager]
+
+    def test_unsupported_options(self):
+        with pytest.raises(ValueError, match='not supported with lazy=True'):
+            mathml2sympy.parse_string(make_mathml('<ci>x</ci>'), lazy=True,
+                                      index=mathml2sympy.EquationIndex())
+        with pytest.raises(ValueError, match='not supported with lazy=True'):
+            mathml2sympy.parse_string(make_mathml('<ci>x</ci>'), lazy=True,
+                                      profile=mathml2sympy.TranspileProfile())
+
+
+class TestLazyElementTree(TestLazy):
+    backend = 'etree'
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+import sympy
+
+from cellmlmanip.lookup import LookupTables
+from cellmlmanip.ode import OdeSystem
+
+
+V = sympy.Symbol('V')
+TIME = sympy.Symbol('time')
+
+
+def ode(state, rhs):
+    return sympy.Eq(sympy.Derivative(sympy.Function(state)(TIME), TIME), rhs)
+
+
+def gate_model():
+    """
+    A gate with smooth voltage-dependent rates, driven by a voltage with a parameter
+    """
+    x, k, a, b, c = sympy.symbols('x k a b c')
+    return [
+        sympy.Eq(a, sympy.exp(V / 20) / (1 + sympy.exp(-V / 15))),
+        sympy.Eq(b, 0.2 * sympy.exp(-V / 30)),
+        sympy.Eq(c, 3.0),
+        ode('x', a * (1 - x) - b * x + sympy.exp(c * V / 100) * x),
+        ode('V', -k * (V + 80) + 1 / (a + b) + sympy.cos(k * V)),
+    ]
+
+
+class TestLookupTables(object):
+
+    def test_find_subexpressions(self):
+        tables = LookupTables(gate_model(), 'V', -100, 60, step=0.1)
+        # Variables are followed and constants resolved; cos(k*V) depends on a parameter
+        assert set(map(str, tables.expressions)) == {
+            'exp(V/20)/(1 + exp(-V/15))', '0.2*exp(-V/30)', 'exp(0.03*V)',
+            '1/(0.2*exp(-V/30) + exp(V/20)/(1 + exp(-V/15)))'}
+        assert len(tables) == 4
+        assert tables.values.shape == (4, 1601)
+        assert tables.end == 60
+        rewritten = {str(e.lhs): e.rhs for e in tables.equations}
+        assert rewritten['a'] in tables.symbols
+        assert rewritten['c'] == 3.0
+        assert 'cos' in str(rewritten['Derivative(V(time), time)'])
+
+    def test_interpolate(self):
+        tables = LookupTables([sympy.Eq(sympy.Symbol('a'), sympy.exp(V / 10))], V, -10, 10, 0.5)
+        assert tables.interpolate(-10.0) == pytest.approx([np.exp(-1)])
+        assert tables.interpolate(10.0) == pytest.approx([np.exp(1)])
+        # Halfway between two table points
+        expected = (np.exp(0.1) + np.exp(0.15)) / 2
+        assert tables.interpolate(1.25) == pytest.approx([expected])
+        values = tables.interpolate(np.array([[1.25, 10.0], [-10.0, 0.0]]))
+        assert values.shape == (1, 2, 2)
+        assert values[0] == pytest.approx(np.array([[expected, np.exp(1)], [np.exp(-1), 1.0]]))
+        for outside in (10.01, np.array([0.0, -11.0])):
+            with pytest.raises(ValueError, match='outside the lookup table range'):
+                tables.interpolate(outside)
+
+    def test_error_check(self):
+        smooth = [sympy.Eq(sympy.Symbol('a'), sympy.exp(V / 10))]
+        errors = LookupTables(smooth, V, -50, 50, 0.01, tolerance=1e-6).errors()
+        assert 0 < errors[0] < 1e-6
+        # A table of a single point is exact
+        assert list(LookupTables(smooth, V, 1, 1 + 1e-12, 0.5).errors()) == [0.0]
+        with pytest.raises(ValueError, match='has error .*; use a smaller step'):
+            LookupTables(smooth, V, -50, 50, 1.0, tolerance=1e-6)
+        # The jump of a discontinuous Piecewise is smeared over one step
+        jump = sympy.Piecewise((sympy.exp(V), V < 0.05), (2 * sympy.exp(V), True))
+        jump = [sympy.Eq(sympy.Symbol('a'), jump)]
+        with pytest.raises(ValueError, match='Lookup table for Piecewise'):
+            LookupTables(jump, V, -1, 1, 0.1, tolerance=1e-3)
+
+    def test_not_finite(self):
+        with pytest.raises(ValueError, match='log\\(V\\) is not finite at V = -1.0'):
+            LookupTables([sympy.Eq(sympy.Symbol('a'), sympy.log(V))], V, -1, 1, 0.5)
+
+    def test_ode_system(self):
+        equations = gate_model()
+        tables = LookupTables(equations, 'V', -100, 60, step=0.01)
+        exact = OdeSystem(equations)
+        system = OdeSystem(equations, lookup_tables=tables)
+        assert 'lookup(V)' in system.source and 'exp' not in system.source
+        assert system.states == exact.states and system.parameters == ['k']
+
+        y = np.stack([np.full(500, 0.3), np.linspace(-100, 60, 500)])
+        assert system.rhs(0.0, y, [0.1]) == pytest.approx(exact.rhs(0.0, y, [0.1]), rel=1e-5)
+        assert system.rhs(0.0, y[:, 7], [0.1]) == pytest.approx(exact.rhs(0.0, y[:, 7], [0.1]),
+                                                                rel=1e-5)
+        with pytest.raises(ValueError, match='outside the lookup table range'):
+            system.rhs(0.0, [0.3, 70.0], [0.1])
+
+        # The Jacobian differentiates the exact expressions
+        jacobian = system.jacobian()
+        assert jacobian.rows == exact.jacobian().rows
+        assert jacobian.columns == exact.jacobian().columns
+        assert not any(entry.atoms(sympy.Dummy) for entry in jacobian.entries)
+        assert jacobian.evaluate(0.0, y, [0.1]) == \
+            pytest.approx(exact.jacobian().evaluate(0.0, y, [0.1]), rel=1e-4)
+
+    def test_noble(self, noble_equations, noble_parameters):
+        tables = LookupTables(noble_equations, 'V', -150, 100, step=0.01)
+        # alpha_h and beta_h depend on a parameter
+        assert len(tables) == 6
+        assert not any(e.has(sympy.Symbol('shift_INa_inact')) for e in tables.expressions)
+        exact = OdeSystem(noble_equations)
+        system = OdeSystem(noble_equations, lookup_tables=tables)
+        params = system.parameter_array(noble_parameters)
+        y = [-87.0, 0.01, 0.8, 0.01]
+        assert system.rhs(0.0, y, params) == pytest.approx(exact.rhs(0.0, y, params), rel=1e-6)
+
+    def test_defined_variable(self):
+        equations = [sympy.Eq(V, sympy.Symbol('u') * 2), ode('x', sympy.exp(V))]
+        tables = LookupTables(equations, 'V', -1, 1)
+        with pytest.raises(ValueError, match='Lookup table variable V must not be defined'):
+            OdeSystem(equations, lookup_tables=tables)
@@ -1,12 +1,38 @@
+import contextlib
+import io
+import logging
 import os
+import sys
 from xml.dom import pulldom
 
+import pytest
 import sympy
 
 from cellmlmanip import mathml2sympy
 
 
+@contextlib.contextmanager
+def captured_log(level=logging.WARNING):
+    """
+    Yields a StringIO that receives the messages logged to the root logger at the given level or
+    above (pytest's caplog fixture needs pytest 3.3)
+    """
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    logger = logging.getLogger()
+    old_level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    try:
+        yield stream
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(old_level)
+
+
 class TestParser(object):
+    backend = 'minidom'
+    options = {}
 
     @staticmethod
     def make_mathml(content_xml):
@@ -16,7 +42,8 @@ class TestParser(object):
 
     def assert_equal(self, content_xml, sympy_expression):
         mathml_string = self.make_mathml(content_xml)
-        transpiled_sympy = mathml2sympy.parse_string(mathml_string)
+        transpiled_sympy = mathml2sympy.parse_string(mathml_string, backend=self.backend,
+                                                     **self.options)
         assert transpiled_sympy == sympy_expression
 
     def test_symbol(self):
@@ -184,7 +211,8 @@ class TestParser(object):
         mathml_xml = '<math xmlns="http://www.w3.org/1998/Math/MathML" ' \
                      'xmlns:cellml="http://www.cellml.org/cellml/1.0#"> <apply><cn ' \
                      'cellml:units="dimensionless">3</cn></apply></math> '
-        transpiled_sympy = mathml2sympy.parse_string(mathml_xml)
+        transpiled_sympy = mathml2sympy.parse_string(mathml_xml, backend=self.backend,
+                                                     **self.options)
         assert transpiled_sympy == [sympy.Number(3.0)]
 
     def test_diff_eq(self):
@@ -200,6 +228,10 @@ class TestParser(object):
     def test_scientific_notation(self):
         self.assert_equal('<cn type="e-notation">1.234<sep/>5</cn>', [sympy.Number(1.234e5)])
 
+    def test_integer_and_rational(self):
+        self.assert_equal('<cn type="integer">-3</cn><cn type="rational">1<sep/>3</cn>',
+                          [sympy.Integer(-3), sympy.Rational(1, 3)])
+
     def test_xor(self):
         self.assert_equal('<apply><xor/><ci>a</ci><ci>b</ci></apply>',
                           [sympy.Xor(sympy.Symbol('a'), sympy.Symbol('b'))])
@@ -242,3 +274,253 @@ class TestParser(object):
             for eq in eqs:
                 pass
                 # print(eq)
+
+
+class TestParserElementTree(TestParser):
+    backend = 'etree'
+
+    def test_text_after_element(self):
+        with captured_log() as log:
+            self.assert_equal('<ci>x</ci> stray', [sympy.Symbol('x')])
+        assert 'Unhandled text node in <math>: "stray"' in log.getvalue()
+
+
+class TestParserCanonicalized(TestParser):
+    options = {'evaluate': False, 'canonicalize': True}
+
+
+class TestUnevaluated(object):
+
+    @staticmethod
+    def parse(content_xml, **options):
+        return mathml2sympy.parse_string(TestParser.make_mathml(content_xml), evaluate=False,
+                                         **options)
+
+    def test_unevaluated(self):
+        x = sympy.Symbol('x')
+        expression, = self.parse('<apply><plus/><ci>x</ci><ci>x</ci><cn>1</cn><cn>2</cn></apply>')
+        assert expression.args == (x, x, 1.0, 2.0)
+        assert mathml2sympy.canonicalize([expression]) == [2 * x + 3.0]
+
+    def test_minus_and_divide(self):
+        a, b = sympy.symbols('a b')
+        expression, = self.parse('<apply><divide/><apply><minus/><ci>a</ci><ci>a</ci></apply>'
+                                 '<ci>b</ci></apply>')
+        assert expression != 0
+        assert mathml2sympy.canonicalize([expression]) == [0]
+
+    def test_canonicalize_shared(self):
+        table = mathml2sympy.SubexpressionTable()
+        sum_xml = '<apply><plus/><ci>a</ci><ci>b</ci></apply>'
+        first, second = self.parse('<apply><exp/>%s</apply><apply><sin/>%s</apply>'
+                                   % (sum_xml, sum_xml), subexpressions=table)
+        assert first.args[0] is second.args[0]
+        first, second = mathml2sympy.canonicalize([first, second])
+        assert first.args[0] is second.args[0]
+
+    def test_model(self):
+        cellml_path = os.path.join(os.path.dirname(__file__), 'noble_model_1962.cellml')
+        assert list(mathml2sympy.parse_file(cellml_path)) == \
+            list(mathml2sympy.parse_file(cellml_path, evaluate=False, canonicalize=True))
+
+
+class TestBindings(object):
+    piecewise = ('<piecewise><piece><ci>x</ci><apply><lt/><ci>a</ci><cn>0</cn></apply></piece>'
+                 '<piece><ci>y</ci><apply><lt/><ci>V</ci><ci>b</ci></apply></piece>'
+                 '<otherwise><ci>z</ci></otherwise></piecewise>')
+
+    @staticmethod
+    def parse(content_xml, **options):
+        return mathml2sympy.parse_string(TestParser.make_mathml(content_xml), **options)
+
+    @pytest.mark.parametrize('evaluate', [True, False])
+    def test_fold(self, evaluate):
+        x, V = sympy.symbols('x V')
+        expression, = self.parse(
+            '<apply><eq/><ci>x</ci><apply><divide/><apply><times/><ci>g</ci><cn>2</cn><ci>V</ci>'
+            '<apply><exp/><apply><minus/><ci>s</ci></apply></apply></apply><ci>Cm</ci></apply>'
+            '</apply>', bindings={'g': 3, 's': 0.0, 'Cm': 2.0}, evaluate=evaluate)
+        assert expression.lhs == x
+        assert sympy.simplify(expression.rhs - 3.0 * V) == 0
+        assert not expression.rhs.atoms(sympy.exp)
+        if not evaluate:
+            assert str(expression.rhs) == '(6.0*V)/2.0'
+
+    def test_identities(self):
+        # With evaluate=False, folding also removes operands that make no difference
+        V = sympy.Symbol('V')
+        for content_xml in ('<apply><plus/><ci>V</ci><ci>s</ci></apply>',
+                            '<apply><minus/><ci>V</ci><ci>s</ci></apply>',
+                            '<apply><times/><ci>V</ci><ci>one</ci></apply>',
+                            '<apply><divide/><ci>V</ci><ci>one</ci></apply>',
+                            '<apply><power/><ci>V</ci><ci>one</ci></apply>'):
+            expression, = self.parse(content_xml, bindings={'s': 0, 'one': 1}, evaluate=False)
+            assert expression == V
+        expression, = self.parse('<apply><times/><ci>V</ci><ci>s</ci></apply>',
+                                 bindings={'s': 0}, evaluate=False)
+        assert expression.is_zero
+
+    @pytest.mark.parametrize('evaluate', [True, False])
+    def test_prune_piecewise(self, evaluate):
+        x, y, z, V, b = sympy.symbols('x y z V b')
+        # The first condition is always true
+        assert self.parse(self.piecewise, bindings={'a': -1}, evaluate=evaluate) == [x]
+        # The first condition is always false
+        expression, = self.parse(self.piecewise, bindings={'a': 1}, evaluate=evaluate)
+        assert expression.args == ((y, V < b), (z, True))
+        expression, = self.parse(self.piecewise, bindings={'a': 1, 'V': 0, 'b': 2},
+                                 evaluate=evaluate)
+        assert expression == y
+
+    @pytest.mark.parametrize('evaluate', [True, False])
+    def test_override_definition(self, evaluate):
+        Cm, x = sympy.symbols('Cm x')
+        expressions = self.parse('<apply><eq/><ci>Cm</ci><cn>2</cn></apply>'
+                                 '<apply><eq/><ci>x</ci><apply><times/><cn>3</cn><ci>Cm</ci>'
+                                 '</apply></apply>', bindings={'Cm': 1.0}, evaluate=evaluate)
+        assert expressions == [sympy.Eq(Cm, 1.0), sympy.Eq(x, 3.0)]
+
+    @pytest.mark.parametrize('evaluate', [True, False])
+    def test_equal_condition(self, evaluate):
+        # Only top-level equations define a variable, not an <eq/> in a piecewise condition
+        x, y = sympy.symbols('x y')
+        piecewise = ('<apply><eq/><ci>y</ci><piecewise><piece><ci>x</ci><apply><eq/><ci>flag</ci>'
+                     '<cn>1</cn></apply></piece><otherwise><cn>0</cn></otherwise></piecewise>'
+                     '</apply>')
+        assert self.parse(piecewise, bindings={'flag': 1}, evaluate=evaluate) == [sympy.Eq(y, x)]
+        assert self.parse(piecewise, bindings={'flag': 2}, evaluate=evaluate) == [sympy.Eq(y, 0.0)]
+
+    def test_errors(self):
+        with pytest.raises(ValueError, match='Bound variables must not appear in derivatives'):
+            self.parse('<apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>V</ci></apply>'
+                       '<cn>1</cn></apply>', bindings={'V': 1.0})
+
+    def test_model(self, tmpdir):
+        cellml_path = os.path.join(os.path.dirname(__file__), 'noble_model_1962.cellml')
+        bindings = {'Cm': 12.0, 'g_Na_max': 400000.0, 'shift_INa_inact': 0.0}
+        index = mathml2sympy.EquationIndex()
+        cache = mathml2sympy.ExpressionCache(str(tmpdir))
+        bound = [e for _, block in mathml2sympy.parse_file(
+            cellml_path, bindings=bindings, index=index, cache=cache) for e in block]
+        values = {sympy.Symbol(name): value for name, value in bindings.items()}
+        expected = [e for _, block in mathml2sympy.parse_file(cellml_path) for e in block]
+        assert [sympy.simplify(a.rhs - b.rhs.subs(values)) for a, b in zip(bound, expected)] == \
+            [0] * len(expected)
+        assert index.using('Cm') == []
+        # Bindings are part of the cache key
+        assert [e for _, block in mathml2sympy.parse_file(cellml_path, cache=cache)
+                for e in block] == expected
+        assert cache.hits == 0
+
+
+class TestParseFile(object):
+    backend = 'minidom'
+
+    @staticmethod
+    def cellml_path(name):
+        return os.path.join(os.path.dirname(__file__), 'cellml_files', name)
+
+    def test_components_in_order(self):
+        blocks = list(mathml2sympy.parse_file(self.cellml_path('test_simple_odes.cellml'),
+                                              backend=self.backend))
+        names = [name for name, _ in blocks]
+        assert names[:3] == ['single_independent_ode',
+                             'single_ode_rhs_const_var',
+                             'single_ode_rhs_computed_var']
+        assert len(blocks) == 17
+
+        time, a = sympy.symbols('time a')
+        sv1 = sympy.Function('sv1')
+        assert blocks[2][1] == [sympy.Eq(sympy.Derivative(sv1(time), time), a),
+                                sympy.Eq(a, -1.0)]
+
+    def test_file_object(self):
+        path = self.cellml_path('test_simple_odes.cellml')
+        with open(path, 'rb') as f:
+            from_file_object = list(mathml2sympy.parse_file(f, backend=self.backend))
+        assert from_file_object == list(mathml2sympy.parse_file(path, backend=self.backend))
+
+    def test_noble_1962(self):
+        cellml_path = os.path.join(os.path.dirname(__file__), 'noble_model_1962.cellml')
+        blocks = list(mathml2sympy.parse_file(cellml_path, backend=self.backend))
+        assert len(blocks) == 7
+        assert all(expressions for _, expressions in blocks)
+
+    def test_long_document(self):
+        # Long enough for identifiers to straddle the chunks pulldom reads the file in
+        equations = ''.join('<apply><eq/><ci>variable_%d</ci><ci>parameter_%d</ci></apply>' % (i, i)
+                            for i in range(2000))
+        cellml = ('<model xmlns="http://www.cellml.org/cellml/1.0#"><component name="c">'
+                  '<math xmlns="http://www.w3.org/1998/Math/MathML">%s</math></component></model>'
+                  % equations)
+        (_, expressions), = mathml2sympy.parse_file(io.BytesIO(cellml.encode('utf-8')),
+                                                    backend=self.backend)
+        assert [str(e) for e in expressions] == \
+            ['Eq(variable_%d, parameter_%d)' % (i, i) for i in range(2000)]
+
+
+class TestParseFileElementTree(TestParseFile):
+    backend = 'etree'
+
+    def test_same_as_minidom(self):
+        path = self.cellml_path('test_simple_odes.cellml')
+        assert list(mathml2sympy.parse_file(path, backend='etree')) == \
+            list(mathml2sympy.parse_file(path, backend='minidom'))
+
+
+class TestTrace(object):
+    mathml = '<math xmlns="http://www.w3.org/1998/Math/MathML">' \
+             '<apply><plus/><ci>x</ci><cn>1</cn></apply></math>'
+
+    def test_trace_order(self):
+        calls = []
+
+        def trace(tag, node, result):
+            calls.append((tag, result))
+
+        mathml2sympy.parse_string(self.mathml, trace=trace)
+        assert [tag for tag, _ in calls] == ['plus', 'ci', 'cn', 'apply']
+        assert calls[-1][1] == sympy.Symbol('x') + 1.0
+
+    def test_log_trace(self):
+        with captured_log(logging.DEBUG) as log:
+            mathml2sympy.parse_string(self.mathml, trace=mathml2sympy.log_trace)
+        assert '<ci>x</ci>' in log.getvalue()
+
+    def test_log_trace_disabled(self, monkeypatch):
+        from cellmlmanip.mathml2sympy import backends
+
+        def fail(node):
+            raise AssertionError('Serialised a node while DEBUG logging is off')
+
+        monkeypatch.setattr(backends.MinidomBackend, 'to_xml', staticmethod(fail))
+        mathml2sympy.parse_string(self.mathml, trace=mathml2sympy.log_trace)
+
+
+class TestEngines(object):
+
+    @staticmethod
+    def nested_apply(depth):
+        # x0 + y * (x1 + y * (x2 + ...)), alternating so that SymPy doesn't flatten the levels
+        opening = ''.join('<apply><%s/><ci>x%d</ci>' % ('plus' if level % 2 == 0 else 'times',
+                                                        level)
+                          for level in range(depth))
+        return '<math xmlns="http://www.w3.org/1998/Math/MathML">%s<cn>1</cn>%s</math>' \
+            % (opening, '</apply>' * depth)
+
+    def test_deep_nesting(self):
+        depth = 5000
+        assert depth > sys.getrecursionlimit()
+        expressions = mathml2sympy.parse_string(self.nested_apply(depth), backend='etree')
+        assert len(expressions) == 1
+        assert len(expressions[0].args) == 2
+
+    def test_recursive_engine_agrees(self):
+        xml = self.nested_apply(100)
+        assert mathml2sympy.parse_string(xml, engine='recursive') == \
+            mathml2sympy.parse_string(xml, engine='iterative')
+
+    def test_engines_agree_on_model(self):
+        cellml_path = os.path.join(os.path.dirname(__file__), 'noble_model_1962.cellml')
+        assert list(mathml2sympy.parse_file(cellml_path, engine='recursive')) == \
+            list(mathml2sympy.parse_file(cellml_path, engine='iterative'))
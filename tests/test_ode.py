@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+import sympy
+
+from cellmlmanip.ode import OdeSystem
+
+
+NOBLE_STATES = [-87.0, 0.01, 0.8, 0.01]
+
+
+def make_equations(*equations):
+    """
+    Builds equations from 'lhs = rhs' strings, where d_x stands for the time derivative of x
+    """
+    t = sympy.Symbol('time')
+    result = []
+    for equation in equations:
+        lhs, rhs = (sympy.sympify(side.replace('d_', 'diff_')) for side in equation.split('='))
+        derivatives = {f: sympy.Derivative(sympy.Function(f.name[5:])(t), t)
+                       for f in (lhs.free_symbols | rhs.free_symbols) if f.name.startswith('diff_')}
+        result.append(sympy.Eq(lhs.xreplace(derivatives), rhs.xreplace(derivatives),
+                               evaluate=False))
+    return result
+
+
+class TestOdeSystem(object):
+
+    def test_noble(self, noble_equations, noble_parameters):
+        system = OdeSystem(noble_equations)
+        assert system.states == ['V', 'm', 'h', 'n']
+        assert system.parameters == sorted(noble_parameters)
+        assert system.time == sympy.Symbol('time')
+        # All algebraic equations are needed
+        assert len(system.equations) == len(noble_equations)
+
+        # Compare with substituting into each equation by hand
+        values = {sympy.Symbol(k): v for k, v in noble_parameters.items()}
+        values.update(zip(sympy.symbols('V m h n'), NOBLE_STATES))
+        for quantity, expression in system.equations:
+            if isinstance(quantity, sympy.Symbol):
+                values[quantity] = float(expression.subs(values))
+        expected = [float(definition.subs(values)) for definition in
+                    (expression for quantity, expression in system.equations
+                     if isinstance(quantity, sympy.Derivative))]
+
+        derivatives = system.rhs(0.0, NOBLE_STATES, system.parameter_array(noble_parameters))
+        assert derivatives.shape == (4,)
+        assert derivatives == pytest.approx(expected, rel=1e-12)
+
+    def test_batch(self, noble_equations, noble_parameters):
+        system = OdeSystem(noble_equations)
+        cells = 50
+        y = np.tile(np.array(NOBLE_STATES)[:, np.newaxis], (1, cells))
+        y[0] = np.linspace(-90, 20, cells)
+        g_Na_max = np.linspace(3e5, 5e5, cells)
+        params = system.parameter_array(dict(noble_parameters, g_Na_max=g_Na_max))
+        assert params.shape == (len(system.parameters), cells)
+
+        derivatives = system(0.0, y, params)
+        assert derivatives.shape == (4, cells)
+        for i in (0, 17, 49):
+            single = system.rhs(0.0, y[:, i], system.parameter_array(
+                dict(noble_parameters, g_Na_max=g_Na_max[i])))
+            assert derivatives[:, i] == pytest.approx(single, rel=1e-12)
+
+    def test_broadcast_constant_derivatives(self):
+        system = OdeSystem(make_equations('d_x = -y', 'd_y = 2', 'd_z = a'))
+        assert system.parameters == ['a']
+        derivatives = system.rhs(0.0, np.ones((3, 5)), [[3.0]])
+        assert derivatives.shape == (3, 5)
+        assert (derivatives[1] == 2).all()
+        assert (derivatives[2] == 3).all()
+
+    def test_unused_and_derivative_equations(self):
+        system = OdeSystem(make_equations(
+            'd_x = rate', 'rate = -k * y', 'unused = 2 * x', 'd_y = 0.5 * d_x', 'time_2 = time'))
+        assert [str(quantity) for quantity, _ in system.equations] == [
+            'rate', 'Derivative(x(time), time)', 'Derivative(y(time), time)']
+        assert system.rhs(0.0, [1.0, 2.0], [3.0]).tolist() == [-6.0, -3.0]
+
+    def test_time_and_names(self):
+        # Names that would clash with the generated code are renamed
+        system = OdeSystem(make_equations('d_x = t * time + p', 'p = 2 * y', 'd_y = 1'))
+        assert system.parameters == ['t']
+        assert system.rhs(3.0, [0.0, 1.0], [4.0]).tolist() == [14.0, 1.0]
+
+    def test_parameter_order(self):
+        system = OdeSystem(make_equations('d_x = a - b'), parameters=['b', 'a', 'c'])
+        assert system.rhs(0.0, [0.0], [1.0, 5.0, 0.0]).tolist() == [4.0]
+        with pytest.raises(ValueError, match='No values given for parameters: b'):
+            OdeSystem(make_equations('d_x = a - b'), parameters=['a'])
+        with pytest.raises(ValueError, match='No values given for parameters: c'):
+            system.parameter_array({'a': 1, 'b': 2})
+
+    @pytest.mark.parametrize('equations, message', [
+        (['a = 1'], 'No ODEs found'),
+        (['d_x = a', 'a = 1', 'a = 2'], 'Multiple definitions of a'),
+        (['d_x = a', 'a = b', 'b = a + 1'], 'Cyclic dependency'),
+        (['d_x = 1', 'x = 2'], 'State variable x is also defined'),
+    ])
+    def test_errors(self, equations, message):
+        with pytest.raises(ValueError, match=message):
+            OdeSystem(make_equations(*equations))
+
+    def test_bound_variables(self):
+        # Bound variables must agree
+        t, s = sympy.symbols('t s')
+        equations = [sympy.Eq(sympy.Derivative(sympy.Function('x')(t), t), 1),
+                     sympy.Eq(sympy.Derivative(sympy.Function('y')(s), s), 1)]
+        with pytest.raises(ValueError, match='more than one bound variable'):
+            OdeSystem(equations)
+        second_order = sympy.Eq(sympy.Derivative(sympy.Function('x')(t), t, 2), 1)
+        with pytest.raises(ValueError, match='Only first order'):
+            OdeSystem([second_order])
+
+
+class TestSparseJacobian(object):
+
+    @staticmethod
+    def finite_differences(system, y, params, step=1e-6):
+        y = np.asarray(y, dtype=float)
+        columns = []
+        for j in range(len(y)):
+            h = step * max(1.0, abs(y[j]))
+            up, down = y.copy(), y.copy()
+            up[j] += h
+            down[j] -= h
+            columns.append((system.rhs(0.0, up, params) - system.rhs(0.0, down, params)) / (2 * h))
+        return np.stack(columns, axis=1)
+
+    def test_noble(self, noble_equations, noble_parameters):
+        system = OdeSystem(noble_equations)
+        jacobian = system.jacobian()
+        # dV/dt depends on all states, the gates only on V and themselves
+        assert jacobian.shape == (4, 4)
+        assert jacobian.rows == [0, 0, 0, 0, 1, 1, 2, 2, 3, 3]
+        assert jacobian.columns == [0, 1, 2, 3, 0, 1, 0, 2, 0, 3]
+        assert jacobian.indptr == [0, 4, 6, 8, 10]
+        assert jacobian.indices == jacobian.columns
+
+        params = system.parameter_array(noble_parameters)
+        matrix = jacobian.dense(0.0, NOBLE_STATES, params)
+        assert matrix == pytest.approx(self.finite_differences(system, NOBLE_STATES, params),
+                                       rel=1e-5, abs=1e-9)
+        # The evaluator only computes what the entries need
+        assert 'alpha_m' in jacobian.source and 'i_Leak' not in jacobian.source
+
+    def test_symbolic_entries(self):
+        system = OdeSystem(make_equations(
+            'd_x = a * y', 'a = k * x**2', 'd_y = y - y + c', 'd_z = exp(x) * z'))
+        jacobian = system.jacobian()
+        x, y, z, k = sympy.symbols('x y z k')
+        # d(dy/dt)/dy is exactly zero, so row 1 is empty
+        assert list(zip(jacobian.rows, jacobian.columns)) == [(0, 0), (0, 1), (2, 0), (2, 2)]
+        assert jacobian.indptr == [0, 2, 2, 4]
+        assert jacobian.entries == [2 * k * x * y, sympy.Symbol('a'), sympy.exp(x) * z,
+                                    sympy.exp(x)]
+
+    def test_batch(self, noble_equations, noble_parameters):
+        system = OdeSystem(noble_equations)
+        jacobian = system.jacobian()
+        cells = 20
+        y = np.tile(np.array(NOBLE_STATES)[:, np.newaxis], (1, cells))
+        y[0] = np.linspace(-90, 20, cells)
+        params = system.parameter_array(noble_parameters)[:, np.newaxis]
+        values = jacobian.evaluate(0.0, y, params)
+        assert values.shape == (jacobian.nnz, cells)
+        for i in (0, 7, 19):
+            assert values[:, i] == pytest.approx(jacobian.evaluate(0.0, y[:, i], params[:, 0]))
+        assert jacobian.dense(0.0, y, params).shape == (4, 4, cells)
+
+    def test_constant(self):
+        jacobian = OdeSystem(make_equations('d_x = 1', 'd_y = a')).jacobian()
+        assert jacobian.nnz == 0
+        assert jacobian.indptr == [0, 0, 0]
+        assert jacobian.evaluate(0.0, np.ones((2, 3)), [1.0]).shape == (0, 3)
+        assert (jacobian.dense(0.0, [1.0, 2.0], [1.0]) == 0).all()
@@ -0,0 +1,68 @@
+import io
+import json
+
+from conftest import NOBLE_MODEL, make_mathml
+
+from cellmlmanip import mathml2sympy
+
+
+class TestTranspileProfile(object):
+
+    def test_counts(self):
+        profile = mathml2sympy.TranspileProfile()
+        expressions = mathml2sympy.parse_string(make_mathml(
+            '<apply><eq/><ci>y</ci>'
+            '<apply><plus/><ci>x</ci><apply><rem/><ci>x</ci><cn>2</cn></apply></apply></apply>'
+            '<apply><eq/><ci>z</ci><piecewise>'
+            '<piece><ci>x</ci><apply><lt/><ci>x</ci><cn>0</cn><ci>y</ci></apply></piece>'
+            '<otherwise><cn>0</cn></otherwise></piecewise></apply>'), profile=profile)
+        assert len(expressions) == 2
+
+        assert profile.tags['ci'].calls == 7
+        assert profile.tags['cn'].calls == 3
+        assert profile.tags['apply'].calls == 5
+        assert profile.tags['piecewise'].calls == 1
+        assert {tag: stats.calls for tag, stats in profile.operators.items()} == \
+            {'eq': 2, 'plus': 1, 'rem': 1, 'lt': 1}
+        assert all(stats.time >= 0 for stats in profile.tags.values())
+        # Symbols are only counted the first time
+        assert profile.tags['ci'].nodes == 3
+        # SymPy builds Mod(1.0*x, 2.0), in which x was already counted
+        assert 1 <= profile.operators['rem'].nodes <= 4
+
+        block, = profile.blocks
+        assert block.expressions == 2
+        assert block.elements == sum(stats.calls for stats in profile.tags.values())
+        assert block.max_depth == 5
+        assert profile.depths == {4: 1, 5: 1}
+
+    def test_model(self):
+        profile = mathml2sympy.TranspileProfile()
+        blocks = list(mathml2sympy.parse_file(NOBLE_MODEL, profile=profile))
+        # Profiling does not change the result
+        assert blocks == list(mathml2sympy.parse_file(NOBLE_MODEL))
+        assert len(profile.blocks) == 7
+        assert sum(profile.depths.values()) == sum(block.expressions for block in profile.blocks)
+        assert profile.operators['diff'].calls == 4
+
+        data = json.loads(json.dumps(profile.to_dict()))
+        assert data['tags']['apply']['calls'] == profile.tags['apply'].calls
+        assert 'root' not in data['tags']
+        assert [block['expressions'] for block in data['blocks']] == [1, 2, 3, 5, 3, 3, 1]
+        output = io.StringIO()
+        profile.dump(output)
+        assert json.loads(output.getvalue()) == data
+
+        report = profile.report(limit=5).splitlines()
+        assert len(report) == 7
+        assert report[-1].startswith('7 blocks, 18 expressions')
+
+    def test_engines_and_evaluate(self):
+        profiles = []
+        for options in ({'engine': 'recursive'}, {'evaluate': False, 'canonicalize': True}):
+            profile = mathml2sympy.TranspileProfile()
+            list(mathml2sympy.parse_file(NOBLE_MODEL, profile=profile, **options))
+            profiles.append(profile)
+        assert profiles[0].depths == profiles[1].depths
+        assert {tag: stats.calls for tag, stats in profiles[0].tags.items()} == \
+            {tag: stats.calls for tag, stats in profiles[1].tags.items()}
@@ -0,0 +1,86 @@
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL
+
+from cellmlmanip import mathml2sympy
+
+
+LEAK_EQUATION = """<apply>
+               <times/>
+               <ci>g_L</ci>"""
+EXTRA_EQUATION = """<apply><eq/><ci>i_total</ci>
+            <apply><plus/><ci>i_Na</ci><ci>i_K</ci><ci>i_Leak</ci></apply></apply>
+      </math>
+   </component>
+   <group>"""
+
+
+@pytest.fixture(scope='module')
+def noble_xml():
+    with open(NOBLE_MODEL, 'rb') as f:
+        return f.read().decode('utf-8').replace('\r\n', '\n')
+
+
+class TestModelSession(object):
+    backend = 'minidom'
+
+    def test_first_load(self, noble_xml):
+        session = mathml2sympy.ModelSession(backend=self.backend)
+        changes = session.load(NOBLE_MODEL)
+        assert session.blocks == list(mathml2sympy.parse_file(NOBLE_MODEL))
+        assert len(changes.added) == len(session.equations) == 18
+        assert changes.removed == changes.changed == []
+        assert (changes.reused, changes.transpiled) == (0, len(session.blocks))
+
+    def test_unchanged(self, noble_xml):
+        session = mathml2sympy.ModelSession(backend=self.backend)
+        session.load_string(noble_xml)
+        before = session.equations
+        changes = session.load_string(noble_xml)
+        assert changes == mathml2sympy.ModelChanges([], [], [], len(session.blocks), 0)
+        # The very same objects are reused
+        assert all(a is b for a, b in zip(before, session.equations))
+
+    def test_reformatted(self, noble_xml):
+        session = mathml2sympy.ModelSession(backend=self.backend)
+        session.load_string(noble_xml)
+        # Whitespace, comments and units do not change the mathematics
+        reformatted = noble_xml.replace('\n', '\n  ').replace(
+            '<eq/>', '<eq/><!-- equation -->').replace('cellml:units="millivolt"', '')
+        changes = session.load_string(reformatted)
+        assert changes == mathml2sympy.ModelChanges([], [], [], len(session.blocks), 0)
+
+    def test_edits(self, noble_xml):
+        session = mathml2sympy.ModelSession(backend=self.backend)
+        session.load_string(noble_xml)
+        blocks = len(session.blocks)
+        i_leak, g_l = sympy.symbols('i_Leak g_L')
+
+        # Change the leakage current, and add an equation to its block
+        edited = noble_xml.replace(LEAK_EQUATION, LEAK_EQUATION + '<cn>2</cn>')
+        edited = edited.replace('      </math>\n   </component>\n   <group>', EXTRA_EQUATION)
+        changes = session.load_string(edited)
+        assert (changes.reused, changes.transpiled) == (blocks - 1, 1)
+        (old, new), = changes.changed
+        assert old.lhs == new.lhs == i_leak
+        assert new.rhs == 2.0 * old.rhs
+        assert [str(e) for e in changes.added] == ['Eq(i_total, i_K + i_Leak + i_Na)']
+        assert changes.removed == []
+        assert session.blocks[:-1] == list(mathml2sympy.parse_file(NOBLE_MODEL))[:-1]
+        # Newly transpiled expressions share symbols with the reused ones
+        g_l_object, = [s for s in session.equations[-2].rhs.free_symbols if s == g_l]
+        assert g_l_object is session.symbol_table.symbols['g_L']
+
+        # Remove the leakage component's equations altogether
+        start = edited.index('<math', edited.index('<component name="leakage_current">'))
+        end = edited.index('</math>', start) + len('</math>')
+        changes = session.load_string(edited[:start] + edited[end:])
+        assert (changes.reused, changes.transpiled) == (blocks - 1, 0)
+        assert sorted(str(e.lhs) for e in changes.removed) == ['i_Leak', 'i_total']
+        assert changes.added == changes.changed == []
+        assert len(session.blocks) == blocks - 1
+
+
+class TestModelSessionElementTree(TestModelSession):
+    backend = 'etree'
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from xml.etree import ElementTree
+
+import pytest
+from conftest import NOBLE_MODEL, SIMPLE_ODES
+
+from cellmlmanip import mathml2sympy
+
+
+def read_chunks(path, size):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestStreamParser(object):
+
+    @pytest.mark.parametrize('path', [NOBLE_MODEL, SIMPLE_ODES])
+    @pytest.mark.parametrize('size', [1, 97, 1 << 20])
+    def test_same_as_parse_file(self, path, size):
+        parser = mathml2sympy.StreamParser()
+        blocks = []
+        for chunk in read_chunks(path, size):
+            parser.feed(chunk)
+            blocks.extend(parser.read_blocks())
+        parser.close()
+        blocks.extend(parser.read_blocks())
+        assert blocks == list(mathml2sympy.parse_file(path))
+
+    def test_blocks_as_soon_as_complete(self):
+        with open(NOBLE_MODEL, 'rb') as f:
+            data = f.read()
+        first_math_end = data.index(b'</math>') + len(b'</math>')
+        parser = mathml2sympy.StreamParser()
+        parser.feed(data[:first_math_end - 1])
+        assert list(parser.read_blocks()) == []
+        parser.feed(data[first_math_end - 1:first_math_end])
+        (component_name, expressions), = parser.read_blocks()
+        assert component_name == 'membrane'
+        assert len(expressions) == 1
+        # All blocks share a symbol table
+        parser.feed(data[first_math_end:])
+        parser.close()
+        blocks = list(parser.read_blocks())
+        assert len(blocks) == 6
+        symbol_table = parser.options['symbol_table']
+        assert {s.name for _, block in blocks for e in block for s in e.free_symbols} <= \
+            set(symbol_table.symbols)
+
+    def test_options(self):
+        index = mathml2sympy.EquationIndex()
+        parser = mathml2sympy.StreamParser(evaluate=False, index=index)
+        for chunk in read_chunks(NOBLE_MODEL, 4096):
+            parser.feed(chunk)
+            list(parser.read_blocks())
+        assert len(index) == 18
+
+    def test_incomplete(self):
+        parser = mathml2sympy.StreamParser()
+        parser.feed(read_chunks(NOBLE_MODEL, 10000)[0])
+        list(parser.read_blocks())
+        with pytest.raises(ElementTree.ParseError):
+            parser.close()
+
+
+class TestParseAsync(object):
+
+    def test_parse_async(self):
+        async def receive(chunks):
+            for chunk in chunks:
+                await asyncio.sleep(0)
+                yield chunk
+
+        async def collect(**options):
+            return [block async for block in mathml2sympy.parse_async(
+                receive(read_chunks(NOBLE_MODEL, 500)), **options)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(collect()) == list(mathml2sympy.parse_file(NOBLE_MODEL))
+            # Blocks are transpiled outside the event loop's thread
+            threads = set()
+            loop.run_until_complete(collect(
+                trace=lambda *args: threads.add(threading.current_thread())))
+            assert threads and threading.current_thread() not in threads
+        finally:
+            loop.close()
@@ -0,0 +1,98 @@
+
+import sympy
+from conftest import NOBLE_MODEL, make_mathml
+
+from cellmlmanip import mathml2sympy
+
+
+class TestSymbolTable(object):
+
+    def test_symbols_are_interned(self):
+        table = mathml2sympy.SymbolTable()
+        expressions = mathml2sympy.parse_string(
+            make_mathml('<ci>x</ci><ci>x</ci><cn>2</cn><cn>2.0</cn>'), symbol_table=table)
+        assert expressions[0] is expressions[1]
+        assert expressions[2] is expressions[3]
+        assert table.symbols == {'x': sympy.Symbol('x')}
+        assert table.numbers == {2.0: sympy.Float(2.0)}
+
+    def test_functions_are_interned(self):
+        table = mathml2sympy.SymbolTable()
+        diff = '<apply><diff/><bvar><ci>time</ci></bvar><ci>V</ci></apply>'
+        mathml2sympy.parse_string(make_mathml(diff + diff), symbol_table=table)
+        assert list(table.functions) == ['V']
+        assert sorted(table.symbols) == ['V', 'time']
+
+    def test_shared_between_parses(self):
+        table = mathml2sympy.SymbolTable()
+        first = mathml2sympy.parse_string(make_mathml('<ci>x</ci>'), symbol_table=table)
+        second = mathml2sympy.parse_string(make_mathml('<ci>x</ci>'), symbol_table=table,
+                                           backend='etree')
+        assert first[0] is second[0]
+
+    def test_nan_is_not_stored(self):
+        table = mathml2sympy.SymbolTable()
+        assert table.number(float('nan')) is sympy.nan
+        assert table.numbers == {}
+
+    def test_model_inventory(self):
+        table = mathml2sympy.SymbolTable()
+        blocks = list(mathml2sympy.parse_file(NOBLE_MODEL, symbol_table=table))
+        free_symbols = set()
+        for _, expressions in blocks:
+            for expression in expressions:
+                free_symbols |= expression.free_symbols
+        assert free_symbols <= set(table.symbols.values())
+        assert set(table.functions) == {'V', 'm', 'h', 'n'}
+
+
+class TestSubexpressionTable(object):
+    gate = '<apply><exp/><apply><divide/><apply><plus/><ci>V</ci><ci>a</ci></apply>' \
+           '<ci>b</ci></apply></apply>'
+
+    def test_shared_subexpressions(self):
+        table = mathml2sympy.SubexpressionTable()
+        xml = make_mathml(
+            '<apply><eq/><ci>alpha</ci><apply><times/><cn>2</cn>%s</apply></apply>'
+            '<apply><eq/><ci>beta</ci><apply><times/><cn>3</cn>%s</apply></apply>'
+            % (self.gate, self.gate))
+        alpha, beta = mathml2sympy.parse_string(xml, subexpressions=table)
+
+        V, a, b = sympy.symbols('V a b')
+        gate = sympy.exp((V + a) / b)
+        assert alpha == sympy.Eq(sympy.Symbol('alpha'), 2.0 * gate)
+        assert beta == sympy.Eq(sympy.Symbol('beta'), 3.0 * gate)
+        assert alpha.rhs.args[1] is beta.rhs.args[1]
+
+        # plus, divide and exp are shared by the second equation; times and eq are not
+        assert table.stats == mathml2sympy.SharingStats(lookups=10, shared=3, unique=7)
+
+    def test_same_result_as_unshared(self):
+        table = mathml2sympy.SubexpressionTable()
+        assert list(mathml2sympy.parse_file(NOBLE_MODEL, subexpressions=table)) == \
+            list(mathml2sympy.parse_file(NOBLE_MODEL))
+        assert table.stats.shared > 0
+
+    def test_evaluation_modes(self):
+        table = mathml2sympy.SubexpressionTable()
+        symbol_table = mathml2sympy.SymbolTable()
+        xml = make_mathml('<apply><plus/><ci>x</ci><ci>x</ci></apply>')
+        x = sympy.Symbol('x')
+        unevaluated, = mathml2sympy.parse_string(xml, subexpressions=table,
+                                                 symbol_table=symbol_table, evaluate=False)
+        evaluated, = mathml2sympy.parse_string(xml, subexpressions=table,
+                                               symbol_table=symbol_table)
+        assert unevaluated.args == (x, x)
+        assert evaluated == 2 * x
+        assert table.stats.shared == 0
+
+    def test_derivative_with_degree(self):
+        table = mathml2sympy.SubexpressionTable()
+        diff = '<apply><diff/><bvar><ci>t</ci><degree><cn>2</cn></degree></bvar><ci>x</ci></apply>'
+        first, second = mathml2sympy.parse_string(make_mathml(diff + diff), subexpressions=table)
+        assert first == second
+
+    def test_single_child_apply(self):
+        table = mathml2sympy.SubexpressionTable()
+        xml = make_mathml('<apply><ci>x</ci></apply><apply><ci>y</ci></apply>')
+        assert mathml2sympy.parse_string(xml, subexpressions=table) == list(sympy.symbols('x y'))
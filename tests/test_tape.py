@@ -0,0 +1,151 @@
+import io
+
+import numpy as np
+import pytest
+import sympy
+from conftest import NOBLE_MODEL, SIMPLE_ODES, make_mathml
+
+from cellmlmanip import mathml2sympy
+from cellmlmanip.mathml2sympy import tape
+
+
+# Values of the variables used in the expressions below
+VALUES = {'x': 0.3, 'y': 0.7, 'z': 2.5, 'n': 3.0}
+
+
+def apply(operator, *operands):
+    return '<apply><%s/>%s</apply>' % (operator, ''.join(operands))
+
+
+X, Y, Z, N = ('<ci>%s</ci>' % name for name in 'xyzn')
+UNARY = ['abs', 'arccos', 'arcsin', 'arctan', 'arcsinh', 'arctanh', 'ceiling', 'cos', 'cosh', 'cot',
+         'coth', 'csc', 'csch', 'exp', 'floor', 'ln', 'sec', 'sech', 'sin', 'sinh', 'tan', 'tanh']
+RECIPROCAL_ARGUMENT = ['arccosh', 'arccot', 'arccoth', 'arccsc', 'arcsec', 'arccsch']
+EXPRESSIONS = (
+    [apply(operator, X) for operator in UNARY] +
+    [apply(operator, Z) for operator in RECIPROCAL_ARGUMENT] +
+    [apply('arcsech', X)] +
+    [apply(operator, X, Y, Z) for operator in ('plus', 'times', 'max', 'min')] +
+    [apply(operator, X, Y) for operator in ('minus', 'divide', 'power', 'rem')] +
+    [apply('minus', X),
+     apply('root', X), apply('root', '<degree>%s</degree>' % N, Z),
+     apply('log', Z), apply('log', '<logbase>%s</logbase>' % N, Z),
+     '<pi/>', '<exponentiale/>', '<cn type="e-notation">1.5<sep/>3</cn>',
+     '<piecewise><piece>%s%s</piece><piece>%s%s</piece><otherwise>%s</otherwise></piecewise>'
+     % (X, apply('gt', X, Y), Y, apply('lt', X, Y, Z), Z),
+     '<piecewise><piece>%s%s</piece><otherwise>%s</otherwise></piecewise>'
+     % (X, apply('and', apply('geq', X, Y), apply('not', '<false/>')), Y)] +
+    [apply('times', '<cn>2</cn>',
+           '<piecewise><piece><cn>1</cn>%s</piece><otherwise><cn>0</cn></otherwise></piecewise>'
+           % relation)
+     for relation in (apply('eq', X, X, X), apply('neq', X, Y), apply('leq', X, Y, Y),
+                      apply('or', apply('gt', X, Y), '<true/>'),
+                      apply('xor', apply('gt', X, Y), apply('lt', X, Y)))]
+)
+
+
+class TestTape(object):
+
+    @pytest.mark.parametrize('content_xml', EXPRESSIONS)
+    def test_matches_sympy(self, content_xml):
+        expression, = mathml2sympy.parse_string(make_mathml(content_xml))
+        expected = float(expression.subs({sympy.Symbol(k): v for k, v in VALUES.items()}))
+
+        compiled = tape.compile_string(make_mathml(content_xml))
+        result, = compiled.evaluate(VALUES).values()
+        assert np.isclose(result, expected)
+
+    def test_vectorized(self):
+        x = np.linspace(-1, 1, 101)
+        xml = make_mathml('<apply><eq/><ci>f</ci>%s</apply>' % apply('plus', apply('exp', X), Y))
+        outputs = tape.compile_string(xml).evaluate({'x': x, 'y': 2.0})
+        assert list(outputs) == ['f']
+        assert np.allclose(outputs['f'], np.exp(x) + 2.0)
+
+    def test_piecewise_without_otherwise(self):
+        xml = make_mathml('<piecewise><piece>%s%s</piece></piecewise>' % (X, apply('gt', X, Y)))
+        result, = tape.compile_string(xml).evaluate({'x': np.array([0.0, 1.0]), 'y': 0.5}).values()
+        assert np.isnan(result[0])
+        assert result[1] == 1.0
+
+    def test_chained_equations(self):
+        xml = make_mathml(
+            '<apply><eq/><ci>a</ci><apply><times/><cn>2</cn><ci>b</ci></apply></apply>'
+            '<apply><eq/><ci>c</ci><apply><plus/><ci>a</ci><cn>1</cn></apply></apply>')
+        compiled = tape.compile_string(xml, backend='etree')
+        assert compiled.inputs == ['b']
+        assert compiled.evaluate({'b': 3.0}) == {'a': 6.0, 'c': 7.0}
+
+    def test_equations_out_of_order(self):
+        xml = make_mathml(
+            '<apply><eq/><ci>c</ci><apply><plus/><ci>a</ci><cn>1</cn></apply></apply>'
+            '<apply><eq/><ci>a</ci><apply><times/><cn>2</cn><ci>b</ci></apply></apply>')
+        compiled = tape.compile_string(xml)
+        assert compiled.inputs == ['b']
+        assert compiled.evaluate({'b': 3.0}) == {'c': 7.0, 'a': 6.0}
+
+    def test_cyclic_equations(self):
+        xml = make_mathml(
+            '<apply><eq/><ci>a</ci><apply><plus/><ci>b</ci><cn>1</cn></apply></apply>'
+            '<apply><eq/><ci>b</ci><apply><times/><cn>2</cn><ci>a</ci></apply></apply>')
+        with pytest.raises(ValueError, match='Cyclic definition of'):
+            tape.compile_string(xml)
+
+    def test_derivatives(self):
+        compiled = tape.compile_file(SIMPLE_ODES)
+        assert 'd(sv1)/d(time)' in compiled.output_names
+        assert 'd(x)/d(time)' in compiled.output_names
+        # sv1_rate = d(sv1)/d(time) reads the stored derivative
+        assert 'd(sv1)/d(time)' not in compiled.inputs
+        outputs = compiled.evaluate({'x': 1.0, 'y': 2.0, 'a': 5.0, 'sv1': 3.0})
+        assert outputs['d(x)/d(time)'] == -2.0
+        assert outputs['local_complex_maths'] == pytest.approx(2.0 * 8 / 3 + np.exp(1.0))
+
+    def test_noble_model(self, noble_parameters):
+        compiled = tape.compile_file(NOBLE_MODEL, backend='etree')
+        index = mathml2sympy.EquationIndex()
+        for _ in mathml2sympy.parse_file(NOBLE_MODEL, index=index):
+            pass
+        equations = index.evaluation_order()
+
+        # Only the states and parameters are inputs: the tape computes everything else itself,
+        # although e.g. i_Na is used before the equation defining it in the document
+        states = {'V': 0.0, 'm': 0.05, 'h': 0.6, 'n': 0.3}
+        assert sorted(compiled.inputs) == sorted(list(states) + list(noble_parameters))
+
+        # Evaluate the SymPy equations in dependency order at a single point
+        V = np.linspace(-100, 40, 11)
+        inputs = dict(noble_parameters, **states)
+        inputs['V'] = V
+        outputs = compiled.evaluate(inputs)
+        for i, voltage in enumerate(V):
+            known = {sympy.Symbol(name): value for name, value in inputs.items()}
+            known[sympy.Symbol('V')] = voltage
+            for equation in equations:
+                value = float(equation.rhs.subs(known))
+                if isinstance(equation.lhs, sympy.Symbol):
+                    name = equation.lhs.name
+                    known[equation.lhs] = value
+                else:
+                    name = tape.derivative_name(equation.lhs.args[0].func.__name__, 'time')
+                assert np.isclose(np.broadcast_to(outputs[name], V.shape)[i], value)
+
+    def test_save_and_load(self):
+        compiled = tape.compile_file(NOBLE_MODEL)
+        buffer = io.BytesIO()
+        compiled.save(buffer)
+        buffer.seek(0)
+        loaded = tape.Tape.load(buffer)
+
+        assert loaded.inputs == compiled.inputs
+        assert loaded.output_names == compiled.output_names
+        assert np.array_equal(loaded.opcodes, compiled.opcodes)
+        inputs = {name: np.linspace(0.1, 1, 5) for name in compiled.inputs}
+        for expected, result in zip(compiled.evaluate(inputs).values(),
+                                    loaded.evaluate(inputs).values()):
+            assert np.allclose(expected, result)
+
+    def test_unused_instructions_are_dropped(self):
+        xml = make_mathml('<apply><eq/><ci>a</ci><ci>b</ci></apply>')
+        compiled = tape.compile_string(xml)
+        assert [tape.OPCODES[opcode] for opcode in compiled.opcodes] == ['load', 'store']
@@ -0,0 +1,94 @@
+import io
+
+import pytest
+import sympy
+from conftest import NOBLE_MODEL, SIMPLE_ODES, make_mathml
+
+from cellmlmanip import mathml2sympy
+
+
+# Content MathML covering every construct the writer produces
+EXPRESSIONS = [
+    '<apply><plus/><ci>x</ci><ci>y</ci><ci>z</ci></apply>',
+    '<apply><minus/><ci>x</ci><ci>y</ci></apply>',
+    '<apply><minus/><ci>x</ci></apply>',
+    '<apply><divide/><ci>a</ci><apply><times/><ci>b</ci><cn>2.5</cn></apply></apply>',
+    '<apply><divide/><cn>1</cn><ci>b</ci></apply>',
+    '<apply><power/><ci>x</ci><cn>3</cn></apply>',
+    '<apply><root/><ci>x</ci></apply>',
+    '<apply><root/><degree><cn>3</cn></degree><ci>x</ci></apply>',
+    '<apply><ln/><ci>x</ci></apply>',
+    '<apply><log/><ci>x</ci></apply>',
+    '<apply><log/><logbase><ci>b</ci></logbase><ci>x</ci></apply>',
+    '<apply><exp/><apply><times/><cn type="e-notation">-1.5<sep/>-7</cn><ci>V</ci></apply></apply>',
+    '<apply><eq/><apply><diff/><bvar><ci>t</ci></bvar><ci>V</ci></apply><ci>i</ci></apply>',
+    '<apply><eq/><apply><diff/><bvar><ci>t</ci><degree><cn>2</cn></degree></bvar><ci>x</ci>'
+    '</apply><apply><minus/><ci>x</ci></apply></apply>',
+    '<piecewise><piece><ci>a</ci><apply><lt/><ci>V</ci><cn>-40</cn></apply></piece>'
+    '<piece><cn>0</cn><apply><and/><apply><geq/><ci>V</ci><cn>1e3</cn></apply>'
+    '<apply><neq/><ci>x</ci><ci>y</ci></apply></apply></piece>'
+    '<otherwise><apply><abs/><ci>b</ci></apply></otherwise></piecewise>',
+    '<apply><leq/><ci>a</ci><ci>b</ci><ci>c</ci></apply>',
+    '<apply><or/><apply><not/><apply><gt/><ci>a</ci><ci>b</ci></apply></apply>'
+    '<apply><xor/><apply><eq/><ci>a</ci><ci>b</ci></apply><true/></apply></apply>',
+    '<apply><rem/><ci>a</ci><apply><max/><ci>b</ci><pi/></apply></apply>',
+    '<apply><times/><apply><floor/><ci>a</ci></apply><apply><ceiling/><ci>b</ci></apply>'
+    '<apply><min/><ci>c</ci><exponentiale/></apply></apply>',
+    '<apply><plus/><apply><sin/><ci>x</ci></apply><apply><arctanh/><ci>x</ci></apply>'
+    '<apply><sech/><ci>x</ci></apply></apply>',
+    '<cn type="rational">-2<sep/>3</cn>',
+    '<infinity/>',
+    '<ci>a&amp;b</ci>',
+]
+
+
+class TestWriter(object):
+    options = {}
+
+    def round_trip(self, expressions):
+        again = mathml2sympy.parse_string(mathml2sympy.to_mathml(expressions), **self.options)
+        assert again == expressions
+
+    @pytest.mark.parametrize('content_xml', EXPRESSIONS)
+    def test_round_trip(self, content_xml):
+        self.round_trip(mathml2sympy.parse_string(make_mathml(content_xml), **self.options))
+
+    @pytest.mark.parametrize('path', [NOBLE_MODEL, SIMPLE_ODES])
+    def test_models(self, path):
+        for _, expressions in mathml2sympy.parse_file(path, **self.options):
+            self.round_trip(expressions)
+
+    def test_write_to_file(self, monkeypatch):
+        _, expressions = list(mathml2sympy.parse_file(NOBLE_MODEL, **self.options))[2]
+        # Flush the buffer many times while writing
+        monkeypatch.setattr(mathml2sympy.writer, 'BUFFER_SIZE', 3)
+        output = io.StringIO()
+        mathml2sympy.write_mathml(expressions, output)
+        assert output.getvalue() == mathml2sympy.to_mathml(expressions)
+        assert mathml2sympy.parse_string(output.getvalue(), **self.options) == expressions
+
+
+class TestWriterUnevaluated(TestWriter):
+    options = {'evaluate': False}
+
+
+class TestOutput(object):
+
+    def test_numbers(self):
+        x = sympy.Symbol('x')
+        assert mathml2sympy.to_mathml([sympy.Float(2.5e-05) * x - sympy.Rational(1, 2)]) == \
+            make_mathml('<apply><plus/><cn type="rational">-1<sep/>2</cn><apply><times/>'
+                        '<cn type="e-notation">2.5<sep/>-5</cn><ci>x</ci></apply></apply>')
+
+    def test_subtraction_and_division(self):
+        x, y = sympy.symbols('x y')
+        with sympy.evaluate(False):
+            expression = (x - y) / x
+        assert mathml2sympy.to_mathml([expression]) == make_mathml(
+            '<apply><divide/><apply><minus/><ci>x</ci><ci>y</ci></apply><ci>x</ci></apply>')
+
+    def test_unsupported(self):
+        with pytest.raises(NotImplementedError, match='No content MathML for'):
+            mathml2sympy.to_mathml([sympy.Function('f')(sympy.Symbol('x'))])
+        with pytest.raises(NotImplementedError, match='No content MathML for'):
+            mathml2sympy.to_mathml([sympy.gamma(sympy.Symbol('x'))])